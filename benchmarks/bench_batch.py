@@ -0,0 +1,76 @@
+"""
+Benchmarks of the batched wrappers built with ``--batch``.
+
+The routine is a C function (``intent(c)``) that adds two small vectors.
+The same slices are passed either by a Python loop of calls of the
+routine or by a single call of ``routine.batch``, which loops over the
+slices in C. Building the extension module needs a C compiler.
+
+Running this file directly prints the time per slice of each benchmark::
+
+    python benchmarks/bench_batch.py
+"""
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(__file__))
+from bench_call import _run, build_extension  # noqa: E402
+
+SIZES = [1, 6, 100]
+
+signature = """\
+python module {name}
+    interface
+        subroutine add(x, y, z, n)
+            intent(c) add
+            double precision dimension(n), intent(c,in) :: x, y
+            double precision dimension(n), intent(c,out) :: z
+            integer, intent(c,hide), depend(x) :: n = len(x)
+        end subroutine add
+    end interface
+end python module {name}
+"""
+
+source = """\
+void add(double *x, double *y, double *z, int n) {
+    int i;
+    for (i = 0; i < n; i++)
+        z[i] = x[i] + y[i];
+}
+"""
+
+_modules = {}
+
+
+def build_module():
+    """Build and import the extension module with --batch."""
+    if 'batchbench' not in _modules:
+        _modules['batchbench'] = build_extension(
+            'batchbench', signature.format(name='batchbench'), source,
+            ['--batch'])
+    return _modules['batchbench']
+
+
+class BatchedCalls:
+    params = (SIZES,)
+    param_names = ['n']
+    ncalls = 10000
+
+    def setup(self, n):
+        self.add = build_module().add
+        self.x = np.ones((self.ncalls, n))
+        self.y = np.ones((self.ncalls, n))
+
+    def time_loop(self, n):
+        add = self.add
+        for x, y in zip(self.x, self.y):
+            add(x, y)
+
+    def time_batch(self, n):
+        self.add.batch(self.x, self.y)
+
+
+if __name__ == '__main__':
+    _run(BatchedCalls)
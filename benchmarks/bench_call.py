@@ -0,0 +1,149 @@
+"""
+Benchmarks of the overhead of calling the generated wrappers.
+
+The wrapped routines are C functions (``intent(c)``) that do nothing, so
+that the time of a call is the time spent in the wrapper: parsing the
+arguments, converting them and building the return value. Building the
+extension module needs a C compiler.
+
+The classes follow the asv conventions (``setup`` plus ``time_*``
+methods); running this file directly prints the time per call of each
+benchmark instead::
+
+    python benchmarks/bench_call.py
+"""
+import importlib
+import os
+import sys
+import tempfile
+import time
+
+from f2py_skel.frontend import f2py2e
+
+NARGS = [0, 3, 10]
+
+
+def routines_signature(name, nargs_list):
+    """Return a signature file of C routines of nargs scalar arguments."""
+    out = [f"python module {name}", "    interface"]
+    for nargs in nargs_list:
+        args = [f"a{i}" for i in range(nargs)]
+        out.append(f"        subroutine s{nargs}({', '.join(args)})")
+        out.append(f"            intent(c) s{nargs}")
+        for i, a in enumerate(args):
+            ctype = "double precision" if i % 2 else "integer"
+            out.append(f"            {ctype}, intent(c) :: {a}")
+        out.append(f"        end subroutine s{nargs}")
+    out.append("    end interface")
+    out.append(f"end python module {name}")
+    return "\n".join(out) + "\n"
+
+
+def routines_source(nargs_list):
+    """Return the C source of the routines of routines_signature."""
+    out = []
+    for nargs in nargs_list:
+        args = [("double a%d" if i % 2 else "int a%d") % i
+                for i in range(nargs)]
+        out.append(f"void s{nargs}({', '.join(args) or 'void'}) {{}}")
+    return "\n".join(out) + "\n"
+
+
+def build_extension(name, signature, source, f2py_args=(), define_macros=()):
+    """Build and import the extension module name of a signature file and
+    the C source of its routines."""
+    from setuptools import Distribution, Extension
+    import numpy
+
+    tmpdir = tempfile.mkdtemp(prefix=f'f2py_bench_{name}_')
+    with open(os.path.join(tmpdir, 'routines.pyf'), 'w') as f:
+        f.write(signature)
+    with open(os.path.join(tmpdir, 'routines.c'), 'w') as f:
+        f.write(source)
+    f2py2e.run_main([os.path.join(tmpdir, 'routines.pyf'), '--build-dir',
+                     tmpdir, '--quiet', '--no-sig-cache', *f2py_args])
+    csrcs = os.path.join(os.path.dirname(os.path.dirname(f2py2e.__file__)),
+                         'csrcs')
+    ext = Extension(name, [os.path.join(tmpdir, f'{name}module.c'),
+                           os.path.join(tmpdir, 'routines.c'),
+                           os.path.join(csrcs, 'fortranobject.c')],
+                    include_dirs=[csrcs, numpy.get_include()],
+                    define_macros=list(define_macros))
+    dist = Distribution({'name': name, 'ext_modules': [ext]})
+    cmd = dist.get_command_obj('build_ext')
+    cmd.build_lib = cmd.build_temp = tmpdir
+    cmd.ensure_finalized()
+    cmd.run()
+    sys.path.insert(0, tmpdir)
+    try:
+        return importlib.import_module(name)
+    finally:
+        sys.path.remove(tmpdir)
+
+
+_modules = {}
+
+
+def build_module(nargs_list=tuple(NARGS)):
+    """Build and import the extension module of the routines."""
+    if nargs_list not in _modules:
+        _modules[nargs_list] = build_extension(
+            'callbench', routines_signature('callbench', nargs_list),
+            routines_source(nargs_list))
+    return _modules[nargs_list]
+
+
+class CallOverhead:
+    params = (NARGS,)
+    param_names = ['nargs']
+    ncalls = 100000
+
+    def setup(self, nargs):
+        self.routine = getattr(build_module(), f's{nargs}')
+        args = [repr(float(i) if i % 2 else i) for i in range(nargs)]
+        # The calls are compiled as they are written in Python code
+        self.call_positional = self.loop(', '.join(args))
+        self.call_keywords = self.loop(
+            ', '.join(f'a{i}={a}' for i, a in enumerate(args)))
+        self.call_dict = self.loop(
+            '**{%s}' % ', '.join(f"'a{i}': {a}" for i, a in enumerate(args)))
+
+    def loop(self, args):
+        code = (f"def call(routine, ncalls):\n"
+                f"    for i in range(ncalls):\n"
+                f"        routine({args})\n")
+        namespace = {}
+        exec(code, namespace)
+        return namespace['call']
+
+    def time_positional(self, nargs):
+        self.call_positional(self.routine, self.ncalls)
+
+    def time_keywords(self, nargs):
+        self.call_keywords(self.routine, self.ncalls)
+
+    def time_dict(self, nargs):
+        self.call_dict(self.routine, self.ncalls)
+
+
+def _run(cls):
+    import itertools
+    for args in itertools.product(*cls.params):
+        bench = cls()
+        bench.setup(*args)
+        for name in sorted(dir(bench)):
+            if not name.startswith('time_'):
+                continue
+            t = min(_timeit(getattr(bench, name), args) for i in range(5))
+            print(f'{cls.__name__}.{name}{args}: '
+                  f'{t / bench.ncalls * 1e9:.0f} ns/call')
+
+
+def _timeit(func, args):
+    t = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - t
+
+
+if __name__ == '__main__':
+    _run(CallOverhead)
@@ -0,0 +1,154 @@
+"""
+Benchmarks of the overhead of calling Python call-back functions.
+
+The routines are C functions (``intent(c)``) that call a call-back
+function ``ncalls`` times, either with a scalar argument, as the
+right-hand side of an ODE integrator, possibly with extra arguments, or
+with an array argument, which is passed to the call-back function as a
+view of the C array. The call-back functions do nothing, so that the
+time of a call is the time spent in the call-back trampoline. Building
+the extension module needs a C compiler.
+
+Each call of a routine with a call-back argument also swaps the active
+call-back of the thread twice. Its cost is measured with a routine that
+does not call the call-back, using the thread-local storage of the
+compiler or, with ``F2PY_USE_PYTHON_TLS``, the thread state dictionary
+of Python.
+
+Running this file directly prints the time per call-back of each
+benchmark::
+
+    python benchmarks/bench_callback.py
+"""
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(__file__))
+from bench_call import _run, build_extension  # noqa: E402
+
+NEXTRA = [0, 2]
+SIZES = [1, 1000]
+TLS = ['native', 'python']
+
+signature = """\
+python module {name}__user__routines
+    interface
+        function fs(t)
+            double precision :: t, fs
+        end function fs
+        subroutine fa(x, n)
+            double precision dimension(n), intent(in) :: x
+            integer, intent(hide) :: n
+        end subroutine fa
+    end interface
+end python module {name}__user__routines
+python module {name}
+    interface
+        subroutine scalar_calls(fs, ncalls)
+            intent(c) scalar_calls
+            use {name}__user__routines
+            external fs
+            integer, intent(c) :: ncalls
+        end subroutine scalar_calls
+        subroutine array_calls(fa, x, n, ncalls)
+            intent(c) array_calls
+            use {name}__user__routines
+            external fa
+            double precision dimension(n), intent(c,in) :: x
+            integer, intent(c,hide), depend(x) :: n = len(x)
+            integer, intent(c) :: ncalls
+        end subroutine array_calls
+        subroutine no_calls(fs)
+            intent(c) no_calls
+            use {name}__user__routines
+            external fs
+        end subroutine no_calls
+    end interface
+end python module {name}
+"""
+
+source = """\
+void scalar_calls(double (*fs)(double *), int ncalls) {
+    int i;
+    double t = 0.0;
+    for (i = 0; i < ncalls; i++)
+        t += fs(&t);
+}
+void array_calls(void (*fa)(double *, int *), double *x, int n,
+                 int ncalls) {
+    int i;
+    for (i = 0; i < ncalls; i++)
+        fa(x, &n);
+}
+void no_calls(double (*fs)(double *)) {}
+"""
+
+_modules = {}
+
+
+def build_module(tls='native'):
+    """Build and import the extension module, keeping the active call-backs
+    in the thread-local storage tls."""
+    name = 'cbbench' if tls == 'native' else f'cbbench_{tls}'
+    if name not in _modules:
+        _modules[name] = build_extension(
+            name, signature.format(name=name), source,
+            define_macros=[('F2PY_USE_PYTHON_TLS', None)]
+            if tls == 'python' else [])
+    return _modules[name]
+
+
+def fs(t, a=0.0, b=0.0):
+    return 1.0
+
+
+def fa(x):
+    pass
+
+
+class ScalarCallback:
+    params = (NEXTRA,)
+    param_names = ['nextra']
+    ncalls = 10000
+
+    def setup(self, nextra):
+        self.scalar_calls = build_module().scalar_calls
+        self.extra = (0.0,) * nextra
+
+    def time_callback(self, nextra):
+        self.scalar_calls(fs, self.ncalls, fs_extra_args=self.extra)
+
+
+class ArrayCallback:
+    params = (SIZES,)
+    param_names = ['n']
+    ncalls = 10000
+
+    def setup(self, n):
+        self.array_calls = build_module().array_calls
+        self.x = np.ones(n)
+
+    def time_callback(self, n):
+        self.array_calls(fa, self.x, self.ncalls)
+
+
+class CallbackSwap:
+    params = (TLS,)
+    param_names = ['tls']
+    ncalls = 10000
+
+    def setup(self, tls):
+        self.no_calls = build_module(tls).no_calls
+
+    def time_swap(self, tls):
+        no_calls = self.no_calls
+        for i in range(self.ncalls):
+            no_calls(fs)
+
+
+if __name__ == '__main__':
+    _run(ScalarCallback)
+    _run(ArrayCallback)
+    _run(CallbackSwap)
@@ -0,0 +1,234 @@
+"""
+Benchmarks of the crackfortran front end.
+
+The classes follow the asv conventions (``setup`` plus ``time_*``
+methods); running this file directly prints the throughput of each
+benchmark instead::
+
+    python benchmarks/bench_crackfortran.py
+"""
+import os
+import tempfile
+import time
+
+from f2py_skel.frontend import crackfortran
+
+
+def free_form_source(nlines):
+    """Return synthetic free form Fortran with about nlines lines."""
+    out = ["module big", "  implicit none", "contains"]
+    i = 0
+    while len(out) < nlines:
+        i += 1
+        out.append(f"  subroutine s{i}(a, b, &")
+        out.append("       n) ! comment with 'quote'")
+        out.append("    integer, intent(in) :: n")
+        out.append("    real(8), intent(inout) :: a(n), b(n)")
+        for k in range(40):
+            out.append(f"    a({k}) = a({k}) + b({k}) * {k}.0d0 ! update")
+            if k % 5 == 0:
+                out.append(f"    b({k}) = 'str!ing' // &")
+                out.append("       & 'x'")
+            if k % 9 == 0:
+                out.append("! full comment line")
+        out.append(f"  end subroutine s{i}")
+    out.append("end module big")
+    return "\n".join(out) + "\n"
+
+
+def fixed_form_source(nlines):
+    """Return synthetic fixed form Fortran 77 with about nlines lines."""
+    out = []
+    i = 0
+    while len(out) < nlines:
+        i += 1
+        out.append(f"      subroutine t{i}(a,b,")
+        out.append("     &  n)")
+        out.append("      integer n")
+        out.append("      double precision a(n), b(n)")
+        for k in range(40):
+            out.append(f"      a({k}) = a({k}) + b({k})*2.0d0")
+            if k % 9 == 0:
+                out.append("c     comment line")
+        out.append("      end")
+    return "\n".join(out) + "\n"
+
+
+def solver_source(nroutines, nbody):
+    """Return free form Fortran of nroutines routines with long bodies."""
+    out = ["module solvers", "contains"]
+    for i in range(nroutines):
+        out.append(f"  subroutine s{i}(a, b, n)")
+        out.append("    integer, intent(in) :: n")
+        out.append("    real(8), intent(inout) :: a(n), b(n)")
+        out.append("    integer :: k")
+        for k in range(nbody // 6):
+            out.append("    do k = 1, n")
+            out.append(f"      a(k) = a(k) + b(k) * {k}.0d0 ! update")
+            out.append("    end do")
+            out.append("    if (a(1) > 0) then")
+            out.append("      b(1) = -b(1)")
+            out.append("    end if")
+        out.append(f"  end subroutine s{i}")
+    out.append("end module solvers")
+    return "\n".join(out) + "\n"
+
+
+def parameters_source(nparams, nroutines):
+    """Return a module of nparams parameters used by nroutines routines."""
+    out = ["module consts",
+           "  integer, parameter :: dp = selected_real_kind(15)"]
+    for i in range(nparams):
+        out.append(f"  integer, parameter :: n{i} = {i} * 2 + 1")
+        out.append(f"  real(dp), parameter :: r{i} = {i}.5_dp / 2")
+    out.append("end module consts")
+    for i in range(nroutines):
+        out.append(f"subroutine s{i}(a)")
+        out.append("  use consts")
+        out.append(f"  real(dp), intent(inout) :: a(n{i})")
+        out.append(f"end subroutine s{i}")
+    return "\n".join(out) + "\n"
+
+
+class ReadFortranCode:
+    params = (['free', 'fixed'], [10000, 200000])
+    param_names = ['form', 'nlines']
+
+    def setup(self, form, nlines):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        if form == 'free':
+            self.filename = os.path.join(self.tmpdir.name, 'big.f90')
+            source = free_form_source(nlines)
+        else:
+            self.filename = os.path.join(self.tmpdir.name, 'big.f')
+            source = fixed_form_source(nlines)
+        with open(self.filename, 'w') as f:
+            f.write(source)
+        self.nlines = source.count('\n')
+        crackfortran.verbose = 0
+
+    def teardown(self, form, nlines):
+        self.tmpdir.cleanup()
+
+    def time_readfortrancode(self, form, nlines):
+        crackfortran.readfortrancode([self.filename], lambda line, reset=0: None)
+
+
+class CrackLine:
+    params = (['free', 'fixed'],)
+    param_names = ['form']
+
+    def setup(self, form):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        if form == 'free':
+            filename = os.path.join(self.tmpdir.name, 'big.f90')
+            source = free_form_source(50000)
+        else:
+            filename = os.path.join(self.tmpdir.name, 'big.f')
+            source = fixed_form_source(50000)
+        with open(filename, 'w') as f:
+            f.write(source)
+        crackfortran.verbose = 0
+        self.statements = [line for line, _, _, _ in
+                           crackfortran.readfortranstatements([filename])]
+        self.nlines = len(self.statements)
+
+    def teardown(self, form):
+        self.tmpdir.cleanup()
+
+    def time_crackline(self, form):
+        crackfortran.crackline('', -1)
+        for line in self.statements:
+            crackfortran.crackline(line)
+        crackfortran.crackline('', 1)
+
+
+class SkipExecutable:
+    params = ([0, 1],)
+    param_names = ['skipexecutable']
+
+    def setup(self, skipexecutable):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        filename = os.path.join(self.tmpdir.name, 'solvers.f90')
+        with open(filename, 'w') as f:
+            f.write(solver_source(20, 12000))
+        crackfortran.verbose = 0
+        self.statements = [line for line, _, _, _ in
+                           crackfortran.readfortranstatements([filename])]
+        self.nlines = len(self.statements)
+
+    def teardown(self, skipexecutable):
+        self.tmpdir.cleanup()
+
+    def time_crackline(self, skipexecutable):
+        crackfortran.skipexecutable = skipexecutable
+        crackfortran.crackline('', -1)
+        for line in self.statements:
+            crackfortran.crackline(line)
+        crackfortran.crackline('', 1)
+        crackfortran.skipexecutable = 1
+
+
+class Parameters:
+    params = ([1000, 4000],)
+    param_names = ['nparams']
+
+    def setup(self, nparams):
+        self.source = parameters_source(nparams, 50)
+        self.nlines = self.source.count('\n')
+
+    def time_parameters(self, nparams):
+        parser = crackfortran.FortranParser(verbose=0, f77modulename='m')
+        parser.parse_string(self.source)
+
+    def teardown(self, nparams):
+        pass
+
+
+class GetLinCoef:
+    # typical dimension specifications
+    exprs = ['n', '2*n+1', 'n-1', 'lda', '(n+1)/2', 'k*(k+1)/2', 'm*n', '3',
+             'max(1,n)', '2*n*(n+1)']
+    params = ([200],)
+    param_names = ['repeat']
+
+    def setup(self, repeat):
+        self.xset = {'n', 'm', 'k', 'lda'}
+        self.ncalls = repeat * len(self.exprs)
+
+    def time_getlincoef(self, repeat):
+        for i in range(repeat):
+            for e in self.exprs:
+                crackfortran.getlincoef(e, self.xset)
+
+    def teardown(self, repeat):
+        pass
+
+
+def _run(cls):
+    import itertools
+    for args in itertools.product(*cls.params):
+        bench = cls()
+        bench.setup(*args)
+        try:
+            for name in sorted(dir(bench)):
+                if not name.startswith('time_'):
+                    continue
+                t = time.perf_counter()
+                getattr(bench, name)(*args)
+                t = time.perf_counter() - t
+                if hasattr(bench, 'ncalls'):
+                    rate = f'{1e6 * t / bench.ncalls:.1f} us/call'
+                else:
+                    rate = f'{bench.nlines / t:,.0f} lines/s'
+                print(f'{cls.__name__}.{name}{args}: {t:.3f} s, {rate}')
+        finally:
+            bench.teardown(*args)
+
+
+if __name__ == '__main__':
+    _run(ReadFortranCode)
+    _run(CrackLine)
+    _run(SkipExecutable)
+    _run(GetLinCoef)
+    _run(Parameters)
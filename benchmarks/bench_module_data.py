@@ -0,0 +1,143 @@
+"""
+Benchmarks of the access to the variables of Fortran 90 modules.
+
+The module has many integer variables and an allocatable array. It is
+implemented in C: the source holds the variables and the routines that
+the Fortran 90 wrappers of f2py would otherwise provide, that is, the
+initialization of the module object and the query (and allocation) of
+the allocatable array. The time of an access is thus the time spent in
+the module object. Building the extension module needs a C compiler.
+
+Running this file directly prints the time per access of each
+benchmark::
+
+    python benchmarks/bench_module_data.py
+"""
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(__file__))
+from bench_call import _run, build_extension  # noqa: E402
+
+NVARS = 200
+NBULK = 10
+
+
+def module_signature(name, nvars):
+    """Return a signature file of a module of nvars integer variables and
+    an allocatable array a."""
+    out = [f"python module {name}", "    interface", "        module vars"]
+    out += [f"            integer :: v{i}" for i in range(nvars)]
+    out.append("            double precision, allocatable, dimension(:) :: a")
+    out += ["        end module vars", "    end interface",
+            f"end python module {name}"]
+    return "\n".join(out) + "\n"
+
+
+def module_source(nvars):
+    """Return the C source of the module of module_signature."""
+    args = ", ".join(f"(char *)&v[{i}]" for i in range(nvars))
+    return f"""\
+#include <stdlib.h>
+#include <Python.h>
+#include <numpy/npy_common.h>
+
+static int v[{nvars}];
+static double *a = NULL;
+static npy_intp a_size = 0;
+
+void f2py_vars_getdims_a(int *r, npy_intp *s,
+                         void (*f2pysetdata)(char *, npy_intp *), int *flag)
+{{
+    npy_intp allocated;
+    if (a != NULL && s[0] >= 0 && s[0] != a_size) {{
+        free(a);
+        a = NULL;
+    }}
+    if (a == NULL && s[0] >= 1) {{
+        a = calloc(s[0], sizeof(double));
+        a_size = s[0];
+    }}
+    if (a != NULL)
+        s[0] = a_size;
+    *flag = 1;
+    allocated = (a != NULL);
+    f2pysetdata((char *)a, &allocated);
+}}
+
+/* F_FUNC(f2pyinitvars,F2PYINITVARS) of the extension module */
+void f2pyinitvars_(void (*setup)())
+{{
+    setup({args}, f2py_vars_getdims_a);
+}}
+"""
+
+
+_modules = {}
+
+
+def build_module():
+    """Build and import the extension module."""
+    if 'modbench' not in _modules:
+        _modules['modbench'] = build_extension(
+            'modbench', module_signature('modbench', NVARS),
+            module_source(NVARS))
+    return _modules['modbench']
+
+
+class ModuleData:
+    params = (['v0', f'v{NVARS - 1}', 'a'],)
+    param_names = ['name']
+    ncalls = 10000
+
+    def setup(self, name):
+        self.vars = build_module().vars
+        self.vars.a = np.zeros(100)
+        self.value = np.ones(100) if name == 'a' else 1
+
+    def time_get(self, name):
+        vars = self.vars
+        for i in range(self.ncalls):
+            getattr(vars, name)
+
+    def time_set(self, name):
+        vars, value = self.vars, self.value
+        for i in range(self.ncalls):
+            setattr(vars, name, value)
+
+
+class BulkAccess:
+    params = (['loop', 'bulk'],)
+    param_names = ['access']
+    ncalls = 1000
+
+    def setup(self, access):
+        self.vars = build_module().vars
+        self.names = [f"v{i}" for i in range(NVARS - NBULK, NVARS)]
+        self.values = dict.fromkeys(self.names, 1)
+
+    def time_get(self, access):
+        vars, names = self.vars, self.names
+        if access == 'bulk':
+            for i in range(self.ncalls):
+                vars._getvars(*names)
+        else:
+            for i in range(self.ncalls):
+                [getattr(vars, n) for n in names]
+
+    def time_set(self, access):
+        vars, values = self.vars, self.values
+        if access == 'bulk':
+            for i in range(self.ncalls):
+                vars._setvars(**values)
+        else:
+            for i in range(self.ncalls):
+                for n, v in values.items():
+                    setattr(vars, n, v)
+
+
+if __name__ == '__main__':
+    _run(ModuleData)
+    _run(BulkAccess)
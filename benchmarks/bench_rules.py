@@ -0,0 +1,94 @@
+"""
+Benchmarks of the C/API code generation.
+
+The classes follow the asv conventions (``setup`` plus ``time_*``
+methods); running this file directly prints the throughput of each
+benchmark instead::
+
+    python benchmarks/bench_rules.py
+"""
+import copy
+import os
+import tempfile
+import time
+
+from f2py_skel.frontend import crackfortran, f2py2e
+
+
+def routines_source(nroutines):
+    """Return a Fortran 77 file of nroutines routines of various kinds."""
+    out = []
+    for i in range(nroutines):
+        if i % 3 == 0:
+            out.append(f"      subroutine s{i}(n,a,b,x,c)")
+            out.append("      integer n")
+            out.append("      double precision a(n),b(n,n),x")
+            out.append("      character*8 c")
+            out.append("cf2py intent(in,out) a")
+            out.append("cf2py intent(out) x")
+            out.append("      end")
+        elif i % 3 == 1:
+            out.append(f"      function f{i}(m,z,k)")
+            out.append("      integer m,k(m)")
+            out.append("      complex*16 z")
+            out.append(f"      real*8 f{i}")
+            out.append("cf2py intent(hide) m")
+            out.append("      end")
+        else:
+            out.append(f"      subroutine t{i}(x,y,l)")
+            out.append("      real x(2,3),y")
+            out.append("      logical l")
+            out.append("cf2py intent(inout) x")
+            out.append("cf2py optional y")
+            out.append("      end")
+    return "\n".join(out) + "\n"
+
+
+class BuildModule:
+    # The time per routine should not depend on the number of routines
+    params = ([100, 1000, 10000],)
+    param_names = ['nroutines']
+    timeout = 600
+
+    def setup(self, nroutines):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.tmpdir.name, 'big.f')
+        with open(self.filename, 'w') as f:
+            f.write(routines_source(nroutines))
+        self.nlines = nroutines
+        crackfortran.reset_global_f2py_vars()
+        files, options = f2py2e.scaninputline(
+            ['-m', 'big', self.filename, '--build-dir', self.tmpdir.name,
+             '--quiet', '--no-sig-cache'])
+        f2py2e.auxfuncs.options = options
+        f2py2e.f90mod_rules.options = options
+        self.postlist = f2py2e.callcrackfortran(files, options)
+
+    def teardown(self, nroutines):
+        self.tmpdir.cleanup()
+
+    def time_buildmodules(self, nroutines):
+        f2py2e.buildmodules(copy.deepcopy(self.postlist))
+
+
+def _run(cls):
+    import itertools
+    for args in itertools.product(*cls.params):
+        bench = cls()
+        bench.setup(*args)
+        try:
+            for name in sorted(dir(bench)):
+                if not name.startswith('time_'):
+                    continue
+                t = time.perf_counter()
+                getattr(bench, name)(*args)
+                t = time.perf_counter() - t
+                rate = getattr(bench, 'nlines', 0) / t
+                print(f'{cls.__name__}.{name}{args}: {t:.3f} s, '
+                      f'{rate:,.0f} routines/s')
+        finally:
+            bench.teardown(*args)
+
+
+if __name__ == '__main__':
+    _run(BuildModule)
@@ -0,0 +1,84 @@
+"""
+Benchmarks of the throughput of threads calling a wrapped routine.
+
+The routine is a C function (``intent(c)``) that spins for a given
+number of iterations without touching Python. Its wrapper holds the GIL
+during the call by default and releases it with ``--release-gil=auto``,
+so that only then the calls of several threads run in parallel. Building
+the extension modules needs a C compiler.
+
+Running this file directly prints the time of each benchmark::
+
+    python benchmarks/bench_threads.py
+"""
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.dirname(__file__))
+from bench_call import _run, build_extension  # noqa: E402
+
+MODES = ['threadsafe', 'auto']
+NTHREADS = [1, 2, 4]
+
+signature = """\
+python module {name}
+    interface
+        subroutine spin(n)
+            intent(c) spin
+            integer, intent(c) :: n
+        end subroutine spin
+    end interface
+end python module {name}
+"""
+
+source = """\
+void spin(int n) {
+    volatile double x = 0;
+    int i;
+    for (i = 0; i < n; i++)
+        x += 1e-9 * i;
+}
+"""
+
+_modules = {}
+
+
+def build_module(mode):
+    """Build and import the extension module with --release-gil=mode."""
+    if mode not in _modules:
+        name = f'threadbench_{mode}'
+        _modules[mode] = build_extension(
+            name, signature.format(name=name), source,
+            [f'--release-gil={mode}'])
+    return _modules[mode]
+
+
+class ThreadedCalls:
+    params = (MODES, NTHREADS)
+    param_names = ['mode', 'nthreads']
+    # The same number of calls of the same length are split between the
+    # threads: the time decreases with the number of threads when the
+    # calls run in parallel
+    ncalls = 400
+    niterations = 100000
+
+    def setup(self, mode, nthreads):
+        self.spin = build_module(mode).spin
+
+    def calls(self, ncalls):
+        for i in range(ncalls):
+            self.spin(self.niterations)
+
+    def time_calls(self, mode, nthreads):
+        threads = [threading.Thread(target=self.calls,
+                                    args=(self.ncalls // nthreads,))
+                   for i in range(nthreads)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+
+if __name__ == '__main__':
+    _run(ThreadedCalls)
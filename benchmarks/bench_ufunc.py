@@ -0,0 +1,74 @@
+"""
+Benchmarks of the ufuncs built with ``--ufunc``.
+
+The routine is a C function (``intent(c)``) of two scalars. Its values
+on the elements of arrays are computed either by ``numpy.vectorize`` of
+the wrapper, which calls the wrapper on each element, or by the ufunc of
+the routine. Building the extension module needs a C compiler.
+
+Running this file directly prints the time per element of each
+benchmark::
+
+    python benchmarks/bench_ufunc.py
+"""
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(__file__))
+from bench_call import _run, build_extension  # noqa: E402
+
+SIZES = [10, 100000]
+
+signature = """\
+python module {name}
+    interface
+        function hyp(x, y)
+            intent(c) hyp
+            double precision, intent(c) :: x, y
+            double precision :: hyp
+        end function hyp
+    end interface
+end python module {name}
+"""
+
+source = """\
+#include <math.h>
+double hyp(double x, double y) {
+    return sqrt(x * x + y * y);
+}
+"""
+
+_modules = {}
+
+
+def build_module():
+    """Build and import the extension module with --ufunc."""
+    if 'ufuncbench' not in _modules:
+        _modules['ufuncbench'] = build_extension(
+            'ufuncbench', signature.format(name='ufuncbench'), source,
+            ['--ufunc'])
+    return _modules['ufuncbench']
+
+
+class UfuncCalls:
+    params = (SIZES,)
+    param_names = ['n']
+
+    def setup(self, n):
+        self.hyp = build_module().hyp
+        self.vectorized = np.vectorize(self.hyp, otypes=[float])
+        self.x = np.linspace(0, 1, n)
+        self.y = np.linspace(1, 2, n)
+        self.ncalls = n
+
+    def time_vectorize(self, n):
+        self.vectorized(self.x, self.y)
+
+    def time_ufunc(self, n):
+        self.hyp.ufunc(self.x, self.y)
+
+
+if __name__ == '__main__':
+    _run(UfuncCalls)
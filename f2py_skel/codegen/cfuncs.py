@@ -15,7 +15,7 @@ Pearu Peterson
 
 """
 import sys
-import copy
+from collections import deque
 
 from f2py_skel import __version__
 
@@ -24,11 +24,45 @@ errmess = sys.stderr.write
 
 ##################### Definitions ##################
 
-outneeds = {'includes0': [], 'includes': [], 'typedefs': [], 'typedefs_generated': [],
-            'userincludes': [],
-            'cppmacros': [], 'cfuncs': [], 'callbacks': [], 'f90modhooks': [],
+
+class NeedsGraph(dict):
+    """
+    The graph of the needs: maps a need to the list of the needs that
+    must be emitted before it.
+
+    append_needs caches the transitive closures of the graph, changing
+    a need drops the cache.
+    """
+
+    def __setitem__(self, need, deps):
+        _closures.clear()
+        dict.__setitem__(self, need, deps)
+
+    def __delitem__(self, need):
+        _closures.clear()
+        dict.__delitem__(self, need)
+
+    def update(self, *args, **kwds):
+        _closures.clear()
+        dict.update(self, *args, **kwds)
+
+
+def newneeds():
+    """
+    Return an empty `outneeds` dict.
+
+    Every module has its own needs, buildmodule collects them in the
+    dict bound to `outneeds` while it runs.
+    """
+    return {'includes0': [], 'includes': [], 'typedefs': [],
+            'typedefs_generated': [], 'userincludes': [], 'cppmacros': [],
+            'cfuncs': [], 'callbacks': [], 'f90modhooks': [],
             'commonhooks': []}
-needs = {}
+
+
+outneeds = newneeds()
+needs = NeedsGraph()
+_closures = {}
 includes0 = {'includes0': '/*need_includes0*/'}
 includes = {'includes': '/*need_includes*/'}
 userincludes = {'userincludes': '/*need_userincludes*/'}
@@ -50,6 +84,7 @@ commonhooks = {'commonhooks': '/*need_commonhooks*/',
 includes0['math.h'] = '#include <math.h>'
 includes0['string.h'] = '#include <string.h>'
 includes0['setjmp.h'] = '#include <setjmp.h>'
+includes0['omp.h'] = '#ifdef _OPENMP\n#include <omp.h>\n#endif'
 
 includes['Python.h'] = '#include <Python.h>'
 needs['arrayobject.h'] = ['Python.h']
@@ -58,6 +93,8 @@ includes['arrayobject.h'] = '''#define PY_ARRAY_UNIQUE_SYMBOL PyArray_API
 
 includes['arrayobject.h'] = '#include "fortranobject.h"'
 includes['stdarg.h'] = '#include <stdarg.h>'
+needs['ufuncobject.h'] = ['arrayobject.h']
+includes['ufuncobject.h'] = '#include "numpy/ufuncobject.h"'
 
 ############# Type definitions ###############
 
@@ -436,12 +473,10 @@ cppmacros['TRYCOMPLEXPYARRAYTEMPLATE'] = """\
 # """
 
 
-needs['GETSTRFROMPYTUPLE'] = ['STRINGCOPYN', 'PRINTPYOBJERR']
-cppmacros['GETSTRFROMPYTUPLE'] = """\
-#define GETSTRFROMPYTUPLE(tuple,index,str,len) {\\
-        PyObject *rv_cb_str = PyTuple_GetItem((tuple),(index));\\
-        if (rv_cb_str == NULL)\\
-            goto capi_fail;\\
+needs['GETSTRFROMPYITEMS'] = ['STRINGCOPYN', 'PRINTPYOBJERR']
+cppmacros['GETSTRFROMPYITEMS'] = """\
+#define GETSTRFROMPYITEMS(items,index,str,len) {\\
+        PyObject *rv_cb_str = (items)[(index)];\\
         if (PyBytes_Check(rv_cb_str)) {\\
             str[len-1]='\\0';\\
             STRINGCOPYN((str),PyBytes_AS_STRING((PyBytesObject*)rv_cb_str),(len));\\
@@ -452,9 +487,9 @@ cppmacros['GETSTRFROMPYTUPLE'] = """\
         }\\
     }
 """
-cppmacros['GETSCALARFROMPYTUPLE'] = """\
-#define GETSCALARFROMPYTUPLE(tuple,index,var,ctype,mess) {\\
-        if ((capi_tmp = PyTuple_GetItem((tuple),(index)))==NULL) goto capi_fail;\\
+cppmacros['GETSCALARFROMPYITEMS'] = """\
+#define GETSCALARFROMPYITEMS(items,index,var,ctype,mess) {\\
+        capi_tmp = (items)[(index)];\\
         if (!(ctype ## _from_pyobj((var),capi_tmp,mess)))\\
             goto capi_fail;\\
     }
@@ -571,23 +606,21 @@ cppmacros['OLDPYNUM'] = """\
 #endif
 """
 cppmacros["F2PY_THREAD_LOCAL_DECL"] = """\
+/* The storage class of the active call-back pointers. Without it (or
+   with F2PY_USE_PYTHON_TLS defined) they are kept in the thread state
+   dictionary of Python, see F2PySwapThreadLocalCallbackPtr. */
 #ifndef F2PY_THREAD_LOCAL_DECL
 #if defined(_MSC_VER) \\
       || defined(_WIN32) || defined(_WIN64) \\
       || defined(__MINGW32__) || defined(__MINGW64__)
 #define F2PY_THREAD_LOCAL_DECL __declspec(thread)
-#elif defined(__STDC_VERSION__) \\
-      && (__STDC_VERSION__ >= 201112L) \\
-      && !defined(__STDC_NO_THREADS__) \\
-      && (!defined(__GLIBC__) || __GLIBC__ > 2 || (__GLIBC__ == 2 && __GLIBC_MINOR__ > 12))
-/* __STDC_NO_THREADS__ was first defined in a maintenance release of glibc 2.12,
-   see https://lists.gnu.org/archive/html/commit-hurd/2012-07/msg00180.html,
-   so `!defined(__STDC_NO_THREADS__)` may give false positive for the existence
-   of `threads.h` when using an older release of glibc 2.12 */
-#include <threads.h>
+#elif defined(__cplusplus) && (__cplusplus >= 201103L)
 #define F2PY_THREAD_LOCAL_DECL thread_local
-#elif defined(__GNUC__) \\
-      && (__GNUC__ > 4 || (__GNUC__ == 4 && (__GNUC_MINOR__ >= 4)))
+#elif defined(__STDC_VERSION__) && (__STDC_VERSION__ >= 201112L)
+/* A keyword of C11, which does not need threads.h */
+#define F2PY_THREAD_LOCAL_DECL _Thread_local
+#elif defined(__GNUC__) || defined(__clang__) || defined(__INTEL_COMPILER)
+/* Clang defines __GNUC__ as 4 and __GNUC_MINOR__ as 2 */
 #define F2PY_THREAD_LOCAL_DECL __thread
 #endif
 #endif
@@ -1349,6 +1382,38 @@ capi_fail:
 }
 """
 
+needs['f2py_ufunc_addattr'] = ['ufuncobject.h']
+# set the attribute ufunc of a routine, see ufunc_routine_rules in rules.py
+cfuncs['f2py_ufunc_addattr'] = """\
+static int
+f2py_ufunc_addattr(PyObject *container, const char *name,
+                   PyUFuncGenericFunction *funcs, void **data, char *types,
+                   const int nin, const int nout, const char *doc)
+{
+    static int imported = 0;
+    PyObject *routine, *ufunc;
+    int ret = -1;
+    if (!imported) {
+        if (_import_umath() < 0)
+            return -1;
+        imported = 1;
+    }
+    routine = F2PyRoutine_Get(container, name);
+    if (routine == NULL)
+        return -1;
+    /* The loop calls the routine given by the data of the ufunc */
+    data[0] = ((PyFortranObject *)routine)->defs[0].data;
+    ufunc = PyUFunc_FromFuncAndData(funcs, data, types, 1, nin, nout,
+                                    PyUFunc_None, name, doc, 0);
+    if (ufunc != NULL) {
+        ret = PyObject_SetAttrString(routine, \"ufunc\", ufunc);
+        Py_DECREF(ufunc);
+    }
+    Py_DECREF(routine);
+    return ret;
+}
+"""
+
 
 def buildcfuncs():
     from f2py_skel.stds.pyf.capi_maps import c2capi_map
@@ -1365,103 +1430,165 @@ def buildcfuncs():
 
 ############ Auxiliary functions for sorting needs ###################
 
+# The tables of needs, in the order they are searched for the kind of a need
+_needtables = (('includes0', includes0), ('includes', includes),
+               ('typedefs', typedefs),
+               ('typedefs_generated', typedefs_generated),
+               ('cppmacros', cppmacros), ('cfuncs', cfuncs),
+               ('callbacks', callbacks), ('f90modhooks', f90modhooks),
+               ('commonhooks', commonhooks))
+_tablesizes = None
+
+
+def _needkind(need):
+    # Return the name of the table that defines need, or None.
+    for n, table in _needtables:
+        if need in table:
+            return n
+    return None
+
+
+def _checkclosures():
+    # Drop the cached closures when needs were added to the tables, an
+    # unknown need may have become known.
+    global _tablesizes
+    sizes = tuple(len(table) for _, table in _needtables)
+    if sizes != _tablesizes:
+        _closures.clear()
+        _tablesizes = sizes
+
+
+def _dependencies(deps, path):
+    # Return the closures of the needs deps concatenated, without
+    # duplicates.  path is the list of needs being expanded.
+    out = []
+    seen = set()
+    for d in deps:
+        if isinstance(d, list):
+            continue
+        if not isinstance(d, str):
+            errmess('append_needs: expected list or string but got :%s\n' %
+                    (repr(d)))
+            continue
+        for k, n in _closure(d, path) if d else ():
+            if n not in seen:
+                seen.add(n)
+                out.append((k, n))
+    return out
+
+
+def _closure(need, path):
+    # Return need and the needs it depends on, directly or not, as a
+    # tuple of (kind, need) pairs.  The dependencies come first, the
+    # ones of the later needs in needs[need] before the others.
+    if need in _closures:
+        return _closures[need]
+    kind = _needkind(need)
+    if kind is None:
+        errmess('append_needs: unknown need %s\n' % (repr(need)))
+        return ()
+    if need in path:
+        cycle = path[path.index(need):] + [need]
+        errmess('append_needs: circular dependence of needs %s, skipping %s.\n'
+                % (' -> '.join(cycle), need))
+        return ()
+    path.append(need)
+    closure = _dependencies(reversed(needs.get(need, [])), path)
+    path.pop()
+    closure.append((kind, need))
+    _closures[need] = closure = tuple(closure)
+    return closure
+
+
 def append_needs(need, flag=1):
-    # This function modifies the contents of the global `outneeds` dict.
+    """
+    Add need, or the list of needs, to the global `outneeds` dict.
+
+    The needs that need depends on, directly or not, and that are not in
+    `outneeds` yet are inserted at the front of the list of their kind,
+    need itself is appended to the list of its kind.  flag is not used.
+    """
     if isinstance(need, list):
         for n in need:
             append_needs(n, flag)
-    elif isinstance(need, str):
-        if not need:
-            return
-        if need in includes0:
-            n = 'includes0'
-        elif need in includes:
-            n = 'includes'
-        elif need in typedefs:
-            n = 'typedefs'
-        elif need in typedefs_generated:
-            n = 'typedefs_generated'
-        elif need in cppmacros:
-            n = 'cppmacros'
-        elif need in cfuncs:
-            n = 'cfuncs'
-        elif need in callbacks:
-            n = 'callbacks'
-        elif need in f90modhooks:
-            n = 'f90modhooks'
-        elif need in commonhooks:
-            n = 'commonhooks'
-        else:
-            errmess('append_needs: unknown need %s\n' % (repr(need)))
-            return
-        if need in outneeds[n]:
-            return
-        if flag:
-            tmp = {}
-            if need in needs:
-                for nn in needs[need]:
-                    t = append_needs(nn, 0)
-                    if isinstance(t, dict):
-                        for nnn in t.keys():
-                            if nnn in tmp:
-                                tmp[nnn] = tmp[nnn] + t[nnn]
-                            else:
-                                tmp[nnn] = t[nnn]
-            for nn in tmp.keys():
-                for nnn in tmp[nn]:
-                    if nnn not in outneeds[nn]:
-                        outneeds[nn] = [nnn] + outneeds[nn]
-            outneeds[n].append(need)
-        else:
-            tmp = {}
-            if need in needs:
-                for nn in needs[need]:
-                    t = append_needs(nn, flag)
-                    if isinstance(t, dict):
-                        for nnn in t.keys():
-                            if nnn in tmp:
-                                tmp[nnn] = t[nnn] + tmp[nnn]
-                            else:
-                                tmp[nnn] = t[nnn]
-            if n not in tmp:
-                tmp[n] = []
-            tmp[n].append(need)
-            return tmp
-    else:
+        return
+    if not isinstance(need, str):
         errmess('append_needs: expected list or string but got :%s\n' %
                 (repr(need)))
+        return
+    if not need:
+        return
+    kind = _needkind(need)
+    if kind is None:
+        errmess('append_needs: unknown need %s\n' % (repr(need)))
+        return
+    if need in outneeds[kind]:
+        return
+    _checkclosures()
+    new = {}
+    for k, n in _dependencies(needs.get(need, []), [need]):
+        if n not in outneeds[k]:
+            new.setdefault(k, []).append(n)
+    for k, ns in new.items():
+        outneeds[k][:0] = ns[::-1]
+    outneeds[kind].append(need)
+
+
+def _findcycle(items):
+    # Return a circular dependence of needs among items, every item has
+    # a dependency in items.
+    path = [items[0]]
+    while True:
+        need = path[-1]
+        dep = next(d for d in needs[need]
+                   if d != need and isinstance(d, str) and d in items)
+        if dep in path:
+            return path[path.index(dep):] + [dep]
+        path.append(dep)
+
+
+def _sortneeds(items):
+    # Return the needs items sorted so that every need comes after its
+    # dependencies among items.  The needs are taken in the order of
+    # items, a need with pending dependencies is moved to the end.
+    counts = dict.fromkeys(items, 0)
+    dependents = {n: [] for n in items}
+    for n in items:
+        for d in set(d for d in needs.get(n, []) if isinstance(d, str)):
+            if d != n and d in counts:
+                counts[n] += 1
+                dependents[d].append(n)
+    queue = deque(items)
+    out = []
+    moved = 0
+    while queue:
+        n = queue.popleft()
+        if counts[n]:
+            queue.append(n)
+            moved += 1
+            if moved == len(queue):
+                cycle = _findcycle(list(queue))
+                errmess('get_needs: circular dependence of needs %s, '
+                        'skipping.\n' % (' -> '.join(cycle)))
+                out.extend(queue)
+                break
+            continue
+        moved = 0
+        out.append(n)
+        for m in dependents[n]:
+            counts[m] -= 1
+    return out
 
 
 def get_needs():
-    # This function modifies the contents of the global `outneeds` dict.
+    """
+    Return the needs in `outneeds` sorted by their dependencies.
+
+    Every list of `outneeds` is emptied.  An empty list gives the list
+    of its kind, e.g. ``['cfuncs']``.
+    """
     res = {}
     for n in outneeds.keys():
-        out = []
-        saveout = copy.copy(outneeds[n])
-        while len(outneeds[n]) > 0:
-            if outneeds[n][0] not in needs:
-                out.append(outneeds[n][0])
-                del outneeds[n][0]
-            else:
-                flag = 0
-                for k in outneeds[n][1:]:
-                    if k in needs[outneeds[n][0]]:
-                        flag = 1
-                        break
-                if flag:
-                    outneeds[n] = outneeds[n][1:] + [outneeds[n][0]]
-                else:
-                    out.append(outneeds[n][0])
-                    del outneeds[n][0]
-            if saveout and (0 not in map(lambda x, y: x == y, saveout, outneeds[n])) \
-                    and outneeds[n] != []:
-                print(n, saveout)
-                errmess(
-                    'get_needs: no progress in sorting needs, probably circular dependence, skipping.\n')
-                out = out + saveout
-                break
-            saveout = copy.copy(outneeds[n])
-        if out == []:
-            out = [n]
-        res[n] = out
+        res[n] = _sortneeds(outneeds[n]) or [n]
+        del outneeds[n][:]
     return res
@@ -60,10 +60,11 @@ f2py_version = __version__.version
 numpy_version = __version__.version
 
 from f2py_skel.stds.auxfuncs import (
-    applyrules, debugcapi, dictappend, errmess, gentitle, getargs2,
+    applyrules, debugcapi, dictappend, errmess, flatlist, gentitle, getargs2,
     hascallstatement, hasexternals, hasinitvalue, hasnote, hasresultnote,
-    isarray, isarrayofstrings, iscomplex, iscomplexarray,
-    iscomplexfunction, iscomplexfunction_warn, isdummyroutine, isexternal,
+    isarray, isarrayofstrings, isbatch, iscomplex, iscomplexarray,
+    iscomplexfunction, iscomplexfunction_warn, isdummyroutine, iselemental,
+    isexternal,
     isfunction, isfunction_wrap, isint1array, isintent_aux, isintent_c,
     isintent_callback, isintent_copy, isintent_hide, isintent_inout,
     isintent_nothide, isintent_out, isintent_overwrite, islogical,
@@ -73,10 +74,12 @@ from f2py_skel.stds.auxfuncs import (
     issubroutine, issubroutine_wrap, isthreadsafe, isunsigned,
     isunsigned_char, isunsigned_chararray, isunsigned_long_long,
     isunsigned_long_longarray, isunsigned_short, isunsigned_shortarray,
-    l_and, l_not, l_or, outmess, replace, stripcomma, requiresf90wrapper
+    l_and, l_not, l_or, outmess, replace, stripcomma, requiresf90wrapper,
+    writefile
 )
 
 from f2py_skel.stds.pyf import capi_maps
+from f2py_skel.stds.pyf import cb_rules
 from f2py_skel.codegen import cfuncs
 from f2py_skel.stds.f77 import common_rules
 from f2py_skel.stds.f90 import use_rules
@@ -100,20 +103,28 @@ for k in ['decl',
           'routine_defs', 'externroutines',
           'initf2pywraphooks',
           'commonhooks', 'initcommonhooks',
-          'f90modhooks', 'initf90modhooks']:
+          'f90modhooks', 'initf90modhooks',
+          'batchsize', 'batchbefore', 'batchcapture', 'batchslice',
+          'batchcall', 'batchstore', 'batchcleanup']:
     sepdict[k] = '\n'
 
 #################### Rules for C/API module #################
 
-generationtime = int(os.environ.get('SOURCE_DATE_EPOCH', time.time()))
+# The generated files do not depend on the time, the generation date is
+# only written when SOURCE_DATE_EPOCH is set.
+generationtime = None
+generationdate = ''
+if 'SOURCE_DATE_EPOCH' in os.environ:
+    generationtime = int(os.environ['SOURCE_DATE_EPOCH'])
+    generationdate = ' * Generation date: %s\n' % (
+        time.asctime(time.gmtime(generationtime)))
 module_rules = {
     'modulebody': """\
 /* File: #modulename#module.c
  * This file is auto-generated with f2py (version:#f2py_version#).
  * f2py is a Fortran to Python Interface Generator (FPIG), Second Edition,
  * written by Pearu Peterson <pearu@cens.ioc.ee>.
- * Generation date: """ + time.asctime(time.gmtime(generationtime)) + """
- * Do not edit this file directly unless you know what you are doing!!!
+""" + generationdate + """ * Do not edit this file directly unless you know what you are doing!!!
  */
 
 #ifdef __cplusplus
@@ -129,8 +140,7 @@ extern \"C\" {
 #includes0#
 
 """ + gentitle("See f2py2e/rules.py: mod_rules['modulebody']") + """
-static PyObject *#modulename#_error;
-static PyObject *#modulename#_module;
+#moduleobjects#
 
 """ + gentitle("See f2py2e/cfuncs.py: typedefs") + """
 #typedefs#
@@ -225,6 +235,9 @@ PyMODINIT_FUNC PyInit_#modulename#(void) {
         PyDict_SetItemString(d, f2py_routine_defs[i].name, tmp);
         Py_DECREF(tmp);
     }
+    if (F2PyCopyAudit_AddFunctions(m) < 0 ||
+            F2PyCallTiming_AddFunctions(m) < 0)
+        return NULL;
 #initf2pywraphooks#
 #initf90modhooks#
 #initcommonhooks#
@@ -263,30 +276,131 @@ defmod_rules = [
      }
 ]
 
+# The translation units holding the wrappers of the routines when the
+# module is split in shards, see shardbodies
+shard_rules = {
+    'shardbody': """\
+/* File: #shardoutput#
+ * This file is auto-generated with f2py (version:#f2py_version#).
+ * It contains wrappers of the module #modulename#, see #coutput#.
+""" + generationdate + """ * Do not edit this file directly unless you know what you are doing!!!
+ */
+
+#ifdef __cplusplus
+extern \"C\" {
+#endif
+
+#ifndef PY_SSIZE_T_CLEAN
+#define PY_SSIZE_T_CLEAN
+#endif /* PY_SSIZE_T_CLEAN */
+
+/* The numpy C API is imported by #coutput# */
+#define NO_IMPORT_ARRAY
+
+""" + gentitle("See f2py2e/cfuncs.py: includes") + """
+#includes#
+#includes0#
+
+""" + gentitle("See f2py2e/rules.py: shard_rules['shardbody']") + """
+#moduleobjects#
+
+""" + gentitle("See f2py2e/cfuncs.py: typedefs") + """
+#typedefs#
+
+""" + gentitle("See f2py2e/cfuncs.py: typedefs_generated") + """
+#typedefs_generated#
+
+""" + gentitle("See f2py2e/cfuncs.py: cppmacros") + """
+#cppmacros#
+
+""" + gentitle("See f2py2e/cfuncs.py: cfuncs") + """
+#cfuncs#
+
+""" + gentitle("See f2py2e/cfuncs.py: userincludes") + """
+#userincludes#
+
+""" + gentitle("See f2py2e/capi_rules.py: usercode") + """
+#usercode#
+
+/* See f2py2e/rules.py */
+#externroutines#
+
+""" + gentitle("See f2py2e/capi_rules.py: usercode1") + """
+#usercode1#
+
+""" + gentitle("See f2py2e/cb_rules.py: buildcallback") + """
+#callbacks#
+
+""" + gentitle("See f2py2e/rules.py: buildapi") + """
+#body#
+
+#ifdef __cplusplus
+}
+#endif
+"""
+}
+
+# The objects shared by the wrappers and the module initialization
+moduleobjects = """\
+static PyObject *#modulename#_error;
+static PyObject *#modulename#_module;"""
+hiddenmacro = """\
+#if defined(__GNUC__) && !defined(_WIN32)
+#define F2PY_HIDDEN __attribute__((visibility(\"hidden\")))
+#else
+#define F2PY_HIDDEN
+#endif
+"""
+sharedmoduleobjects = hiddenmacro + """\
+F2PY_HIDDEN PyObject *#modulename#_error;
+F2PY_HIDDEN PyObject *#modulename#_module;"""
+shardmoduleobjects = hiddenmacro + """\
+extern F2PY_HIDDEN PyObject *#modulename#_error;
+extern F2PY_HIDDEN PyObject *#modulename#_module;"""
+
+# The prototype of the wrappers of the routines and of their batched
+# variants. The wrappers are #static#: static, or F2PY_HIDDEN when the
+# module is split in shards, and then declared by their 'sharedecls' in
+# the unit of the module initialization, see shardbodies.
+wrapperproto = """\
+PyObject *#apiname#(const PyObject *capi_self,
+                           PyObject *const *capi_args,
+                           Py_ssize_t capi_nargs,
+                           PyObject *capi_kwnames,
+                           #functype# (*f2py_func)(#callprotoargument#))"""
+wrapperdecls = """\
+extern F2PY_HIDDEN char doc_#apiname#[];
+extern F2PY_HIDDEN """ + wrapperproto + ";\n"
+
 routine_rules = {
     'separatorsfor': sepdict,
     'body': """
 #begintitle#
-static char doc_#apiname#[] = \"\\\n#docreturn##name#(#docsignatureshort#)\\n\\nWrapper for ``#name#``.\\\n\\n#docstrsigns#\";
+#static# char doc_#apiname#[] = \"\\\n#docreturn##name#(#docsignatureshort#)\\n\\nWrapper for ``#name#``.\\\n\\n#docstrsigns#\";
 /* #declfortranroutine# */
-static PyObject *#apiname#(const PyObject *capi_self,
-                           PyObject *capi_args,
-                           PyObject *capi_keywds,
-                           #functype# (*f2py_func)(#callprotoargument#)) {
+#static# """ + wrapperproto + """ {
     PyObject * volatile capi_buildvalue = NULL;
     volatile int f2py_success = 1;
 #decl#
     static char *capi_kwlist[] = {#kwlist##kwlistopt##kwlistxa#NULL};
+    static F2PyArgParser capi_parser = {\"#argformat#|#keyformat##xaformat#:#pyname#\",capi_kwlist};
+    static F2PyCallStats capi_callstats = {\"#pyname#\"};
+    F2PyCallClock capi_clock = {0};
 #usercode#
 #routdebugenter#
 #ifdef F2PY_REPORT_ATEXIT
 f2py_start_clock();
 #endif
-    if (!PyArg_ParseTupleAndKeywords(capi_args,capi_keywds,\\
-        \"#argformat#|#keyformat##xaformat#:#pyname#\",\\
-        capi_kwlist#args_capi##keys_capi##keys_xa#))\n        return NULL;
+    if (f2py_call_timing)
+        F2PyCallClock_Start(&capi_clock);
+    if (capi_kwnames == NULL && capi_nargs == #nargsfast#) {
+#argsfast#
+    } else if (!F2PyArg_ParseVectorcall(capi_args,capi_nargs,capi_kwnames,\\
+        &capi_parser#args_capi##keys_capi##keys_xa#))\n        return NULL;
 #frompyobj#
 /*end of frompyobj*/
+    if (capi_clock.start)
+        F2PyCallClock_Lap(&capi_clock,F2PY_CALL_CONVERT);
 #ifdef F2PY_REPORT_ATEXIT
 f2py_start_call_clock();
 #endif
@@ -296,6 +410,8 @@ if (PyErr_Occurred())
 #ifdef F2PY_REPORT_ATEXIT
 f2py_stop_call_clock();
 #endif
+    if (capi_clock.start)
+        F2PyCallClock_Lap(&capi_clock,F2PY_CALL_FORTRAN);
 /*end of callfortranroutine*/
         if (f2py_success) {
 #pyobjfrom#
@@ -317,10 +433,13 @@ f2py_stop_call_clock();
 #ifdef F2PY_REPORT_ATEXIT
 f2py_stop_clock();
 #endif
+    if (capi_clock.start)
+        F2PyCallClock_Stop(&capi_clock,F2PY_CALL_BUILD,&capi_callstats);
     return capi_buildvalue;
 }
 #endtitle#
 """,
+    'sharedecls': wrapperdecls,
     'routine_defs': '#routine_def#',
     'initf2pywraphooks': '#initf2pywraphook#',
     'externroutines': '#declfortranroutine#',
@@ -341,6 +460,137 @@ f2py_stop_clock();
                 ]
 }
 
+# The batched wrapper of a routine, built with --batch, see buildapi. The
+# arrays have a leading batch axis and the routine is called on each slice
+# with the GIL released.
+batch_routine_rules = {
+    'separatorsfor': sepdict,
+    'body': """
+#begintitle#
+#static# char doc_#apiname#[] = \"\\\n#docreturn##name#.batch(#docsignatureshort#,nthreads=1)\\n\\nBatched wrapper for ``#name#``.\\n\\nThe array arguments have a leading batch axis and ``#name#`` is called\\non each slice, the outputs are stacked along the batch axis. The slices\\nare split over nthreads threads when the module is built with OpenMP.\";
+#static# """ + wrapperproto + """ {
+    PyObject * volatile capi_buildvalue = NULL;
+    volatile int f2py_success = 1;
+#decl#
+    npy_intp capi_batch = -1;
+    int capi_nthreads = 1;
+    static char *capi_kwlist[] = {#kwlist##kwlistopt##kwlistxa#\"nthreads\",NULL};
+    static F2PyArgParser capi_parser = {\"#argformat#|#keyformat##xaformat#i:#pyname#\",capi_kwlist};
+    static F2PyCallStats capi_callstats = {\"#pyname#\"};
+    F2PyCallClock capi_clock = {0};
+    if (f2py_call_timing)
+        F2PyCallClock_Start(&capi_clock);
+    if (capi_kwnames == NULL && capi_nargs == #nargsfast#) {
+#argsfast#
+    } else if (!F2PyArg_ParseVectorcall(capi_args,capi_nargs,capi_kwnames,\\
+        &capi_parser#args_capi##keys_capi##keys_xa#,&capi_nthreads))\n        return NULL;
+#batchsize#
+    if (capi_batch < 0) {
+        PyErr_SetString(PyExc_ValueError,\"#pyname#() requires an array with a batch axis\");
+        return NULL;
+    }
+#frompyobj#
+/*end of frompyobj*/
+#batchbefore#
+    if (capi_clock.start)
+        F2PyCallClock_Lap(&capi_clock,F2PY_CALL_CONVERT);
+    if (f2py_success) {
+#batchcapture#
+        npy_intp capi_i;
+        Py_BEGIN_ALLOW_THREADS
+#ifdef _OPENMP
+        if (capi_nthreads < 1)
+            capi_nthreads = omp_get_max_threads();
+#pragma omp parallel for num_threads(capi_nthreads) if (capi_nthreads > 1)
+#endif
+        for (capi_i = 0; capi_i < capi_batch; capi_i++) {
+#batchslice#
+#batchcall#
+#batchstore#
+        }
+        Py_END_ALLOW_THREADS
+    }
+    if (capi_clock.start)
+        F2PyCallClock_Lap(&capi_clock,F2PY_CALL_FORTRAN);
+/*end of callfortranroutine*/
+        if (f2py_success) {
+        CFUNCSMESS(\"Building return value.\\n\");
+        capi_buildvalue = Py_BuildValue(\"#batchreturnformat#\"#batchreturn#);
+        } /*if (f2py_success) after callfortranroutine*/
+#batchcleanup#
+/*cleanupfrompyobj*/
+#cleanupfrompyobj#
+    CFUNCSMESS(\"Freeing memory.\\n\");
+#freemem#
+    if (capi_clock.start)
+        F2PyCallClock_Stop(&capi_clock,F2PY_CALL_BUILD,&capi_callstats);
+    return capi_buildvalue;
+}
+#endtitle#
+""",
+    'initf2pywraphooks': {l_not(ismoduleroutine): '''
+    {
+      static FortranDataDef def = {"#name#",-1,{{-1}},0,NULL,(f2py_init_func)#apiname#,doc_#apiname#};
+      if (F2PyBatch_AddAttr(m,&def) < 0)
+        return NULL;
+    }
+    '''},
+    'initf90modhooks': {ismoduleroutine: '''
+    {
+      static FortranDataDef def = {"#name#",-1,{{-1}},0,NULL,(f2py_init_func)#apiname#,doc_#apiname#};
+      if (F2PyBatch_AddAttr(PyDict_GetItemString(d,"#f90modulename#"),&def) < 0)
+        return NULL;
+    }
+    '''},
+    'sharedecls': wrapperdecls,
+    'need': ['arrayobject.h', 'CFUNCSMESS', 'omp.h'],
+}
+
+# The ufunc of a routine of numeric scalar arguments, built with --ufunc,
+# see buildufunc. Its loop calls the routine on each element.
+ufuncproto = """\
+void #ufuncname#(char **capi_args, const npy_intp *capi_dims,
+                           const npy_intp *capi_steps, void *capi_data)"""
+
+ufunc_routine_rules = {
+    'body': """
+#begintitle#
+#static# char doc_#ufuncname#[] = \"#ufuncdoc#\";
+#static# """ + ufuncproto + """ {
+    #functype# (*f2py_func)(#callprotoargument#) = (#functype# (*)(#callprotoargument#))capi_data;
+    npy_intp capi_i;
+    for (capi_i = 0; capi_i < capi_dims[0]; capi_i++) {
+#ufuncload#
+#ufunccall#
+#ufuncstore#
+    }
+}
+#endtitle#
+""",
+    'initf2pywraphooks': {l_not(ismoduleroutine): '''
+    {
+      static PyUFuncGenericFunction funcs[1] = {#ufuncname#};
+      static void *data[1];
+      static char types[] = {#ufunctypes#};
+      if (f2py_ufunc_addattr(m,"#name#",funcs,data,types,#ufuncnin#,#ufuncnout#,doc_#ufuncname#) < 0)
+        return NULL;
+    }
+    '''},
+    'initf90modhooks': {ismoduleroutine: '''
+    {
+      static PyUFuncGenericFunction funcs[1] = {#ufuncname#};
+      static void *data[1];
+      static char types[] = {#ufunctypes#};
+      if (f2py_ufunc_addattr(PyDict_GetItemString(d,"#f90modulename#"),"#name#",funcs,data,types,#ufuncnin#,#ufuncnout#,doc_#ufuncname#) < 0)
+        return NULL;
+    }
+    '''},
+    'sharedecls': """\
+extern F2PY_HIDDEN char doc_#ufuncname#[];
+extern F2PY_HIDDEN """ + ufuncproto + ";\n",
+    'need': ['f2py_ufunc_addattr'],
+}
+
 ################## Rules for C/API function ##############
 
 rout_rules = [
@@ -387,12 +637,30 @@ rout_rules = [
         'apiname': 'f2py_rout_#modulename#_#name#',
         'pyname': '#modulename#.#name#',
         'decl': '',
-        '_check': l_not(ismoduleroutine)
+        '_check': l_and(l_not(ismoduleroutine), l_not(isbatch))
     }, {
         'apiname': 'f2py_rout_#modulename#_#f90modulename#_#name#',
         'pyname': '#modulename#.#f90modulename#.#name#',
         'decl': '',
-        '_check': ismoduleroutine
+        '_check': l_and(ismoduleroutine, l_not(isbatch))
+    }, {  # Batched wrapper
+        'apiname': 'f2py_batch_#modulename#_#name#',
+        'pyname': '#modulename#.#name#.batch',
+        'decl': '',
+        '_check': l_and(l_not(ismoduleroutine), isbatch)
+    }, {
+        'apiname': 'f2py_batch_#modulename#_#f90modulename#_#name#',
+        'pyname': '#modulename#.#f90modulename#.#name#.batch',
+        'decl': '',
+        '_check': l_and(ismoduleroutine, isbatch)
+    }, {
+        'batchsize': '/*batchsize*/', 'batchbefore': '/*batchbefore*/',
+        'batchcapture': '/*batchcapture*/', 'batchslice': '/*batchslice*/',
+        'batchcall': {l_not(l_and(isfunction, l_not(isfunction_wrap))):
+                      '            (*f2py_func)(#callfortran#);'},
+        'batchstore': '/*batchstore*/', 'batchcleanup': '/*batchcleanup*/',
+        'batchreturn': '', 'batchreturnformat': '',
+        '_check': isbatch
     }, {  # Subroutine
         'functype': 'void',
         'declfortranroutine': {l_and(l_not(l_or(ismoduleroutine, isintent_c)), l_not(isdummyroutine)): 'extern void #F_FUNC#(#fortranname#,#FORTRANNAME#)(#callprotoargument#);',
@@ -554,6 +822,18 @@ rout_rules = [
         'return': {iscomplexfunction: ',#name#_return_value_capi',
                    l_not(l_or(iscomplexfunction, isintent_hide)): ',#name#_return_value'},
         '_check': l_and(isfunction, l_not(isstringfunction), l_not(isfunction_wrap))
+    }, {  # Batched scalar function
+        'decl': '    PyArrayObject *capi_#name#_return_value_batch = NULL;',
+        'batchbefore': """\
+    capi_#name#_return_value_batch = F2PyBatch_New(#atype#,NULL,0,0,capi_batch);
+    if (capi_#name#_return_value_batch == NULL)
+        f2py_success = 0;""",
+        'batchcapture': '        #ctype# *capi_#name#_return_value_data = (#ctype# *)PyArray_DATA(capi_#name#_return_value_batch);',
+        'batchcall': '            capi_#name#_return_value_data[capi_i] = (*f2py_func)(#callfortran#);',
+        'batchreturnformat': {l_not(isintent_hide): 'N'},
+        'batchreturn': {l_not(isintent_hide): ',F2PyBatch_Result(capi_#name#_return_value_batch,0,capi_batch)'},
+        'batchcleanup': '    Py_XDECREF(capi_#name#_return_value_batch);',
+        '_check': l_and(isbatch, isfunction, l_not(isstringfunction), l_not(isfunction_wrap))
     }, {  # String function # in use for --no-wrap
         'declfortranroutine': 'extern void #F_FUNC#(#fortranname#,#FORTRANNAME#)(#callprotoargument#);',
         'routine_def': {l_not(l_or(ismoduleroutine, isintent_c)):
@@ -706,6 +986,9 @@ aux_rules = [
     }
 ]
 
+# The hidden intent(out) scalars without initial value are only results
+_isbatchresult = l_and(isintent_out, isintent_hide, l_not(hasinitvalue))
+
 arg_rules = [
     {
         'separatorsfor': sepdict
@@ -1008,6 +1291,7 @@ if (#varname#_cb.capi==Py_None) {
                  '    const int #varname#_Rank = #rank#;',
                  '    PyArrayObject *capi_#varname#_tmp = NULL;',
                  '    int capi_#varname#_intent = 0;',
+                 {isbatch: '    PyArrayObject *capi_#varname#_batch = NULL;'},
                  ],
         'callfortran':'#varname#,',
         'return':{isintent_out: ',capi_#varname#_tmp'},
@@ -1045,7 +1329,8 @@ if (#varname#_cb.capi==Py_None) {
         '_check': isarray,
         '_depend': ''
     }, {  # Not hidden
-        'decl': '    PyObject *#varname#_capi = Py_None;',
+        'decl': ['    PyObject *#varname#_capi = Py_None;',
+                 '    static F2PyCopyStats capi_#varname#_copystats = {"#pyname#","#varname#"};'],
         'argformat': {isrequired: 'O'},
         'keyformat': {isoptional: 'O'},
         'args_capi': {isrequired: ',&#varname#_capi'},
@@ -1054,10 +1339,14 @@ if (#varname#_cb.capi==Py_None) {
     }, {
         'frompyobj': ['    #setdims#;',
                       '    capi_#varname#_intent |= #intent#;',
-                      {isintent_hide:
+                      {l_and(isintent_hide, l_not(isbatch)):
                        '    capi_#varname#_tmp = array_from_pyobj(#atype#,#varname#_Dims,#varname#_Rank,capi_#varname#_intent,Py_None);'},
-                      {isintent_nothide:
-                       '    capi_#varname#_tmp = array_from_pyobj(#atype#,#varname#_Dims,#varname#_Rank,capi_#varname#_intent,#varname#_capi);'},
+                      {l_and(isintent_nothide, l_not(isbatch)):
+                       '    capi_#varname#_tmp = array_from_pyobj_stats(#atype#,#varname#_Dims,#varname#_Rank,capi_#varname#_intent,#varname#_capi,&capi_#varname#_copystats);'},
+                      {l_and(isintent_hide, isbatch):
+                       '    capi_#varname#_tmp = F2PyBatch_FromPyObj(#atype#,#varname#_Dims,#varname#_Rank,capi_#varname#_intent,Py_None,capi_batch,&capi_#varname#_batch);'},
+                      {l_and(isintent_nothide, isbatch):
+                       '    capi_#varname#_tmp = F2PyBatch_FromPyObj(#atype#,#varname#_Dims,#varname#_Rank,capi_#varname#_intent,#varname#_capi,capi_batch,&capi_#varname#_batch);'},
                       """\
     if (capi_#varname#_tmp == NULL) {
         PyObject *exc, *val, *tb;
@@ -1090,16 +1379,46 @@ if (#varname#_cb.capi==Py_None) {
                       ],
         'cleanupfrompyobj': [  # note that this list will be reversed
             '    }  /*if (capi_#varname#_tmp == NULL) ... else of #varname#*/',
-            {l_not(l_or(isintent_out, isintent_hide)): """\
+            {l_not(l_or(isintent_out, isintent_hide, isbatch)): """\
     if((PyObject *)capi_#varname#_tmp!=#varname#_capi) {
         Py_XDECREF(capi_#varname#_tmp); }"""},
-            {l_and(isintent_hide, l_not(isintent_out))
+            {l_and(isintent_hide, l_not(isintent_out), l_not(isbatch))
                    : """        Py_XDECREF(capi_#varname#_tmp);"""},
+            {isbatch: """\
+        Py_XDECREF(capi_#varname#_tmp);
+        F2PyBatch_Release(capi_#varname#_batch);"""},
             {hasinitvalue: '    }  /*if (f2py_success) of #varname# init*/'},
         ],
         '_check': isarray,
         '_depend': ''
     },
+    # Batched wrappers
+    {
+        'batchsize': {isintent_nothide: """\
+    if (!F2PyBatch_Size(#varname#_capi,&capi_batch,\"#pyname#() #nth# (#varname#)\"))
+        return NULL;"""},
+        'batchcapture': ['        char *capi_#varname#_data = PyArray_BYTES(capi_#varname#_batch);',
+                         '        const npy_intp capi_#varname#_step = F2PY_BATCH_STEP(capi_#varname#_batch,capi_batch);'],
+        'batchslice': '            #ctype# *#varname# = (#ctype# *)(capi_#varname#_data + capi_i * capi_#varname#_step);',
+        'batchreturnformat': {isintent_out: 'N'},
+        'batchreturn': {isintent_out: ',F2PyBatch_Result(capi_#varname#_batch,capi_#varname#_intent,capi_batch)'},
+        '_check': l_and(isbatch, isarray)
+    }, {
+        'decl': {isintent_out: '    PyArrayObject *capi_#varname#_batch = NULL;'},
+        'batchbefore': {isintent_out: """\
+    capi_#varname#_batch = F2PyBatch_New(#atype#,NULL,0,0,capi_batch);
+    if (capi_#varname#_batch == NULL)
+        f2py_success = 0;"""},
+        'batchcapture': [{l_not(_isbatchresult): '        const #ctype# capi_#varname#_value = #varname#;'},
+                         {isintent_out: '        #ctype# *capi_#varname#_data = (#ctype# *)PyArray_DATA(capi_#varname#_batch);'}],
+        'batchslice': [{l_not(_isbatchresult): '            #ctype# #varname# = capi_#varname#_value;'},
+                       {_isbatchresult: '            #ctype# #varname#;'}],
+        'batchstore': {isintent_out: '            capi_#varname#_data[capi_i] = #varname#;'},
+        'batchreturnformat': {isintent_out: 'N'},
+        'batchreturn': {isintent_out: ',F2PyBatch_Result(capi_#varname#_batch,0,capi_batch)'},
+        'batchcleanup': {isintent_out: '    Py_XDECREF(capi_#varname#_batch);'},
+        '_check': l_and(isbatch, isscalar)
+    },
     # Scalararray
     {  # Common
         '_check': l_and(isarray, l_not(iscomplexarray))
@@ -1186,17 +1505,23 @@ def buildmodule(m, um):
     rd = dictappend({'f2py_version': f2py_version}, vrd)
     funcwrappers = []
     funcwrappers2 = []  # F90 codes
+    wrappers = []  # the bodies of the wrappers split in shards
+    # The bodies of the interfaced routines by name, the first one in an
+    # interface block and the last interface block taking precedence
+    bodies = {}
+    nbadblocks = 0
+    for bi in m['body']:
+        if bi['block'] not in ['interface', 'abstract interface']:
+            nbadblocks += 1
+            continue
+        bbodies = {}
+        for b in bi['body']:
+            bbodies.setdefault(b['name'], b)
+        bodies.update(bbodies)
     for n in m['interfaced']:
-        nb = None
-        for bi in m['body']:
-            if bi['block'] not in ['interface', 'abstract interface']:
-                errmess('buildmodule: Expected interface block. Skipping.\n')
-                continue
-            for b in bi['body']:
-                if b['name'] == n:
-                    nb = b
-                    break
-
+        for i in range(nbadblocks):
+            errmess('buildmodule: Expected interface block. Skipping.\n')
+        nb = bodies.get(n)
         if not nb:
             errmess(
                 'buildmodule: Could not found the body of interfaced routine "%s". Skipping.\n' % (n))
@@ -1220,6 +1545,8 @@ def buildmodule(m, um):
                 else:
                     funcwrappers.append(wrap)
             ar = applyrules(api, vrd)
+            if options.get('shards'):
+                wrappers.append(ar.pop('body'))
             rd = dictappend(rd, ar)
 
     # Construct COMMON block support
@@ -1275,109 +1602,320 @@ def buildmodule(m, um):
         if ('_check' in r and r['_check'](m)) or ('_check' not in r):
             ar = applyrules(r, vrd, m)
             rd = dictappend(rd, ar)
+    shards = []
+    if options.get('shards'):
+        bodies = shardbodies(flatlist(wrappers), options['shards'])
+        cbdecls = [cb_rules.cb_sharedecls[k]
+                   for k in needs.get('callbacks', [])
+                   if k in cb_rules.cb_sharedecls]
+        root, ext = os.path.splitext(vrd['coutput'])
+        for i, body in enumerate(bodies, 1):
+            srd = dict(rd, body=body, callbacks='\n'.join(cbdecls),
+                       moduleobjects=shardmoduleobjects,
+                       shardoutput='%s_shard%d%s' % (root, i, ext))
+            shards.append((srd['shardoutput'],
+                           applyrules(shard_rules, srd)['shardbody']))
+        rd['body'] = flatlist(rd.get('sharedecls', [])) + \
+            flatlist(rd.get('body', []))
+        rd['moduleobjects'] = sharedmoduleobjects
+    else:
+        rd['moduleobjects'] = moduleobjects
     ar = applyrules(module_rules, rd)
 
+    # The files are written only when their content changes, see
+    # writefile, and listed in ret['generated'].
+    ret['generated'] = []
     fn = os.path.join(options['buildpath'], vrd['coutput'])
     ret['csrc'] = fn
-    with open(fn, 'w') as f:
-        f.write(ar['modulebody'].replace('\t', 2 * ' '))
+    writefile(fn, ar['modulebody'].replace('\t', 2 * ' '))
+    ret['generated'].append(fn)
     outmess('    Wrote C/API module "%s" to file "%s"\n' % (m['name'], fn))
+    if shards:
+        ret['shardsrc'] = []
+        for sn, text in shards:
+            fn = os.path.join(options['buildpath'], sn)
+            writefile(fn, text.replace('\t', 2 * ' '))
+            ret['shardsrc'].append(fn)
+            ret['generated'].append(fn)
+        outmess('    Wrote the wrappers of module "%s" to %d files "%s"\n' % (
+            m['name'], len(shards), '", "'.join(ret['shardsrc'])))
 
     if options['dorestdoc']:
         fn = os.path.join(
             options['buildpath'], vrd['modulename'] + 'module.rest')
-        with open(fn, 'w') as f:
-            f.write('.. -*- rest -*-\n')
-            f.write('\n'.join(ar['restdoc']))
+        writefile(fn, '.. -*- rest -*-\n' + '\n'.join(ar['restdoc']))
+        ret['generated'].append(fn)
         outmess('    ReST Documentation is saved to file "%s/%smodule.rest"\n' %
                 (options['buildpath'], vrd['modulename']))
     if options['dolatexdoc']:
         fn = os.path.join(
             options['buildpath'], vrd['modulename'] + 'module.tex')
         ret['ltx'] = fn
-        with open(fn, 'w') as f:
-            f.write(
-                '%% This file is auto-generated with f2py (version:%s)\n' % (f2py_version))
-            if 'shortlatex' not in options:
-                f.write(
-                    '\\documentclass{article}\n\\usepackage{a4wide}\n\\begin{document}\n\\tableofcontents\n\n')
-                f.write('\n'.join(ar['latexdoc']))
-            if 'shortlatex' not in options:
-                f.write('\\end{document}')
+        text = ('%% This file is auto-generated with f2py (version:%s)\n'
+                % (f2py_version))
+        if 'shortlatex' not in options:
+            text += ('\\documentclass{article}\n\\usepackage{a4wide}\n'
+                     '\\begin{document}\n\\tableofcontents\n\n')
+            text += '\n'.join(ar['latexdoc'])
+        if 'shortlatex' not in options:
+            text += '\\end{document}'
+        writefile(fn, text)
+        ret['generated'].append(fn)
         outmess('    Documentation is saved to file "%s/%smodule.tex"\n' %
                 (options['buildpath'], vrd['modulename']))
     if funcwrappers:
         wn = os.path.join(options['buildpath'], vrd['f2py_wrapper_output'])
         ret['fsrc'] = wn
-        with open(wn, 'w') as f:
-            f.write('C     -*- fortran -*-\n')
-            f.write(
-                'C     This file is autogenerated with f2py (version:%s)\n' % (f2py_version))
-            f.write(
-                'C     It contains Fortran 77 wrappers to fortran functions.\n')
-            lines = []
-            for l in ('\n\n'.join(funcwrappers) + '\n').split('\n'):
-                if 0 <= l.find('!') < 66:
-                    # don't split comment lines
-                    lines.append(l + '\n')
-                elif l and l[0] == ' ':
-                    while len(l) >= 66:
-                        lines.append(l[:66] + '\n     &')
-                        l = l[66:]
-                    lines.append(l + '\n')
-                else:
-                    lines.append(l + '\n')
-            lines = ''.join(lines).replace('\n     &\n', '\n')
-            f.write(lines)
+        lines = ['C     -*- fortran -*-\n',
+                 'C     This file is autogenerated with f2py (version:%s)\n'
+                 % (f2py_version),
+                 'C     It contains Fortran 77 wrappers to fortran functions.\n']
+        for l in ('\n\n'.join(funcwrappers) + '\n').split('\n'):
+            if 0 <= l.find('!') < 66:
+                # don't split comment lines
+                lines.append(l + '\n')
+            elif l and l[0] == ' ':
+                while len(l) >= 66:
+                    lines.append(l[:66] + '\n     &')
+                    l = l[66:]
+                lines.append(l + '\n')
+            else:
+                lines.append(l + '\n')
+        writefile(wn, ''.join(lines).replace('\n     &\n', '\n'))
+        ret['generated'].append(wn)
         outmess('    Fortran 77 wrappers are saved to "%s"\n' % (wn))
     if funcwrappers2:
         wn = os.path.join(
             options['buildpath'], '%s-f2pywrappers2.f90' % (vrd['modulename']))
         ret['fsrc'] = wn
-        with open(wn, 'w') as f:
-            f.write('!     -*- f90 -*-\n')
-            f.write(
-                '!     This file is autogenerated with f2py (version:%s)\n' % (f2py_version))
-            f.write(
-                '!     It contains Fortran 90 wrappers to fortran functions.\n')
-            lines = []
-            for l in ('\n\n'.join(funcwrappers2) + '\n').split('\n'):
-                if 0 <= l.find('!') < 72:
-                    # don't split comment lines
-                    lines.append(l + '\n')
-                elif len(l) > 72 and l[0] == ' ':
-                    lines.append(l[:72] + '&\n     &')
-                    l = l[72:]
-                    while len(l) > 66:
-                        lines.append(l[:66] + '&\n     &')
-                        l = l[66:]
-                    lines.append(l + '\n')
-                else:
-                    lines.append(l + '\n')
-            lines = ''.join(lines).replace('\n     &\n', '\n')
-            f.write(lines)
+        lines = ['!     -*- f90 -*-\n',
+                 '!     This file is autogenerated with f2py (version:%s)\n'
+                 % (f2py_version),
+                 '!     It contains Fortran 90 wrappers to fortran functions.\n']
+        for l in ('\n\n'.join(funcwrappers2) + '\n').split('\n'):
+            if 0 <= l.find('!') < 72:
+                # don't split comment lines
+                lines.append(l + '\n')
+            elif len(l) > 72 and l[0] == ' ':
+                lines.append(l[:72] + '&\n     &')
+                l = l[72:]
+                while len(l) > 66:
+                    lines.append(l[:66] + '&\n     &')
+                    l = l[66:]
+                lines.append(l + '\n')
+            else:
+                lines.append(l + '\n')
+        writefile(wn, ''.join(lines).replace('\n     &\n', '\n'))
+        ret['generated'].append(wn)
         outmess('    Fortran 90 wrappers are saved to "%s"\n' % (wn))
     return ret
 
+
+def shardbodies(bodies, nshards):
+    """
+    Split the wrappers of a module in nshards translation units.
+
+    Returns the list of bodies split in nshards contiguous lists of about
+    the same size. The wrappers are defined F2PY_HIDDEN (see #static#)
+    and the tables of the module refer to them by their 'sharedecls'.
+    """
+    shards = [[] for i in range(nshards)]
+    total = sum(map(len, bodies)) or 1
+    size = 0
+    for body in bodies:
+        shards[min(size * nshards // total, nshards - 1)].append(body)
+        size += len(body)
+    return shards
+
+
 ################## Build C/API function #############
 
 stnd = {1: 'st', 2: 'nd', 3: 'rd', 4: 'th', 5: 'th',
         6: 'th', 7: 'th', 8: 'th', 9: 'th', 0: 'th'}
 
 
+def usesglobals(rout):
+    """Return whether the routine may use COMMON blocks or module variables.
+    """
+    return bool(rout.get('common') or rout.get('modulevars') or
+                [m for m in rout.get('use', {}) if '__user__' not in m])
+
+
+def releasesgil(rout):
+    """Return whether the wrapper of the routine releases the GIL with
+    --release-gil=auto: the routine does not call Python and, unless
+    --release-gil-shared=release, does not use COMMON blocks or module
+    variables.
+    """
+    if options.get('release_gil') != 'auto':
+        return False
+    if l_or(hasexternals, hascallstatement, isdummyroutine)(rout) or \
+            any(isintent_callback(v) for v in rout['vars'].values()):
+        return False
+    return options.get('release_gil_shared') == 'release' or \
+        not usesglobals(rout)
+
+
+def batchable(rout):
+    """Return why no batched wrapper of the routine is built with --batch,
+    or None. The batched wrapper calls the routine with the GIL released:
+    the routine does not call Python, and its arguments are numeric
+    arrays, without initial values, and scalars. At least one array
+    argument gives the batch size.
+    """
+    if l_or(hasexternals, hascallstatement, isdummyroutine,
+            isstringfunction)(rout):
+        return 'call-back, callstatement, dummy or string routine'
+    args, depargs = getargs2(rout)
+    var = rout['vars']
+    if 'nthreads' in args:
+        return 'argument nthreads'
+    for a in args:
+        if isintent_aux(var[a]):
+            continue
+        if l_or(isstring, isexternal, isstringarray)(var[a]):
+            return 'argument %s is not numeric' % (a)
+        if isscalar(var[a]) and isintent_inout(var[a]):
+            return 'scalar argument %s is intent(inout)' % (a)
+        if isarray(var[a]) and hasinitvalue(var[a]):
+            return 'array argument %s has an initial value' % (a)
+    if not [a for a in args if l_and(isarray, isintent_nothide)(var[a])]:
+        return 'no array argument'
+    return None
+
+
+def ufuncable(rout):
+    """Return why no ufunc of the routine is built with --ufunc, or None.
+    The arguments of the routine are numeric scalars, the inputs and the
+    outputs of the ufunc. The loops of ufuncs run without the GIL: unless
+    the routine is elemental, it does not use COMMON blocks or module
+    variables, as with --release-gil=auto.
+    """
+    if l_or(hasexternals, hascallstatement, isdummyroutine,
+            isstringfunction)(rout):
+        return 'call-back, callstatement, dummy or string routine'
+    args, depargs = getargs2(rout)
+    var = rout['vars']
+    if l_and(isfunction, l_not(isfunction_wrap))(rout):
+        args = args + [rout.get('result', rout['name'])]
+    for a in args:
+        if not isscalar(var[a]) or isintent_aux(var[a]) or \
+                capi_maps.getctype(var[a]) not in capi_maps.c2capi_map:
+            return 'argument %s is not a numeric scalar' % (a)
+        if isintent_inout(var[a]):
+            return 'argument %s is intent(inout)' % (a)
+        if isintent_hide(var[a]) and not isintent_out(var[a]):
+            return 'argument %s is hidden' % (a)
+        if 'check' in var[a]:
+            return 'argument %s is checked' % (a)
+    if not [a for a in args if isintent_nothide(var[a])]:
+        return 'no input argument'
+    if not iselemental(rout) and usesglobals(rout) and \
+            options.get('release_gil_shared') != 'release':
+        return 'may use COMMON blocks or module variables'
+    return None
+
+
+def buildufunc(rout, args, rd):
+    """Return the dictionary of the rules of the ufunc of the routine. The
+    inputs of the ufunc are the arguments of the wrapper and its outputs
+    the values returned by the wrapper, in the same order.
+    """
+    var = rout['vars']
+    ins = [a for a in args if isrequired(var[a])] + \
+        [a for a in args if isoptional(var[a])]
+    outs = [a for a in args if isintent_out(var[a])]
+    # The value of a function that is not wrapped is returned by the call
+    isvalue = l_and(isfunction, l_not(isfunction_wrap))(rout)
+    if isvalue:
+        outs.insert(0, rd['rname'])
+    ctypes = dict((a, capi_maps.getctype(var[a])) for a in ins + outs)
+    element = '(capi_args[%d] + capi_i * capi_steps[%d])'
+    load, store = [], []
+    for a in args:
+        if a in ins:
+            load.append('        %s %s = *(%s *)%s;' % (
+                ctypes[a], a, ctypes[a], element % ((ins.index(a),) * 2)))
+        else:
+            load.append('        %s %s;' % (ctypes[a], a))
+    call = '        (*f2py_func)(%s);' % (rd['callfortran'])
+    for i, a in enumerate(outs):
+        out = '*(%s *)%s' % (ctypes[a], element % ((len(ins) + i,) * 2))
+        if isvalue and i == 0:
+            call = '        %s = (*f2py_func)(%s);' % (out, rd['callfortran'])
+        else:
+            store.append('        %s = %s;' % (out, a))
+    if ismoduleroutine(rout):
+        ufuncname = 'f2py_ufunc_#modulename#_%s_%s' % (
+            rout['modulename'], rout['name'])
+    else:
+        ufuncname = 'f2py_ufunc_#modulename#_%s' % (rout['name'])
+    doc = '%s = %s(%s)\\n\\nUfunc of ``%s``, called on each element.' % (
+        ', '.join(outs), rout['name'], ', '.join(ins), rout['name'])
+    return dict(rd, ufuncname=ufuncname, ufuncdoc=doc,
+                ufuncload='\n'.join(load), ufunccall=call,
+                ufuncstore='\n'.join(store),
+                ufunctypes=','.join(capi_maps.c2capi_map[ctypes[a]]
+                                    for a in ins + outs),
+                ufuncnin=repr(len(ins)), ufuncnout=repr(len(outs)))
+
+
 def buildapi(rout):
     rout, wrap = func2subr.assubr(rout)
+    if not isthreadsafe(rout) and releasesgil(rout):
+        # The wrapper is generated as for the threadsafe directive
+        rout = dict(rout, f2pyenhancements=dict(
+            rout.get('f2pyenhancements', {}), threadsafe=''))
     args, depargs = getargs2(rout)
     capi_maps.depargs = depargs
-    var = rout['vars']
 
     if ismoduleroutine(rout):
         outmess('            Constructing wrapper function "%s.%s"...\n' %
                 (rout['modulename'], rout['name']))
     else:
         outmess('        Constructing wrapper function "%s"...\n' % (rout['name']))
+    rd = buildroutine(rout, args, depargs)
+    ar = applyrules(routine_rules, rd)
+    if ismoduleroutine(rout):
+        outmess('              %s\n' % (ar['docshort']))
+    else:
+        outmess('          %s\n' % (ar['docshort']))
+    if options.get('batch'):
+        reason = batchable(rout)
+        if reason:
+            outmess('          No batched wrapper of "%s": %s.\n' %
+                    (rout['name'], reason))
+        else:
+            outmess('          Constructing batched wrapper "%s.batch"...\n'
+                    % (rout['name']))
+            # The routine and its arguments are marked for the rules of
+            # the batched wrapper, see isbatch
+            brout = dict(rout, batch='', vars={
+                a: dict(v, batch='') for a, v in rout['vars'].items()})
+            ar = dictappend(ar, applyrules(
+                batch_routine_rules, buildroutine(brout, args, depargs),
+                brout))
+    if options.get('ufunc'):
+        reason = ufuncable(rout)
+        if reason:
+            outmess('          No ufunc of "%s": %s.\n' %
+                    (rout['name'], reason))
+        else:
+            outmess('          Constructing ufunc "%s.ufunc"...\n'
+                    % (rout['name']))
+            ar = dictappend(ar, applyrules(
+                ufunc_routine_rules, buildufunc(rout, args, rd), rout))
+    return ar, wrap
+
+
+def buildroutine(rout, args, depargs):
+    """Return the dictionary of the rules of the wrapper of the routine
+    applied to the routine and its arguments.
+    """
+    var = rout['vars']
     # Routine
     vrd = capi_maps.routsign2map(rout)
+    vrd['static'] = 'F2PY_HIDDEN' if options.get('shards') else 'static'
     rd = dictappend({}, vrd)
     for r in rout_rules:
         if ('_check' in r and r['_check'](rout)) or ('_check' not in r):
@@ -1475,12 +2013,16 @@ def buildapi(rout):
                 ['\\begin{description}'] + rd[k][1:] +\
                 ['\\end{description}']
 
-    ar = applyrules(routine_rules, rd)
-    if ismoduleroutine(rout):
-        outmess('              %s\n' % (ar['docshort']))
-    else:
-        outmess('          %s\n' % (ar['docshort']))
-    return ar, wrap
+    # The required arguments are objects (O) and, when they are all
+    # given by position, are taken from the arguments of the call
+    argsfast = replace('#args_capi#', {'args_capi': rd['args_capi']})
+    argsfast = argsfast.split(',&')[1:]
+    rd['nargsfast'] = repr(len(argsfast))
+    rd['argsfast'] = '\n'.join('        %s = capi_args[%d];' % (a, i)
+                               for i, a in enumerate(argsfast)) or \
+        '        /* no required arguments */'
+
+    return rd
 
 
 #################### EOF rules.py #######################
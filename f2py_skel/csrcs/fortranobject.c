@@ -5,8 +5,14 @@
 extern "C" {
 #endif
 
+#include <stddef.h>
 #include <stdlib.h>
 #include <string.h>
+#ifdef _WIN32
+#include <windows.h>
+#else
+#include <time.h>
+#endif
 
 /*
   This file implements: FortranObject, array_from_pyobj, copy_ND_array
@@ -101,9 +107,245 @@ F2PyGetThreadLocalCallbackPtr(char *key)
     return prev;
 }
 
+/********************* F2PyArg_ParseVectorcall **************************/
+
+static int
+f2py_argparser_init(F2PyArgParser *parser)
+{
+    const char *p;
+    PyObject *kwtuple, *name;
+    int i;
+    parser->len = parser->min = 0;
+    for (p = parser->format; *p != '\0' && *p != ':'; p++) {
+        if (*p == '|') {
+            parser->min = parser->len;
+        }
+        else if (*p != '!') {
+            parser->len++;
+        }
+    }
+    parser->fname = (*p == ':') ? p + 1 : "function";
+    kwtuple = PyTuple_New(parser->len);
+    if (kwtuple == NULL) {
+        return -1;
+    }
+    for (i = 0; i < parser->len; i++) {
+        if (parser->kwlist[i] == NULL) {
+            PyErr_Format(PyExc_SystemError,
+                         "%.200s(): more format units than argument names",
+                         parser->fname);
+            Py_DECREF(kwtuple);
+            return -1;
+        }
+        name = PyUnicode_InternFromString(parser->kwlist[i]);
+        if (name == NULL) {
+            Py_DECREF(kwtuple);
+            return -1;
+        }
+        PyTuple_SET_ITEM(kwtuple, i, name);
+    }
+    parser->kwtuple = kwtuple;
+    return 0;
+}
+
+/* Returns the index of name in kwnames, or -1 */
+static Py_ssize_t
+f2py_kwindex(PyObject *kwnames, PyObject *name)
+{
+    Py_ssize_t i, n = PyTuple_GET_SIZE(kwnames);
+    /* The keyword names of calls in Python code are interned */
+    for (i = 0; i < n; i++) {
+        if (PyTuple_GET_ITEM(kwnames, i) == name) {
+            return i;
+        }
+    }
+    for (i = 0; i < n; i++) {
+        if (PyUnicode_Compare(PyTuple_GET_ITEM(kwnames, i), name) == 0) {
+            return i;
+        }
+    }
+    return -1;
+}
+
+/*
+  Parses the arguments of a vectorcall as PyArg_ParseTupleAndKeywords
+  parses the arguments of a call, with the same error messages. The
+  argument names are interned on first use, so that the keyword
+  arguments are usually found by identity. Returns 1 on success and 0 on
+  failure.
+*/
+int
+F2PyArg_ParseVectorcall(PyObject *const *args, Py_ssize_t nargs,
+                        PyObject *kwnames, F2PyArgParser *parser, ...)
+{
+    va_list va;
+    const char *format;
+    Py_ssize_t nkwargs = (kwnames == NULL) ? 0 : PyTuple_GET_SIZE(kwnames);
+    Py_ssize_t nfound = 0, i, j;
+    PyObject *arg, **p;
+    PyTypeObject *type;
+    long ival;
+    int *ip;
+
+    if (parser->kwtuple == NULL && f2py_argparser_init(parser) < 0) {
+        return 0;
+    }
+    if (nargs + nkwargs > parser->len) {
+        PyErr_Format(PyExc_TypeError,
+                     "%.200s() takes at most %d %sargument%s (%zd given)",
+                     parser->fname, parser->len, (nargs == 0) ? "keyword " : "",
+                     (parser->len == 1) ? "" : "s", nargs + nkwargs);
+        return 0;
+    }
+    va_start(va, parser);
+    format = parser->format;
+    for (i = 0; i < parser->len; i++) {
+        if (*format == '|') {
+            format++;
+        }
+        arg = NULL;
+        if (i < nargs) {
+            arg = args[i];
+        }
+        else if (nkwargs > nfound) {
+            j = f2py_kwindex(kwnames,
+                             PyTuple_GET_ITEM(parser->kwtuple, i));
+            if (j >= 0) {
+                arg = args[nargs + j];
+                nfound++;
+            }
+        }
+        if (arg == NULL && i < parser->min) {
+            PyErr_Format(PyExc_TypeError,
+                         "%.200s() missing required argument '%s' (pos %zd)",
+                         parser->fname, parser->kwlist[i], i + 1);
+            goto fail;
+        }
+        switch (*format++) {
+            case 'O':
+                if (*format == '!') {
+                    format++;
+                    type = va_arg(va, PyTypeObject *);
+                    p = va_arg(va, PyObject **);
+                    if (arg != NULL && !PyObject_TypeCheck(arg, type)) {
+                        PyErr_Format(PyExc_TypeError,
+                                     "%.200s() argument %zd must be %.50s, "
+                                     "not %.50s",
+                                     parser->fname, i + 1, type->tp_name,
+                                     (arg == Py_None) ? "None"
+                                                      : Py_TYPE(arg)->tp_name);
+                        goto fail;
+                    }
+                }
+                else {
+                    p = va_arg(va, PyObject **);
+                }
+                if (arg != NULL) {
+                    *p = arg;
+                }
+                break;
+            case 'i':
+                ip = va_arg(va, int *);
+                if (arg == NULL) {
+                    break;
+                }
+                ival = PyLong_AsLong(arg);
+                if (ival == -1 && PyErr_Occurred()) {
+                    goto fail;
+                }
+                if (ival > INT_MAX) {
+                    PyErr_SetString(PyExc_OverflowError,
+                                    "signed integer is greater than maximum");
+                    goto fail;
+                }
+                if (ival < INT_MIN) {
+                    PyErr_SetString(PyExc_OverflowError,
+                                    "signed integer is less than minimum");
+                    goto fail;
+                }
+                *ip = (int)ival;
+                break;
+            default:
+                PyErr_Format(PyExc_SystemError,
+                             "%.200s(): bad format unit '%c'", parser->fname,
+                             format[-1]);
+                goto fail;
+        }
+    }
+    va_end(va);
+    if (nfound < nkwargs) {
+        /* Arguments given by name and position, or unknown names */
+        for (i = 0; i < nargs; i++) {
+            if (f2py_kwindex(kwnames, PyTuple_GET_ITEM(parser->kwtuple, i)) >=
+                0) {
+                PyErr_Format(PyExc_TypeError,
+                             "argument for %.200s() given by name ('%s') "
+                             "and position (%zd)",
+                             parser->fname, parser->kwlist[i], i + 1);
+                return 0;
+            }
+        }
+        for (j = 0; j < nkwargs; j++) {
+            arg = PyTuple_GET_ITEM(kwnames, j);
+            for (i = 0; i < parser->len; i++) {
+                if (PyUnicode_Compare(arg, PyTuple_GET_ITEM(parser->kwtuple,
+                                                            i)) == 0) {
+                    break;
+                }
+            }
+            if (i == parser->len) {
+                PyErr_Format(PyExc_TypeError,
+                             "'%U' is an invalid keyword argument for "
+                             "%.200s()",
+                             arg, parser->fname);
+                return 0;
+            }
+        }
+    }
+    return 1;
+fail:
+    va_end(va);
+    return 0;
+}
+
 /************************* FortranObject *******************************/
 
-typedef PyObject *(*fortranfunc)(PyObject *, PyObject *, PyObject *, void *);
+/*
+  Checks that the array obj is still the view of data, of the given
+  type, shape and flags, as created by PyArray_New: a view may have
+  been reshaped or had its flags changed since.
+*/
+static int
+array_view_check(PyObject *obj, const int type_num, const int rank,
+                 npy_intp *dims, const int itemsize, char *data,
+                 const int flags)
+{
+    PyArrayObject *arr = (PyArrayObject *)obj;
+    npy_intp stride;
+    int i;
+
+    if (!PyArray_CheckExact(obj))
+        return 0;
+    if (PyArray_DATA(arr) != data || PyArray_TYPE(arr) != type_num ||
+        PyArray_NDIM(arr) != rank || !PyArray_ISNOTSWAPPED(arr) ||
+        !PyArray_CHKFLAGS(arr, flags) ||
+        (itemsize > 0 && PyArray_ITEMSIZE(arr) != itemsize))
+        return 0;
+    stride = PyArray_ITEMSIZE(arr);
+    for (i = 0; i < rank; ++i) {
+        int j = (flags & NPY_ARRAY_C_CONTIGUOUS) ? rank - i - 1 : i;
+        if (PyArray_DIM(arr, j) != dims[j] ||
+            PyArray_STRIDE(arr, j) != stride)
+            return 0;
+        if (dims[j])
+            stride *= dims[j];
+    }
+    return 1;
+}
+
+static PyObject *
+fortran_vectorcall(PyObject *fp, PyObject *const *args, size_t nargsf,
+                   PyObject *kwnames);
 
 PyObject *
 PyFortranObject_New(FortranDataDef *defs, f2py_void_func init)
@@ -122,6 +364,9 @@ PyFortranObject_New(FortranDataDef *defs, f2py_void_func init)
         Py_DECREF(fp);
         return NULL;
     }
+    fp->vectorcall = fortran_vectorcall;
+    fp->index = NULL;
+    fp->views = NULL;
     fp->len = 0;
     while (defs[fp->len].name != NULL) {
         fp->len++;
@@ -130,6 +375,23 @@ PyFortranObject_New(FortranDataDef *defs, f2py_void_func init)
         goto fail;
     }
     fp->defs = defs;
+    /* The attributes are looked up by name in the index */
+    if ((fp->index = PyDict_New()) == NULL) {
+        goto fail;
+    }
+    if ((fp->views = PyMem_Calloc(fp->len, sizeof(PyObject *))) == NULL) {
+        PyErr_NoMemory();
+        goto fail;
+    }
+    for (i = 0; i < fp->len; i++) {
+        v = PyLong_FromLong(i);
+        if (v == NULL ||
+            PyDict_SetItemString(fp->index, fp->defs[i].name, v) < 0) {
+            Py_XDECREF(v);
+            goto fail;
+        }
+        Py_DECREF(v);
+    }
     for (i = 0; i < fp->len; i++) {
         if (fp->defs[i].rank == -1) { /* Is Fortran routine */
             v = PyFortranObject_NewAsAttr(&(fp->defs[i]));
@@ -178,6 +440,9 @@ PyFortranObject_NewAsAttr(FortranDataDef *defs)
     }
     fp->len = 1;
     fp->defs = defs;
+    fp->vectorcall = fortran_vectorcall;
+    fp->index = NULL;
+    fp->views = NULL;
     return (PyObject *)fp;
 }
 
@@ -186,6 +451,14 @@ PyFortranObject_NewAsAttr(FortranDataDef *defs)
 static void
 fortran_dealloc(PyFortranObject *fp)
 {
+    int i;
+    if (fp->views != NULL) {
+        for (i = 0; i < fp->len; i++) {
+            Py_XDECREF(fp->views[i]);
+        }
+        PyMem_Free(fp->views);
+    }
+    Py_XDECREF(fp->index);
     Py_XDECREF(fp->dict);
     PyObject_Del(fp);
 }
@@ -337,12 +610,146 @@ set_data(char *d, npy_intp *f)
     /* printf("set_data: d=%p,f=%d\n",d,*f); */
 }
 
+/* Returns the index of the def of name, -1 if there is none, or -2 on
+   error */
+static int
+fortran_index(PyFortranObject *fp, PyObject *name)
+{
+    PyObject *v;
+    const char *s;
+    int i;
+    if (fp->index != NULL) {
+        v = PyDict_GetItemWithError(fp->index, name);
+        if (v == NULL)
+            return PyErr_Occurred() ? -2 : -1;
+        return (int)PyLong_AsLong(v);
+    }
+    if ((s = PyUnicode_AsUTF8(name)) == NULL)
+        return -2;
+    for (i = 0; i < fp->len; i++)
+        if (strcmp(s, fp->defs[i].name) == 0)
+            return i;
+    return -1;
+}
+
 static PyObject *
-fortran_getattr(PyFortranObject *fp, char *name)
+fortran_getarray(PyFortranObject *fp, int i)
+{ /* F90 allocatable array */
+    int k, flag;
+    PyObject *v;
+    if (fp->defs[i].func == NULL)
+        return NULL;
+    for (k = 0; k < fp->defs[i].rank; ++k) fp->defs[i].dims.d[k] = -1;
+    save_def = &fp->defs[i];
+    (*(fp->defs[i].func))(&fp->defs[i].rank, fp->defs[i].dims.d, set_data,
+                          &flag);
+    if (flag == 2)
+        k = fp->defs[i].rank + 1;
+    else
+        k = fp->defs[i].rank;
+    v = (fp->views != NULL ? fp->views[i] : NULL);
+    if (fp->defs[i].data == NULL) { /* array is not allocated */
+        if (fp->views != NULL)
+            Py_CLEAR(fp->views[i]);
+        Py_RETURN_NONE;
+    }
+    /* The view of the previous access is reused until the array is
+       reallocated */
+    if (v != NULL && array_view_check(v, fp->defs[i].type, k,
+                                      fp->defs[i].dims.d, 0,
+                                      fp->defs[i].data, NPY_ARRAY_FARRAY)) {
+        Py_INCREF(v);
+        return v;
+    }
+    v = PyArray_New(&PyArray_Type, k, fp->defs[i].dims.d, fp->defs[i].type,
+                    NULL, fp->defs[i].data, 0, NPY_ARRAY_FARRAY, NULL);
+    if (v == NULL)
+        return NULL;
+    if (fp->views != NULL) {
+        Py_INCREF(v);
+        Py_XSETREF(fp->views[i], v);
+    }
+    return v;
+}
+
+static PyObject *
+fortran_getattro(PyFortranObject *fp, PyObject *name);
+static int
+fortran_setattro(PyFortranObject *fp, PyObject *name, PyObject *v);
+
+/*
+  Bulk access to the variables of a Fortran module or COMMON block:
+  _getvars(*names) returns the tuple of their values and
+  _setvars(**values) sets them. The names cannot clash with those of
+  Fortran variables, which do not start with an underscore.
+*/
+
+static PyObject *
+fortran_getvars(PyObject *fp, PyObject *const *args, Py_ssize_t nargs)
 {
-    int i, j, k, flag;
+    PyObject *ret, *v;
+    Py_ssize_t i;
+    ret = PyTuple_New(nargs);
+    if (ret == NULL)
+        return NULL;
+    for (i = 0; i < nargs; i++) {
+        if (!PyUnicode_Check(args[i])) {
+            PyErr_Format(PyExc_TypeError,
+                         "_getvars: names must be str, not %.200s",
+                         Py_TYPE(args[i])->tp_name);
+            goto fail;
+        }
+        v = fortran_getattro((PyFortranObject *)fp, args[i]);
+        if (v == NULL)
+            goto fail;
+        PyTuple_SET_ITEM(ret, i, v);
+    }
+    return ret;
+fail:
+    Py_DECREF(ret);
+    return NULL;
+}
+
+static PyObject *
+fortran_setvars(PyObject *fp, PyObject *args, PyObject *kwds)
+{
+    PyObject *name, *v;
+    Py_ssize_t pos = 0;
+    int i;
+    if (PyTuple_GET_SIZE(args) != 0) {
+        PyErr_SetString(PyExc_TypeError,
+                        "_setvars: the values must be keyword arguments");
+        return NULL;
+    }
+    while (kwds != NULL && PyDict_Next(kwds, &pos, &name, &v)) {
+        i = fortran_index((PyFortranObject *)fp, name);
+        if (i == -2)
+            return NULL;
+        if (i == -1 || ((PyFortranObject *)fp)->defs[i].rank == -1) {
+            PyErr_Format(PyExc_AttributeError,
+                         "_setvars: %U is not a Fortran variable", name);
+            return NULL;
+        }
+        if (fortran_setattro((PyFortranObject *)fp, name, v) < 0)
+            return NULL;
+    }
+    Py_RETURN_NONE;
+}
+
+static PyMethodDef fortran_varmethods[] = {
+        {"_getvars", (PyCFunction)(void (*)(void))fortran_getvars,
+         METH_FASTCALL, "Return the values of the named variables."},
+        {"_setvars", (PyCFunction)(void (*)(void))fortran_setvars,
+         METH_VARARGS | METH_KEYWORDS, "Set the variables given by name."},
+        {NULL}};
+
+static PyObject *
+fortran_getattro(PyFortranObject *fp, PyObject *name)
+{
+    int i;
+    const char *str;
     if (fp->dict != NULL) {
-        PyObject *v = _PyDict_GetItemStringWithError(fp->dict, name);
+        PyObject *v = PyDict_GetItemWithError(fp->dict, name);
         if (v == NULL && PyErr_Occurred()) {
             return NULL;
         }
@@ -351,39 +758,18 @@ fortran_getattr(PyFortranObject *fp, char *name)
             return v;
         }
     }
-    for (i = 0, j = 1; i < fp->len && (j = strcmp(name, fp->defs[i].name));
-         i++)
-        ;
-    if (j == 0)
-        if (fp->defs[i].rank != -1) { /* F90 allocatable array */
-            if (fp->defs[i].func == NULL)
-                return NULL;
-            for (k = 0; k < fp->defs[i].rank; ++k) fp->defs[i].dims.d[k] = -1;
-            save_def = &fp->defs[i];
-            (*(fp->defs[i].func))(&fp->defs[i].rank, fp->defs[i].dims.d,
-                                  set_data, &flag);
-            if (flag == 2)
-                k = fp->defs[i].rank + 1;
-            else
-                k = fp->defs[i].rank;
-            if (fp->defs[i].data != NULL) { /* array is allocated */
-                PyObject *v = PyArray_New(
-                        &PyArray_Type, k, fp->defs[i].dims.d, fp->defs[i].type,
-                        NULL, fp->defs[i].data, 0, NPY_ARRAY_FARRAY, NULL);
-                if (v == NULL)
-                    return NULL;
-                /* Py_INCREF(v); */
-                return v;
-            }
-            else { /* array is not allocated */
-                Py_RETURN_NONE;
-            }
-        }
-    if (strcmp(name, "__dict__") == 0) {
+    i = fortran_index(fp, name);
+    if (i == -2)
+        return NULL;
+    if (i >= 0 && fp->defs[i].rank != -1)
+        return fortran_getarray(fp, i);
+    if ((str = PyUnicode_AsUTF8(name)) == NULL)
+        return NULL;
+    if (strcmp(str, "__dict__") == 0) {
         Py_INCREF(fp->dict);
         return fp->dict;
     }
-    if (strcmp(name, "__doc__") == 0) {
+    if (strcmp(str, "__doc__") == 0) {
         PyObject *s = PyUnicode_FromString(""), *s2, *s3;
         for (i = 0; i < fp->len; i++) {
             s2 = fortran_doc(fp->defs[i]);
@@ -392,33 +778,35 @@ fortran_getattr(PyFortranObject *fp, char *name)
             Py_DECREF(s);
             s = s3;
         }
-        if (PyDict_SetItemString(fp->dict, name, s))
+        if (PyDict_SetItem(fp->dict, name, s))
             return NULL;
         return s;
     }
-    if ((strcmp(name, "_cpointer") == 0) && (fp->len == 1)) {
+    if ((strcmp(str, "_cpointer") == 0) && (fp->len == 1)) {
         PyObject *cobj =
                 F2PyCapsule_FromVoidPtr((void *)(fp->defs[0].data), NULL);
-        if (PyDict_SetItemString(fp->dict, name, cobj))
+        if (PyDict_SetItem(fp->dict, name, cobj))
             return NULL;
         return cobj;
     }
-    PyObject *str, *ret;
-    str = PyUnicode_FromString(name);
-    ret = PyObject_GenericGetAttr((PyObject *)fp, str);
-    Py_DECREF(str);
-    return ret;
+    if (fp->index != NULL) { /* Fortran module or COMMON block */
+        PyMethodDef *m;
+        for (m = fortran_varmethods; m->ml_name != NULL; m++)
+            if (strcmp(str, m->ml_name) == 0)
+                return PyCFunction_New(m, (PyObject *)fp);
+    }
+    return PyObject_GenericGetAttr((PyObject *)fp, name);
 }
 
 static int
-fortran_setattr(PyFortranObject *fp, char *name, PyObject *v)
+fortran_setattro(PyFortranObject *fp, PyObject *name, PyObject *v)
 {
-    int i, j, flag;
+    int i, flag;
     PyArrayObject *arr = NULL;
-    for (i = 0, j = 1; i < fp->len && (j = strcmp(name, fp->defs[i].name));
-         i++)
-        ;
-    if (j == 0) {
+    i = fortran_index(fp, name);
+    if (i == -2)
+        return -1;
+    if (i >= 0) {
         if (fp->defs[i].rank == -1) {
             PyErr_SetString(PyExc_AttributeError,
                             "over-writing fortran routine");
@@ -481,40 +869,69 @@ fortran_setattr(PyFortranObject *fp, char *name, PyObject *v)
             return -1;
     }
     if (v == NULL) {
-        int rv = PyDict_DelItemString(fp->dict, name);
+        int rv = PyDict_DelItem(fp->dict, name);
         if (rv < 0)
             PyErr_SetString(PyExc_AttributeError,
                             "delete non-existing fortran attribute");
         return rv;
     }
     else
-        return PyDict_SetItemString(fp->dict, name, v);
+        return PyDict_SetItem(fp->dict, name, v);
 }
 
 static PyObject *
-fortran_call(PyFortranObject *fp, PyObject *arg, PyObject *kw)
+fortran_vectorcall(PyObject *fp, PyObject *const *args, size_t nargsf,
+                   PyObject *kwnames)
 {
-    int i = 0;
+    FortranDataDef *def = ((PyFortranObject *)fp)->defs;
     /*  printf("fortran call
-        name=%s,func=%p,data=%p,%p\n",fp->defs[i].name,
-        fp->defs[i].func,fp->defs[i].data,&fp->defs[i].data); */
-    if (fp->defs[i].rank == -1) { /* is Fortran routine */
-        if (fp->defs[i].func == NULL) {
+        name=%s,func=%p,data=%p,%p\n",def->name,
+        def->func,def->data,&def->data); */
+    if (def->rank == -1) { /* is Fortran routine */
+        if (def->func == NULL) {
             PyErr_Format(PyExc_RuntimeError, "no function to call");
             return NULL;
         }
-        else if (fp->defs[i].data == NULL)
-            /* dummy routine */
-            return (*((fortranfunc)(fp->defs[i].func)))((PyObject *)fp, arg,
-                                                        kw, NULL);
-        else
-            return (*((fortranfunc)(fp->defs[i].func)))(
-                    (PyObject *)fp, arg, kw, (void *)fp->defs[i].data);
+        /* data is NULL for dummy routines */
+        return (*((fortranfunc)(def->func)))(
+                fp, args, PyVectorcall_NARGS(nargsf), kwnames,
+                (void *)def->data);
     }
     PyErr_Format(PyExc_TypeError, "this fortran object is not callable");
     return NULL;
 }
 
+static PyObject *
+fortran_call(PyFortranObject *fp, PyObject *arg, PyObject *kw)
+{
+    Py_ssize_t nargs = PyTuple_GET_SIZE(arg), nkw, pos = 0, i;
+    PyObject **stack = NULL, *kwnames = NULL, *key, *value, *ret = NULL;
+    if (kw == NULL || (nkw = PyDict_GET_SIZE(kw)) == 0) {
+        return fortran_vectorcall((PyObject *)fp, &PyTuple_GET_ITEM(arg, 0),
+                                  nargs, NULL);
+    }
+    /* The keyword arguments follow the positional arguments */
+    stack = PyMem_New(PyObject *, nargs + nkw);
+    kwnames = PyTuple_New(nkw);
+    if (stack == NULL || kwnames == NULL) {
+        PyErr_NoMemory();
+        goto fail;
+    }
+    for (i = 0; i < nargs; i++) {
+        stack[i] = PyTuple_GET_ITEM(arg, i);
+    }
+    for (i = 0; PyDict_Next(kw, &pos, &key, &value); i++) {
+        Py_INCREF(key);
+        PyTuple_SET_ITEM(kwnames, i, key);
+        stack[nargs + i] = value;
+    }
+    ret = fortran_vectorcall((PyObject *)fp, stack, nargs, kwnames);
+fail:
+    PyMem_Free(stack);
+    Py_XDECREF(kwnames);
+    return ret;
+}
+
 static PyObject *
 fortran_repr(PyFortranObject *fp)
 {
@@ -535,10 +952,14 @@ PyTypeObject PyFortran_Type = {
         PyVarObject_HEAD_INIT(NULL, 0).tp_name = "fortran",
         .tp_basicsize = sizeof(PyFortranObject),
         .tp_dealloc = (destructor)fortran_dealloc,
-        .tp_getattr = (getattrfunc)fortran_getattr,
-        .tp_setattr = (setattrfunc)fortran_setattr,
+        .tp_getattro = (getattrofunc)fortran_getattro,
+        .tp_setattro = (setattrofunc)fortran_setattro,
         .tp_repr = (reprfunc)fortran_repr,
         .tp_call = (ternaryfunc)fortran_call,
+#ifdef Py_TPFLAGS_HAVE_VECTORCALL
+        .tp_vectorcall_offset = offsetof(PyFortranObject, vectorcall),
+        .tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_HAVE_VECTORCALL,
+#endif
 };
 
 /************************* f2py_report_atexit *******************************/
@@ -769,6 +1190,52 @@ swap_arrays(PyArrayObject *obj1, PyArrayObject *obj2)
      (PyArray_ISCOMPLEX(arr) && PyTypeNum_ISCOMPLEX(type_num)) || \
      (PyArray_ISBOOL(arr) && PyTypeNum_ISBOOL(type_num)))
 
+/*
+  Objects that export a buffer (PEP 3118) are viewed as arrays, except
+  bytes and numpy scalars that are converted as Python objects.
+*/
+#define F2PY_ISBUFFER(obj)                             \
+    (PyObject_CheckBuffer(obj) && !PyBytes_Check(obj) && \
+     !PyArray_IsScalar(obj, Generic))
+
+/*
+  Returns an array viewing the buffer of obj when its type, item size,
+  contiguity and alignment are the ones required by intent, so that
+  the Fortran routine can use the buffer without a copy. Otherwise
+  returns NULL without setting an exception.
+*/
+static PyArrayObject *
+buffer_as_array(const int type_num, const int elsize, npy_intp *dims,
+                const int rank, const int intent, PyObject *obj)
+{
+    npy_intp view_dims[F2PY_MAX_DIMS];
+    PyArrayObject *arr =
+            (PyArrayObject *)PyArray_FromAny(obj, NULL, 0, 0, 0, NULL);
+    if (arr == NULL) {
+        PyErr_Clear();
+        return NULL;
+    }
+    if (!PyArray_CHKFLAGS(arr, NPY_ARRAY_OWNDATA) &&
+        PyArray_ITEMSIZE(arr) == elsize && ARRAY_ISCOMPATIBLE(arr, type_num) &&
+        F2PY_CHECK_ALIGNMENT(arr, intent) &&
+        /* intent(inout) and intent(inplace) require writable input */
+        ((intent & (F2PY_INTENT_INOUT | F2PY_INTENT_INPLACE))
+                 ? ((intent & F2PY_INTENT_C) ? PyArray_ISCARRAY(arr)
+                                             : PyArray_ISFARRAY(arr))
+                 : ((intent & F2PY_INTENT_C) ? PyArray_ISCARRAY_RO(arr)
+                                             : PyArray_ISFARRAY_RO(arr)))) {
+        /* dims is left unchanged when the dimensions do not match */
+        memcpy(view_dims, dims, rank * sizeof(npy_intp));
+        if (!check_and_fix_dimensions(arr, rank, view_dims)) {
+            memcpy(dims, view_dims, rank * sizeof(npy_intp));
+            return arr;
+        }
+        PyErr_Clear();
+    }
+    Py_DECREF(arr);
+    return NULL;
+}
+
 extern PyArrayObject *
 array_from_pyobj(const int type_num, npy_intp *dims, const int rank,
                  const int intent, PyObject *obj)
@@ -931,6 +1398,15 @@ array_from_pyobj(const int type_num, npy_intp *dims, const int rank,
         return arr;
     }
 
+    if (!(intent & (F2PY_INTENT_CACHE | F2PY_INTENT_COPY)) &&
+        F2PY_ISBUFFER(obj)) {
+        /* Returning a view of the input buffer */
+        arr = buffer_as_array(type_num, elsize, dims, rank, intent, obj);
+        if (arr != NULL) {
+            return arr;
+        }
+    }
+
     if ((intent & F2PY_INTENT_INOUT) || (intent & F2PY_INTENT_INPLACE) ||
         (intent & F2PY_INTENT_CACHE)) {
         PyErr_Format(PyExc_TypeError,
@@ -952,10 +1428,13 @@ array_from_pyobj(const int type_num, npy_intp *dims, const int rank,
             descr->type = NPY_CHARLTR;
         }
         F2PY_REPORT_ON_ARRAY_COPY_FROMANY;
+        /* Buffers are viewed unless a copy is required */
         arr = (PyArrayObject *)PyArray_FromAny(
                 obj, descr, 0, 0,
                 ((intent & F2PY_INTENT_C) ? NPY_ARRAY_CARRAY
                                           : NPY_ARRAY_FARRAY) |
+                        ((intent & F2PY_INTENT_COPY) ? NPY_ARRAY_ENSURECOPY
+                                                     : 0) |
                         NPY_ARRAY_FORCECAST,
                 NULL);
         if (arr == NULL)
@@ -1165,6 +1644,764 @@ copy_ND_array(const PyArrayObject *arr, PyArrayObject *out)
     return PyArray_CopyInto(out, (PyArrayObject *)arr);
 }
 
+/************************* copy audit **********************************/
+
+/*
+  Runtime audit of the copies made when converting the array arguments
+  of the wrappers. The state is per extension module: each module links
+  its own fortranobject.c. The statistics are only updated when the
+  audit is enabled, with the GIL held.
+*/
+
+static int copy_audit = 0;
+static F2PyCopyStats *copy_stats = NULL; /* Registered statistics */
+
+static const char *copy_reasons[F2PY_COPY_NREASONS] = {
+        "dtype", "non-contiguous", "order", "alignment", "non-array",
+        "intent(copy)"};
+
+/* Return the reason why array_from_pyobj copies the array arr */
+static int
+array_copy_reason(PyArrayObject *arr, const int type_num, const int intent)
+{
+    PyArray_Descr *descr = PyArray_DescrFromType(type_num);
+    int elsize = (type_num == NPY_STRING) ? 1 : descr->elsize;
+    Py_DECREF(descr);
+    if (intent & F2PY_INTENT_COPY)
+        return F2PY_COPY_INTENT;
+    if (PyArray_ITEMSIZE(arr) != elsize || !ARRAY_ISCOMPATIBLE(arr, type_num))
+        return F2PY_COPY_DTYPE;
+    if (!F2PY_CHECK_ALIGNMENT(arr, intent))
+        return F2PY_COPY_ALIGNMENT;
+    if ((intent & F2PY_INTENT_C) ? PyArray_ISFARRAY_RO(arr)
+                                 : PyArray_ISCARRAY_RO(arr))
+        return F2PY_COPY_ORDER;
+    return F2PY_COPY_NONCONTIGUOUS;
+}
+
+extern PyArrayObject *
+array_from_pyobj_stats(const int type_num, npy_intp *dims, const int rank,
+                       const int intent, PyObject *obj, F2PyCopyStats *stats)
+{
+    PyArrayObject *arr;
+    void *data = NULL;
+    int reason = -1;
+
+    if (!copy_audit || (intent & (F2PY_INTENT_HIDE | F2PY_INTENT_CACHE)) ||
+        ((intent & F2PY_OPTIONAL) && obj == Py_None)) {
+        return array_from_pyobj(type_num, dims, rank, intent, obj);
+    }
+    /* The input is inspected before intent(inplace) changes it */
+    if (PyArray_Check(obj)) {
+        data = PyArray_DATA((PyArrayObject *)obj);
+        reason = array_copy_reason((PyArrayObject *)obj, type_num, intent);
+    }
+    arr = array_from_pyobj(type_num, dims, rank, intent, obj);
+    if (arr == NULL)
+        return NULL;
+    if (!stats->registered) {
+        stats->registered = 1;
+        stats->next = copy_stats;
+        copy_stats = stats;
+    }
+    stats->calls++;
+    if (reason < 0) {
+        /* Buffers are viewed when possible */
+        if (!PyArray_CHKFLAGS(arr, NPY_ARRAY_OWNDATA))
+            return arr;
+        reason = F2PY_COPY_NONARRAY;
+    }
+    else if ((PyObject *)arr == obj && PyArray_DATA(arr) == data) {
+        return arr;
+    }
+    stats->copies++;
+    stats->bytes += PyArray_NBYTES(arr);
+    stats->reasons[reason]++;
+    return arr;
+}
+
+static PyObject *
+copy_audit_set(PyObject *self, PyObject *args)
+{
+    int flag;
+    PyObject *ret = PyBool_FromLong(copy_audit);
+    if (!PyArg_ParseTuple(args, "p:__f2py_copy_audit__", &flag)) {
+        Py_DECREF(ret);
+        return NULL;
+    }
+    copy_audit = flag;
+    return ret;
+}
+
+static PyObject *
+copy_audit_stats(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"reset", NULL};
+    int reset = 0;
+    F2PyCopyStats *stats;
+    PyObject *ret, *routine, *argument, *reasons;
+    int i;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "|p:__f2py_copy_stats__",
+                                     kwlist, &reset))
+        return NULL;
+    if ((ret = PyDict_New()) == NULL)
+        return NULL;
+    for (stats = copy_stats; stats != NULL; stats = stats->next) {
+        routine = PyDict_GetItemString(ret, stats->routine);
+        if (routine == NULL) {
+            if ((routine = PyDict_New()) == NULL)
+                goto fail;
+            if (PyDict_SetItemString(ret, stats->routine, routine)) {
+                Py_DECREF(routine);
+                goto fail;
+            }
+            Py_DECREF(routine);
+        }
+        if ((reasons = PyDict_New()) == NULL)
+            goto fail;
+        for (i = 0; i < F2PY_COPY_NREASONS; i++) {
+            PyObject *n;
+            if (!stats->reasons[i])
+                continue;
+            if ((n = PyLong_FromSsize_t(stats->reasons[i])) == NULL ||
+                PyDict_SetItemString(reasons, copy_reasons[i], n)) {
+                Py_XDECREF(n);
+                Py_DECREF(reasons);
+                goto fail;
+            }
+            Py_DECREF(n);
+        }
+        argument = Py_BuildValue("{s:n,s:n,s:n,s:N}", "calls", stats->calls,
+                                 "copies", stats->copies, "bytes",
+                                 stats->bytes, "reasons", reasons);
+        if (argument == NULL ||
+            PyDict_SetItemString(routine, stats->argument, argument)) {
+            Py_XDECREF(argument);
+            goto fail;
+        }
+        Py_DECREF(argument);
+    }
+    if (reset) {
+        while (copy_stats != NULL) {
+            stats = copy_stats;
+            copy_stats = stats->next;
+            stats->calls = stats->copies = stats->bytes = 0;
+            memset(stats->reasons, 0, sizeof(stats->reasons));
+            stats->next = NULL;
+            stats->registered = 0;
+        }
+    }
+    return ret;
+fail:
+    Py_DECREF(ret);
+    return NULL;
+}
+
+static PyMethodDef copy_audit_methods[] = {
+        {"__f2py_copy_audit__", copy_audit_set, METH_VARARGS,
+         "__f2py_copy_audit__(flag) -> bool\n\n"
+         "Enable or disable the audit of the copies of array arguments,\n"
+         "return the previous state. The audit is disabled by default."},
+        {"__f2py_copy_stats__", (PyCFunction)(void (*)(void))copy_audit_stats,
+         METH_VARARGS | METH_KEYWORDS,
+         "__f2py_copy_stats__(reset=False) -> dict\n\n"
+         "Return the statistics of the audit of the copies of array\n"
+         "arguments as {routine: {argument: {'calls': int, 'copies': int,\n"
+         "'bytes': int, 'reasons': {reason: int}}}}. The reasons are\n"
+         "'dtype', 'non-contiguous', 'order', 'alignment', 'non-array'\n"
+         "and 'intent(copy)'. With reset=True the statistics are cleared."},
+        {NULL, NULL}};
+
+extern int
+F2PyCopyAudit_AddFunctions(PyObject *module)
+{
+    return PyModule_AddFunctions(module, copy_audit_methods);
+}
+
+/************************* call timing *********************************/
+
+/*
+  Runtime timing of the calls of the wrappers. A wrapper times the
+  conversion of its arguments, the call of the Fortran routine and the
+  building of its return value with a F2PyCallClock, and adds the times
+  to the statistics of the routine. The time spent in Python call-back
+  functions is accumulated per thread by the call-backs, see
+  callback_time, and subtracted from the phase of the wrapper in which
+  they are called, so that the call-backs of the other threads are not
+  counted while the routine runs without the GIL. As for the copy audit,
+  the statistics are per extension module and are updated with the GIL
+  held.
+*/
+
+int f2py_call_timing = 0;
+static F2PyCallStats *call_stats = NULL; /* Registered statistics */
+
+/* The storage class of the call-back time, as F2PY_THREAD_LOCAL_DECL
+   of the active call-backs (see cfuncs.py) */
+#ifndef F2PY_THREAD_LOCAL_DECL
+#if defined(_MSC_VER) \
+      || defined(_WIN32) || defined(_WIN64) \
+      || defined(__MINGW32__) || defined(__MINGW64__)
+#define F2PY_THREAD_LOCAL_DECL __declspec(thread)
+#elif defined(__cplusplus) && (__cplusplus >= 201103L)
+#define F2PY_THREAD_LOCAL_DECL thread_local
+#elif defined(__STDC_VERSION__) && (__STDC_VERSION__ >= 201112L)
+#define F2PY_THREAD_LOCAL_DECL _Thread_local
+#elif defined(__GNUC__) || defined(__clang__) || defined(__INTEL_COMPILER)
+#define F2PY_THREAD_LOCAL_DECL __thread
+#endif
+#endif
+
+#if defined(F2PY_THREAD_LOCAL_DECL) && !defined(F2PY_USE_PYTHON_TLS)
+
+static F2PY_THREAD_LOCAL_DECL npy_int64 f2py_callback_time = 0;
+
+/* Return the time spent in call-back functions by the thread */
+static npy_int64 *
+callback_time(void)
+{
+    return &f2py_callback_time;
+}
+
+#else
+
+static void
+callback_time_free(PyObject *capsule)
+{
+    PyMem_RawFree(PyCapsule_GetPointer(capsule, NULL));
+}
+
+/* Return the time spent in call-back functions by the thread, kept in
+   the thread state dictionary of Python */
+static npy_int64 *
+callback_time(void)
+{
+    PyObject *local_dict, *capsule;
+    npy_int64 *time;
+
+    local_dict = PyThreadState_GetDict();
+    if (local_dict == NULL) {
+        Py_FatalError("callback_time: PyThreadState_GetDict failed");
+    }
+    capsule = PyDict_GetItemString(local_dict, "__f2py_callback_time");
+    if (capsule != NULL) {
+        return (npy_int64 *)PyCapsule_GetPointer(capsule, NULL);
+    }
+    time = (npy_int64 *)PyMem_RawCalloc(1, sizeof(npy_int64));
+    if (time == NULL) {
+        Py_FatalError("callback_time: PyMem_RawCalloc failed");
+    }
+    capsule = PyCapsule_New(time, NULL, callback_time_free);
+    if (capsule == NULL) {
+        Py_FatalError("callback_time: PyCapsule_New failed");
+    }
+    if (PyDict_SetItemString(local_dict, "__f2py_callback_time", capsule)) {
+        Py_FatalError("callback_time: PyDict_SetItemString failed");
+    }
+    Py_DECREF(capsule);
+    return time;
+}
+
+#endif
+
+static const char *call_phases[F2PY_CALL_NPHASES] = {"convert", "fortran",
+                                                      "build", "callback"};
+
+/* Return a monotonic time in nanoseconds */
+extern npy_int64
+F2PyClock_Now(void)
+{
+#ifdef _WIN32
+    static LARGE_INTEGER frequency = {0};
+    LARGE_INTEGER counter;
+    if (frequency.QuadPart == 0)
+        QueryPerformanceFrequency(&frequency);
+    QueryPerformanceCounter(&counter);
+    return (npy_int64)((double)counter.QuadPart * 1e9 /
+                       (double)frequency.QuadPart);
+#else
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (npy_int64)ts.tv_sec * 1000000000 + ts.tv_nsec;
+#endif
+}
+
+extern void
+F2PyCallClock_Start(F2PyCallClock *clock)
+{
+    clock->start = clock->lap = F2PyClock_Now();
+    clock->callback = *callback_time();
+}
+
+/* Add the time since the previous lap to the phase */
+extern void
+F2PyCallClock_Lap(F2PyCallClock *clock, const int phase)
+{
+    npy_int64 now = F2PyClock_Now();
+    npy_int64 total = *callback_time();
+    npy_int64 callback = total - clock->callback;
+    clock->time[phase] += now - clock->lap - callback;
+    clock->time[F2PY_CALL_CALLBACK] += callback;
+    clock->lap = now;
+    clock->callback = total;
+}
+
+/* Add the time of the last phase and of the call to the statistics */
+extern void
+F2PyCallClock_Stop(F2PyCallClock *clock, const int phase,
+                   F2PyCallStats *stats)
+{
+    npy_int64 total;
+    int i, bin = 0;
+
+    F2PyCallClock_Lap(clock, phase);
+    if (!stats->registered) {
+        stats->registered = 1;
+        stats->next = call_stats;
+        call_stats = stats;
+    }
+    stats->calls++;
+    for (i = 0; i < F2PY_CALL_NPHASES; i++)
+        stats->time[i] += clock->time[i];
+    total = clock->lap - clock->start;
+    while (total > 1 && bin < F2PY_CALL_NBINS - 1) {
+        total >>= 1;
+        bin++;
+    }
+    stats->histogram[bin]++;
+}
+
+/* Add the time of a call-back function started at *start */
+extern void
+F2PyCallClock_Callback(npy_int64 *start)
+{
+    if (*start) {
+        *callback_time() += F2PyClock_Now() - *start;
+        *start = 0;
+    }
+}
+
+static PyObject *
+call_timing_set(PyObject *self, PyObject *args)
+{
+    int flag;
+    PyObject *ret = PyBool_FromLong(f2py_call_timing);
+    if (!PyArg_ParseTuple(args, "p:__f2py_call_timing__", &flag)) {
+        Py_DECREF(ret);
+        return NULL;
+    }
+    f2py_call_timing = flag;
+    return ret;
+}
+
+static PyObject *
+call_timing_stats(PyObject *self, PyObject *args, PyObject *kwds)
+{
+    static char *kwlist[] = {"reset", NULL};
+    int reset = 0;
+    F2PyCallStats *stats;
+    PyObject *ret, *routine, *histogram, *n;
+    int i;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwds, "|p:__f2py_call_stats__",
+                                     kwlist, &reset))
+        return NULL;
+    if ((ret = PyDict_New()) == NULL)
+        return NULL;
+    for (stats = call_stats; stats != NULL; stats = stats->next) {
+        if ((histogram = PyDict_New()) == NULL)
+            goto fail;
+        for (i = 0; i < F2PY_CALL_NBINS; i++) {
+            PyObject *key;
+            if (!stats->histogram[i])
+                continue;
+            key = PyLong_FromLongLong((long long)1 << i);
+            n = PyLong_FromSsize_t(stats->histogram[i]);
+            if (key == NULL || n == NULL ||
+                PyDict_SetItem(histogram, key, n)) {
+                Py_XDECREF(key);
+                Py_XDECREF(n);
+                Py_DECREF(histogram);
+                goto fail;
+            }
+            Py_DECREF(key);
+            Py_DECREF(n);
+        }
+        routine = Py_BuildValue("{s:n,s:N}", "calls", stats->calls,
+                                "histogram", histogram);
+        if (routine == NULL)
+            goto fail;
+        for (i = 0; i < F2PY_CALL_NPHASES; i++) {
+            n = PyFloat_FromDouble((double)stats->time[i] * 1e-9);
+            if (n == NULL || PyDict_SetItemString(routine, call_phases[i], n)) {
+                Py_XDECREF(n);
+                Py_DECREF(routine);
+                goto fail;
+            }
+            Py_DECREF(n);
+        }
+        if (PyDict_SetItemString(ret, stats->routine, routine)) {
+            Py_DECREF(routine);
+            goto fail;
+        }
+        Py_DECREF(routine);
+    }
+    if (reset) {
+        while (call_stats != NULL) {
+            stats = call_stats;
+            call_stats = stats->next;
+            stats->calls = 0;
+            memset(stats->time, 0, sizeof(stats->time));
+            memset(stats->histogram, 0, sizeof(stats->histogram));
+            stats->next = NULL;
+            stats->registered = 0;
+        }
+    }
+    return ret;
+fail:
+    Py_DECREF(ret);
+    return NULL;
+}
+
+static PyMethodDef call_timing_methods[] = {
+        {"__f2py_call_timing__", call_timing_set, METH_VARARGS,
+         "__f2py_call_timing__(flag) -> bool\n\n"
+         "Enable or disable the timing of the calls of the routines,\n"
+         "return the previous state. The timing is disabled by default."},
+        {"__f2py_call_stats__", (PyCFunction)(void (*)(void))call_timing_stats,
+         METH_VARARGS | METH_KEYWORDS,
+         "__f2py_call_stats__(reset=False) -> dict\n\n"
+         "Return the statistics of the timing of the calls as\n"
+         "{routine: {'calls': int, 'convert': float, 'fortran': float,\n"
+         "'build': float, 'callback': float, 'histogram': {int: int}}}.\n"
+         "The times in seconds are spent converting the arguments, in the\n"
+         "Fortran routine, building the return value and in Python\n"
+         "call-back functions. The histogram counts the calls by their\n"
+         "duration: the key n is for the calls of n to 2*n nanoseconds.\n"
+         "With reset=True the statistics are cleared."},
+        {NULL, NULL}};
+
+extern int
+F2PyCallTiming_AddFunctions(PyObject *module)
+{
+    return PyModule_AddFunctions(module, call_timing_methods);
+}
+
+/************************* batched calls *******************************/
+
+/*
+  Conversions of the arguments of the batched wrappers, see
+  buildapi in rules.py. The arrays of a batched call have a leading batch
+  axis. They are converted to buffers holding the n slices one after the
+  other, each slice being contiguous in the order of the routine: the
+  batch axis is the last axis of a Fortran array and the first axis of a
+  C array. The wrapper converts the first slice as in the wrapper of the
+  routine, which checks its dimensions, and calls the routine on each
+  slice. The buffers hold at least one slice, so that the first slice of
+  an empty batch can be converted.
+*/
+
+extern int
+F2PyBatch_Size(PyObject *obj, npy_intp *n, const char *errmess)
+{
+    npy_intp size;
+    if (obj == Py_None)
+        return 1;
+    if (PyArray_Check(obj) && PyArray_NDIM((PyArrayObject *)obj) > 0)
+        size = PyArray_DIM((PyArrayObject *)obj, 0);
+    else if (!PyArray_Check(obj) && PySequence_Check(obj)) {
+        size = PySequence_Size(obj);
+        if (size < 0)
+            return 0;
+    }
+    else {
+        PyErr_Format(PyExc_ValueError, "%s: expected an array with a batch axis",
+                     errmess);
+        return 0;
+    }
+    if (*n >= 0 && size != *n) {
+        PyErr_Format(PyExc_ValueError,
+                     "%s: batch size %" NPY_INTP_FMT
+                     " does not match %" NPY_INTP_FMT,
+                     errmess, size, *n);
+        return 0;
+    }
+    *n = size;
+    return 1;
+}
+
+extern PyArrayObject *
+F2PyBatch_New(const int type_num, npy_intp *dims, const int rank,
+              const int intent, const npy_intp n)
+{
+    npy_intp bdims[F2PY_MAX_DIMS + 1];
+    PyArrayObject *batch;
+    if (count_negative_dimensions(rank, dims) > 0) {
+        PyErr_SetString(PyExc_ValueError,
+                        "failed to create batched intent(cache|hide)|optional "
+                        "array -- must have defined dimensions");
+        return NULL;
+    }
+    if (intent & F2PY_INTENT_C) {
+        bdims[0] = (n > 0 ? n : 1);
+        memcpy(bdims + 1, dims, rank * sizeof(npy_intp));
+    }
+    else {
+        memcpy(bdims, dims, rank * sizeof(npy_intp));
+        bdims[rank] = (n > 0 ? n : 1);
+    }
+    batch = (PyArrayObject *)PyArray_New(&PyArray_Type, rank + 1, bdims,
+                                         type_num, NULL, NULL, 0,
+                                         !(intent & F2PY_INTENT_C), NULL);
+    if (batch != NULL && !(intent & F2PY_INTENT_CACHE))
+        PyArray_FILLWBYTE(batch, 0);
+    return batch;
+}
+
+/* Return the buffer of the slices of the array obj with a batch axis */
+static PyArrayObject *
+batch_from_pyobj(const int type_num, const int intent, PyObject *obj,
+                 const npy_intp n)
+{
+    PyArrayObject *arr, *batch;
+    PyArray_Descr *descr;
+    PyArray_Dims perm;
+    npy_intp axes[NPY_MAXDIMS];
+    PyObject *slices;
+    int i, inout = intent & (F2PY_INTENT_INOUT | F2PY_INTENT_INPLACE);
+
+    if (PyArray_Check(obj)) {
+        arr = (PyArrayObject *)obj;
+        Py_INCREF(arr);
+    }
+    else if (inout) {
+        PyErr_Format(PyExc_TypeError,
+                     "failed to initialize batched intent(inout|inplace) "
+                     "array, input '%s' object is not an array",
+                     Py_TYPE(obj)->tp_name);
+        return NULL;
+    }
+    else {
+        arr = (PyArrayObject *)PyArray_FromAny(obj, NULL, 0, 0, 0, NULL);
+        if (arr == NULL)
+            return NULL;
+    }
+    if (PyArray_NDIM(arr) < 1 || PyArray_DIM(arr, 0) != n) {
+        PyErr_Format(PyExc_ValueError,
+                     "failed to initialize batched array -- expected a batch "
+                     "axis of size %" NPY_INTP_FMT,
+                     n);
+        Py_DECREF(arr);
+        return NULL;
+    }
+    descr = PyArray_DescrFromType(type_num);
+    if (inout && (PyArray_ITEMSIZE(arr) != descr->elsize ||
+                  !ARRAY_ISCOMPATIBLE(arr, type_num))) {
+        PyErr_Format(PyExc_ValueError,
+                     "failed to initialize batched intent(inout|inplace) "
+                     "array -- input '%c' not compatible to '%c'",
+                     PyArray_DESCR(arr)->type, descr->type);
+        Py_DECREF(descr);
+        Py_DECREF(arr);
+        return NULL;
+    }
+    if (n == 0) {
+        /* The first slice of an empty batch is zeros */
+        Py_DECREF(descr);
+        batch = F2PyBatch_New(type_num, PyArray_DIMS(arr) + 1,
+                              PyArray_NDIM(arr) - 1, intent & F2PY_INTENT_C, 0);
+        Py_DECREF(arr);
+        return batch;
+    }
+    if (intent & F2PY_INTENT_C) {
+        slices = (PyObject *)arr;
+    }
+    else {
+        /* The batch axis becomes the last axis */
+        for (i = 1; i < PyArray_NDIM(arr); i++) axes[i - 1] = i;
+        axes[PyArray_NDIM(arr) - 1] = 0;
+        perm.ptr = axes;
+        perm.len = PyArray_NDIM(arr);
+        slices = PyArray_Transpose(arr, &perm);
+        Py_DECREF(arr);
+        if (slices == NULL) {
+            Py_DECREF(descr);
+            return NULL;
+        }
+    }
+    batch = (PyArrayObject *)PyArray_FromAny(
+            slices, descr, 0, 0,
+            ((intent & F2PY_INTENT_C) ? NPY_ARRAY_C_CONTIGUOUS
+                                      : NPY_ARRAY_F_CONTIGUOUS) |
+                    NPY_ARRAY_ALIGNED |
+                    ((intent & F2PY_INTENT_COPY) ? NPY_ARRAY_ENSURECOPY : 0) |
+                    (inout ? NPY_ARRAY_WRITEABLE | NPY_ARRAY_WRITEBACKIFCOPY
+                           : NPY_ARRAY_FORCECAST),
+            NULL);
+    Py_DECREF(slices);
+    return batch;
+}
+
+extern PyArrayObject *
+F2PyBatch_FromPyObj(const int type_num, npy_intp *dims, const int rank,
+                    const int intent, PyObject *obj, const npy_intp n,
+                    PyArrayObject **batch)
+{
+    PyArrayObject *view, *arr;
+    int c = intent & F2PY_INTENT_C;
+
+    if ((intent & F2PY_INTENT_HIDE) ||
+        ((intent & (F2PY_INTENT_CACHE | F2PY_OPTIONAL)) && obj == Py_None))
+        *batch = F2PyBatch_New(type_num, dims, rank, intent, n);
+    else
+        *batch = batch_from_pyobj(type_num, intent, obj, n);
+    if (*batch == NULL)
+        return NULL;
+    /* The view of the first slice */
+    view = (PyArrayObject *)PyArray_New(
+            &PyArray_Type, PyArray_NDIM(*batch) - 1,
+            PyArray_DIMS(*batch) + (c ? 1 : 0), type_num, NULL,
+            PyArray_DATA(*batch), 0,
+            (c ? NPY_ARRAY_C_CONTIGUOUS : NPY_ARRAY_F_CONTIGUOUS) |
+                    NPY_ARRAY_ALIGNED |
+                    (PyArray_FLAGS(*batch) & NPY_ARRAY_WRITEABLE),
+            NULL);
+    if (view == NULL)
+        goto fail;
+    Py_INCREF(*batch);
+    if (PyArray_SetBaseObject(view, (PyObject *)*batch) < 0) {
+        Py_DECREF(view);
+        goto fail;
+    }
+    /* The dimensions of the slice are checked as in the wrapper */
+    arr = array_from_pyobj(type_num, dims, rank,
+                           intent & ~(F2PY_INTENT_OUT | F2PY_INTENT_HIDE |
+                                      F2PY_INTENT_CACHE | F2PY_INTENT_COPY |
+                                      F2PY_INTENT_INPLACE | F2PY_OPTIONAL),
+                           (PyObject *)view);
+    if (arr != view)
+        Py_DECREF(view);
+    if (arr == NULL)
+        goto fail;
+    return arr;
+fail:
+    F2PyBatch_Release(*batch);
+    *batch = NULL;
+    return NULL;
+}
+
+extern PyObject *
+F2PyBatch_Result(PyArrayObject *batch, const int intent, const npy_intp n)
+{
+    npy_intp dims[NPY_MAXDIMS], strides[NPY_MAXDIMS];
+    int i, j, nd = PyArray_NDIM(batch);
+    int axis = (intent & F2PY_INTENT_C) ? 0 : nd - 1;
+    PyArrayObject *ret;
+
+    /* The batch axis becomes the first axis */
+    dims[0] = n;
+    strides[0] = PyArray_STRIDE(batch, axis);
+    for (i = 0, j = 1; i < nd; i++) {
+        if (i != axis) {
+            dims[j] = PyArray_DIM(batch, i);
+            strides[j++] = PyArray_STRIDE(batch, i);
+        }
+    }
+    Py_INCREF(PyArray_DESCR(batch));
+    ret = (PyArrayObject *)PyArray_NewFromDescr(
+            &PyArray_Type, PyArray_DESCR(batch), nd, dims, strides,
+            PyArray_DATA(batch), PyArray_FLAGS(batch) & NPY_ARRAY_WRITEABLE,
+            NULL);
+    if (ret == NULL)
+        return NULL;
+    Py_INCREF(batch);
+    if (PyArray_SetBaseObject(ret, (PyObject *)batch) < 0) {
+        Py_DECREF(ret);
+        return NULL;
+    }
+    return (PyObject *)ret;
+}
+
+extern void
+F2PyBatch_Release(PyArrayObject *batch)
+{
+    if (batch == NULL)
+        return;
+    /* The slices of intent(inout) arrays are copied back to the input */
+    if (PyArray_ResolveWritebackIfCopy(batch) < 0)
+        PyErr_WriteUnraisable((PyObject *)batch);
+    Py_DECREF(batch);
+}
+
+extern PyObject *
+F2PyRoutine_Get(PyObject *container, const char *name)
+{
+    PyObject *routine;
+
+    routine = PyObject_GetAttrString(container, name);
+    if (routine == NULL)
+        return NULL;
+    if (!PyFortran_Check(routine) ||
+        ((PyFortranObject *)routine)->defs[0].rank != -1) {
+        PyErr_Format(PyExc_TypeError, "%s is not a Fortran routine", name);
+        Py_DECREF(routine);
+        return NULL;
+    }
+    /* The routines of Fortran 90 modules are kept in the dictionary of
+       the module so that their attributes are set once */
+    if (PyFortran_Check(container) &&
+        PyDict_SetItemString(((PyFortranObject *)container)->dict, name,
+                             routine) < 0) {
+        Py_DECREF(routine);
+        return NULL;
+    }
+    return routine;
+}
+
+extern int
+F2PyBatch_AddAttr(PyObject *container, FortranDataDef *def)
+{
+    PyObject *routine, *batch;
+    int ret = -1;
+
+    routine = F2PyRoutine_Get(container, def->name);
+    if (routine == NULL)
+        return -1;
+    def->data = ((PyFortranObject *)routine)->defs[0].data;
+    batch = PyFortranObject_NewAsAttr(def);
+    if (batch != NULL) {
+        ret = PyObject_SetAttrString(routine, "batch", batch);
+        Py_DECREF(batch);
+    }
+    Py_DECREF(routine);
+    return ret;
+}
+
+/************************* call-back arguments *************************/
+
+/*
+  The array arguments of a call-back function are views of the Fortran
+  arrays, kept in the argument tuple of the call-back between its calls.
+  The view of the previous call is reused when the call-back function
+  has not kept a reference to it and it still describes the array, see
+  array_view_check.
+*/
+
+extern PyObject *
+F2PyCallback_Array(PyObject *old, const int type_num, const int rank,
+                   npy_intp *dims, const int itemsize, char *data,
+                   const int flags)
+{
+    if (old != NULL && Py_REFCNT(old) == 1 &&
+        array_view_check(old, type_num, rank, dims, itemsize, data, flags)) {
+        Py_INCREF(old);
+        return old;
+    }
+    return PyArray_New(&PyArray_Type, rank, dims, type_num, NULL, data,
+                       itemsize, flags, NULL);
+}
+
 /*********************************************/
 /* Compatibility functions for Python >= 3.0 */
 /*********************************************/
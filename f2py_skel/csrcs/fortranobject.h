@@ -75,8 +75,30 @@ typedef struct {
     int len;              /* Number of attributes */
     FortranDataDef *defs; /* An array of FortranDataDef's */
     PyObject *dict;       /* Fortran object attribute dictionary */
+    vectorcallfunc vectorcall; /* Calls the Fortran routine */
+    PyObject *index;      /* Indices of the defs by name, or NULL */
+    PyObject **views;     /* Views of the allocatable arrays, or NULL */
 } PyFortranObject;
 
+/* C/API wrapper of a Fortran routine */
+typedef PyObject *(*fortranfunc)(PyObject *, PyObject *const *, Py_ssize_t,
+                                 PyObject *, void *);
+
+/*
+  Parser of the arguments of a C/API wrapper, see
+  F2PyArg_ParseVectorcall. Only the first two members are initialized by
+  the wrapper, the others are set on first use.
+*/
+typedef struct {
+    const char *format; /* "<required>|<optional>:<name>" where the format
+                           units are O, O! or i as in PyArg_ParseTuple */
+    char **kwlist;      /* Argument names, NULL terminated */
+    int len;            /* Number of arguments */
+    int min;            /* Number of required arguments */
+    const char *fname;  /* Name of the routine */
+    PyObject *kwtuple;  /* Interned argument names */
+} F2PyArgParser;
+
 #define PyFortran_Check(op) (Py_TYPE(op) == &PyFortran_Type)
 #define PyFortran_Check1(op) (0 == strcmp(Py_TYPE(op)->tp_name, "fortran"))
 
@@ -88,6 +110,10 @@ PyFortranObject_New(FortranDataDef *defs, f2py_void_func init);
 extern PyObject *
 PyFortranObject_NewAsAttr(FortranDataDef *defs);
 
+extern int
+F2PyArg_ParseVectorcall(PyObject *const *args, Py_ssize_t nargs,
+                        PyObject *kwnames, F2PyArgParser *parser, ...);
+
 PyObject *
 F2PyCapsule_FromVoidPtr(void *ptr, void (*dtor)(PyObject *));
 void *
@@ -132,6 +158,115 @@ array_from_pyobj(const int type_num, npy_intp *dims, const int rank,
 extern int
 copy_ND_array(const PyArrayObject *in, PyArrayObject *out);
 
+/*
+  Statistics of the copies of an array argument, see
+  array_from_pyobj_stats. The wrapper initializes the first two members,
+  the others are set when the copy audit is enabled.
+*/
+#define F2PY_COPY_DTYPE 0
+#define F2PY_COPY_NONCONTIGUOUS 1
+#define F2PY_COPY_ORDER 2
+#define F2PY_COPY_ALIGNMENT 3
+#define F2PY_COPY_NONARRAY 4
+#define F2PY_COPY_INTENT 5
+#define F2PY_COPY_NREASONS 6
+
+typedef struct F2PyCopyStats {
+    const char *routine;  /* Name of the routine */
+    const char *argument; /* Name of the argument */
+    Py_ssize_t calls;     /* Number of conversions */
+    Py_ssize_t copies;    /* Number of copies */
+    Py_ssize_t bytes;     /* Number of bytes copied */
+    Py_ssize_t reasons[F2PY_COPY_NREASONS]; /* Copies by reason */
+    int registered;
+    struct F2PyCopyStats *next;
+} F2PyCopyStats;
+
+extern PyArrayObject *
+array_from_pyobj_stats(const int type_num, npy_intp *dims, const int rank,
+                       const int intent, PyObject *obj, F2PyCopyStats *stats);
+extern int
+F2PyCopyAudit_AddFunctions(PyObject *module);
+
+/*
+  Statistics of the calls of a routine, see F2PyCallClock_Stop. The
+  wrapper initializes the first member, the others are set when the call
+  timing is enabled. The times are in nanoseconds.
+*/
+#define F2PY_CALL_CONVERT 0
+#define F2PY_CALL_FORTRAN 1
+#define F2PY_CALL_BUILD 2
+#define F2PY_CALL_CALLBACK 3
+#define F2PY_CALL_NPHASES 4
+#define F2PY_CALL_NBINS 48
+
+typedef struct F2PyCallStats {
+    const char *routine; /* Name of the routine */
+    Py_ssize_t calls;    /* Number of calls */
+    npy_int64 time[F2PY_CALL_NPHASES]; /* Time by phase */
+    Py_ssize_t histogram[F2PY_CALL_NBINS]; /* Calls by log2 of the time */
+    int registered;
+    struct F2PyCallStats *next;
+} F2PyCallStats;
+
+/* Timer of a call, start is 0 when the call is not timed */
+typedef struct {
+    npy_int64 start;
+    npy_int64 lap;      /* End of the previous phase */
+    npy_int64 callback; /* Time spent in call-backs by the thread at the
+                           end of the previous phase */
+    npy_int64 time[F2PY_CALL_NPHASES];
+} F2PyCallClock;
+
+extern int f2py_call_timing;
+extern npy_int64
+F2PyClock_Now(void);
+extern void
+F2PyCallClock_Start(F2PyCallClock *clock);
+extern void
+F2PyCallClock_Lap(F2PyCallClock *clock, const int phase);
+extern void
+F2PyCallClock_Stop(F2PyCallClock *clock, const int phase,
+                   F2PyCallStats *stats);
+extern void
+F2PyCallClock_Callback(npy_int64 *start);
+extern int
+F2PyCallTiming_AddFunctions(PyObject *module);
+
+/*
+  Batched calls, see F2PyBatch_FromPyObj. F2PY_BATCH_STEP is the number
+  of bytes of a slice of the buffer batch of n slices.
+*/
+#define F2PY_BATCH_STEP(batch, n) (PyArray_NBYTES(batch) / ((n) > 0 ? (n) : 1))
+
+extern int
+F2PyBatch_Size(PyObject *obj, npy_intp *n, const char *errmess);
+extern PyArrayObject *
+F2PyBatch_New(const int type_num, npy_intp *dims, const int rank,
+              const int intent, const npy_intp n);
+extern PyArrayObject *
+F2PyBatch_FromPyObj(const int type_num, npy_intp *dims, const int rank,
+                    const int intent, PyObject *obj, const npy_intp n,
+                    PyArrayObject **batch);
+extern PyObject *
+F2PyBatch_Result(PyArrayObject *batch, const int intent, const npy_intp n);
+extern void
+F2PyBatch_Release(PyArrayObject *batch);
+extern int
+F2PyBatch_AddAttr(PyObject *container, FortranDataDef *def);
+
+/* The routine name of a module or of a Fortran 90 module, as a new
+   reference */
+extern PyObject *
+F2PyRoutine_Get(PyObject *container, const char *name);
+
+/* The view of an array argument of a call-back function, as a new
+   reference, see F2PyCallback_Array */
+extern PyObject *
+F2PyCallback_Array(PyObject *old, const int type_num, const int rank,
+                   npy_intp *dims, const int itemsize, char *data,
+                   const int flags);
+
 #ifdef DEBUG_COPY_ND_ARRAY
 extern void
 dump_attrs(const PyArrayObject *arr);
@@ -16,6 +16,7 @@ Usage of crackfortran:
 ======================
 Command line keys: -quiet,-verbose,-fix,-f77,-f90,-show,-h <pyffilename>
                    -m <module name for f77 routines>,--ignore-contains
+                   --no-skip-executable
 Functions: crackfortran, crack2fortran
 The following Fortran statements/constructions are supported
 (or will be if needed):
@@ -28,6 +29,8 @@ The following Fortran statements/constructions are supported
 Note: 'virtual' is mapped to 'dimension'.
 Note: 'implicit integer (z) static (z)' is 'implicit static (z)' (this is minor bug).
 Note: code after 'contains' will be ignored until its scope ends.
+Note: the executable part of a subprogram is only scanned for end, contains,
+      entry, call, data and f2py directive statements.
 Note: 'common' statement is extended: dimensions are moved to variable definitions
 Note: f2py directive: <commentchar>f2py<line> is read as <line>
 Note: pythonmodule is introduced to represent Python module
@@ -141,11 +144,18 @@ TODO:
 """
 import sys
 import string
-import fileinput
+import io
+import itertools
+import contextlib
+import concurrent.futures
 import re
 import os
 import copy
+import fractions
+import functools
+import math
 import platform
+import types
 
 from f2py_skel import __version__
 
@@ -154,6 +164,7 @@ from f2py_skel import __version__
 # code, it is safest to use import * pending a major refactoring of f2py.
 from f2py_skel.stds.auxfuncs import *
 from f2py_skel.stds import symbolic
+from f2py_skel.frontend import sigcache
 from f2py_skel import __version__
 
 f2py_version = __version__.version
@@ -168,13 +179,16 @@ pyffilename = ''
 f77modulename = ''
 skipemptyends = 0      # for old F77 programs without 'program' statement
 ignorecontains = 1
+skipexecutable = 1     # Skip executable statements of subprograms
 dolowercase = 1
 debug = []
 
 # Global variables
 beginpattern = ''
 currentfilename = ''
+executablepart = -1
 expectbegin = 1
+f2pydirective = 0
 f90modulevars = {}
 filepositiontext = ''
 gotnextfile = 1
@@ -185,6 +199,7 @@ groupname = ''
 include_paths = []
 neededmodule = -1
 onlyfuncs = []
+parametercache = {}
 previous_context = None
 skipblocksuntil = -1
 skipfuncs = []
@@ -193,12 +208,10 @@ usermodules = []
 
 
 def reset_global_f2py_vars():
-    global groupcounter, grouplist, neededmodule, expectbegin
-    global skipblocksuntil, usermodules, f90modulevars, gotnextfile
-    global filepositiontext, currentfilename, skipfunctions, skipfuncs
-    global onlyfuncs, include_paths, previous_context
+    global skipfuncs, onlyfuncs, include_paths
     global strictf77, sourcecodeform, quiet, verbose, tabchar, pyffilename
-    global f77modulename, skipemptyends, ignorecontains, dolowercase, debug
+    global f77modulename, skipemptyends, ignorecontains, skipexecutable
+    global dolowercase, debug
 
     # flags
     strictf77 = 1
@@ -210,23 +223,36 @@ def reset_global_f2py_vars():
     f77modulename = ''
     skipemptyends = 0
     ignorecontains = 1
+    skipexecutable = 1
     dolowercase = 1
     debug = []
-    # variables
+    skipfuncs = []
+    onlyfuncs = []
+    include_paths = []
+    _resetparservars()
+
+
+def _resetparservars():
+    # Reset the parser variables, keeping the flags
+    global groupcounter, grouplist, neededmodule, expectbegin
+    global skipblocksuntil, usermodules, f90modulevars, gotnextfile
+    global filepositiontext, currentfilename, skipfunctions
+    global previous_context, executablepart, f2pydirective, parametercache
+
     groupcounter = 0
     grouplist = {groupcounter: []}
     neededmodule = -1
     expectbegin = 1
     skipblocksuntil = -1
+    executablepart = -1
+    f2pydirective = 0
+    parametercache = {}
     usermodules = []
     f90modulevars = {}
     gotnextfile = 1
     filepositiontext = ''
     currentfilename = ''
     skipfunctions = []
-    skipfuncs = []
-    onlyfuncs = []
-    include_paths = []
     previous_context = None
 
 
@@ -302,245 +328,280 @@ _has_fix_header = re.compile(r'-\*-\s*fix\s*-\*-', re.I).search
 _free_f90_start = re.compile(r'[^c*]\s*[^\s\d\t]', re.I).match
 
 
-def is_free_format(file):
-    """Check if file is in free format Fortran."""
+def _isfreeformat(lines):
     # f90 allows both fixed and free format, assuming fixed unless
     # signs of free format are detected.
     result = 0
-    with open(file, 'r') as f:
-        line = f.readline()
-        n = 15  # the number of non-comment lines to scan for hints
-        if _has_f_header(line):
-            n = 0
-        elif _has_f90_header(line):
-            n = 0
-            result = 1
-        while n > 0 and line:
-            if line[0] != '!' and line.strip():
-                n -= 1
-                if (line[0] != '\t' and _free_f90_start(line[:5])) or line[-2:-1] == '&':
-                    result = 1
-                    break
-            line = f.readline()
+    lines = iter(lines)
+    line = next(lines, '')
+    n = 15  # the number of non-comment lines to scan for hints
+    if _has_f_header(line):
+        n = 0
+    elif _has_f90_header(line):
+        n = 0
+        result = 1
+    while n > 0 and line:
+        if line[0] != '!' and line.strip():
+            n -= 1
+            if (line[0] != '\t' and _free_f90_start(line[:5])) or line[-2:-1] == '&':
+                result = 1
+                break
+        line = next(lines, '')
     return result
 
 
+def is_free_format(file):
+    """Check if file is in free format Fortran."""
+    with _openfortranfile(file) as f:
+        return _isfreeformat(f)
+
+
+# Source text of the files that are not read from disk (see
+# FortranParser.parse_string), by file name.
+_stringsources = {}
+_readbufsize = 1 << 20
+
+
+def _openfortranfile(filename):
+    if filename in _stringsources:
+        return io.StringIO(_stringsources[filename])
+    return open(filename, 'r', buffering=_readbufsize)
+
+
+_includeline = re.compile(
+    r'\s*include\s*(\'|")(?P<name>[^\'"]*)(\'|")', re.I)
+_cont1 = re.compile(r'(?P<line>.*)&\s*\Z')
+_cont2 = re.compile(r'(\s*&|)(?P<line>.*)')
+_mline_mark = re.compile(r".*?'''")
+
+
+def _contline(l):
+    """
+    Return (line, True) when l ends with the free form continuation
+    mark ``&``, line being l without the mark, and (l, False) otherwise.
+    """
+    if '\n' in l:  # multiline block
+        r = _cont1.match(l)
+        if r:
+            return r.group('line'), True
+        return l, False
+    t = l.rstrip()
+    if t[-1:] == '&':
+        return t[:-1], True
+    return l, False
+
+
+def _contstart(l):
+    """Strip the optional leading ``&`` of a continuation line."""
+    if '\n' in l:  # multiline block
+        return _cont2.match(l).group('line')
+    t = l.lstrip()
+    if t[:1] == '&':
+        return t[1:]
+    return l
+
+
 # Read fortran (77,90) code
-def readfortrancode(ffile, dowithline=show, istop=1):
+def readfortranstatements(ffile):
     """
-    Read fortran codes from files and
-     1) Get rid of comments, line continuations, and empty lines; lower cases.
-     2) Call dowithline(line) on every line.
-     3) Recursively call itself when statement \"include '<filename>'\" is met.
+    Generate the logical statements of the Fortran files in ffile.
+
+    The files are read as one buffered stream in a single pass that gets
+    rid of comments, empty lines and line continuations (in fixed and in
+    free form) and lower cases the statements when dolowercase is set.
+    For every statement ``(line, origline, lineno, firstline)`` is
+    generated, where origline is the statement before lower casing,
+    lineno the number of lines read from the current file and
+    firstline the first physical line of the statement.
+
+    The globals currentfilename, sourcecodeform, strictf77 and
+    beginpattern are updated whenever a new file is entered, and
+    f2pydirective is set before a statement is generated when its first
+    line is an f2py directive.
     """
     global gotnextfile, filepositiontext, currentfilename, sourcecodeform, strictf77
-    global beginpattern, quiet, verbose, dolowercase, include_paths
+    global beginpattern, f2pydirective
 
-    if not istop:
-        saveglobals = gotnextfile, filepositiontext, currentfilename, sourcecodeform, strictf77,\
-            beginpattern, quiet, verbose, dolowercase
-    if ffile == []:
-        return
+    if isinstance(ffile, str):
+        ffile = [ffile]
     localdolowercase = dolowercase
     # cont: set to True when the content of the last line read
     # indicates statement continuation
     cont = False
-    finalline = ''
-    ll = ''
-    includeline = re.compile(
-        r'\s*include\s*(\'|")(?P<name>[^\'"]*)(\'|")', re.I)
-    cont1 = re.compile(r'(?P<line>.*)&\s*\Z')
-    cont2 = re.compile(r'(\s*&|)(?P<line>.*)')
-    mline_mark = re.compile(r".*?'''")
-    if istop:
-        dowithline('', -1)
     ll, l1 = '', ''
-    spacedigits = [' '] + [str(_m) for _m in range(10)]
-    filepositiontext = ''
-    fin = fileinput.FileInput(ffile)
-    while True:
-        l = fin.readline()
-        if not l:
-            break
-        if fin.isfirstline():
-            filepositiontext = ''
-            currentfilename = fin.filename()
-            gotnextfile = 1
-            l1 = l
-            strictf77 = 0
-            sourcecodeform = 'fix'
-            ext = os.path.splitext(currentfilename)[1]
-            if is_f_file(currentfilename) and \
-                    not (_has_f90_header(l) or _has_fix_header(l)):
-                strictf77 = 1
-            elif is_free_format(currentfilename) and not _has_fix_header(l):
-                sourcecodeform = 'free'
-            if strictf77:
-                beginpattern = beginpattern77
-            else:
-                beginpattern = beginpattern90
-            outmess('\tReading file %s (format:%s%s)\n'
-                    % (repr(currentfilename), sourcecodeform,
-                       strictf77 and ',strict' or ''))
-
-        l = l.expandtabs().replace('\xa0', ' ')
-        # Get rid of newline characters
-        while not l == '':
-            if l[-1] not in "\n\r\f":
-                break
-            l = l[:-1]
-        if not strictf77:
-            (l, rl) = split_by_unquoted(l, '!')
-            l += ' '
-            if rl[:5].lower() == '!f2py':  # f2py directive
-                l, _ = split_by_unquoted(l + 4 * ' ' + rl[5:], '!')
-        if l.strip() == '':  # Skip empty line
-            if sourcecodeform == 'free':
-                # In free form, a statement continues in the next line
-                # that is not a comment line [3.3.2.4^1], lines with
-                # blanks are comment lines [3.3.2.3^1]. Hence, the
-                # line continuation flag must retain its state.
-                pass
-            else:
-                # In fixed form, statement continuation is determined
-                # by a non-blank character at the 6-th position. Empty
-                # line indicates a start of a new statement
-                # [3.3.3.3^1]. Hence, the line continuation flag must
-                # be reset.
-                cont = False
-            continue
-        if sourcecodeform == 'fix':
-            if l[0] in ['*', 'c', '!', 'C', '#']:
-                if l[1:5].lower() == 'f2py':  # f2py directive
-                    l = '     ' + l[5:]
-                else:  # Skip comment line
-                    cont = False
-                    continue
-            elif strictf77:
-                if len(l) > 72:
-                    l = l[:72]
-            if not (l[0] in spacedigits):
-                raise Exception('readfortrancode: Found non-(space,digit) char '
-                                'in the first column.\n\tAre you sure that '
-                                'this code is in fix form?\n\tline=%s' % repr(l))
-
-            if (not cont or strictf77) and (len(l) > 5 and not l[5] == ' '):
-                # Continuation of a previous line
-                ll = ll + l[6:]
-                finalline = ''
-                origfinalline = ''
-            else:
+    # lldirective: set when the statement in ll starts with an f2py
+    # directive
+    lldirective = False
+    lineno = 0
+    for filename in ffile:
+        with _openfortranfile(filename) as fin:
+            lines = iter(fin)
+            lineno = 0
+            for l in lines:
+                lineno += 1
+                if lineno == 1:
+                    filepositiontext = ''
+                    currentfilename = filename
+                    gotnextfile = 1
+                    l1 = l
+                    strictf77 = 0
+                    sourcecodeform = 'fix'
+                    ext = os.path.splitext(currentfilename)[1]
+                    if is_f_file(currentfilename) and \
+                            not (_has_f90_header(l) or _has_fix_header(l)):
+                        strictf77 = 1
+                    elif is_free_format(currentfilename) and not _has_fix_header(l):
+                        sourcecodeform = 'free'
+                    if strictf77:
+                        beginpattern = beginpattern77
+                    else:
+                        beginpattern = beginpattern90
+                    outmess('\tReading file %s (format:%s%s)\n'
+                            % (repr(currentfilename), sourcecodeform,
+                               strictf77 and ',strict' or ''))
+                    free = sourcecodeform == 'free'
+
+                # Get rid of newline characters
+                l = l.expandtabs().replace('\xa0', ' ').rstrip('\n\r\f')
+                directive = False
                 if not strictf77:
-                    # F90 continuation
-                    r = cont1.match(l)
-                    if r:
-                        l = r.group('line')  # Continuation follows ..
-                    if cont:
-                        ll = ll + cont2.match(l).group('line')
-                        finalline = ''
+                    if '!' in l:
+                        (l, rl) = split_by_unquoted(l, '!')
+                        l += ' '
+                        if rl[:5].lower() == '!f2py':  # f2py directive
+                            directive = not l.strip()
+                            l, _ = split_by_unquoted(l + 4 * ' ' + rl[5:], '!')
+                    else:
+                        l += ' '
+                if not l.strip():  # Skip empty line
+                    if not free:
+                        # In fixed form, statement continuation is
+                        # determined by a non-blank character at the 6-th
+                        # position. Empty line indicates a start of a new
+                        # statement [3.3.3.3^1]. Hence, the line
+                        # continuation flag must be reset. In free form, a
+                        # statement continues in the next line that is not
+                        # a comment line [3.3.2.4^1], lines with blanks
+                        # are comment lines [3.3.2.3^1]. Hence, the line
+                        # continuation flag must retain its state.
+                        cont = False
+                    continue
+                if not free:
+                    if l[0] in '*c!C#':
+                        if l[1:5].lower() == 'f2py':  # f2py directive
+                            l = '     ' + l[5:]
+                            directive = True
+                        else:  # Skip comment line
+                            cont = False
+                            continue
+                    elif strictf77:
+                        if len(l) > 72:
+                            l = l[:72]
+                    if l[0] not in ' 0123456789':
+                        raise Exception('readfortrancode: Found non-(space,digit) char '
+                                        'in the first column.\n\tAre you sure that '
+                                        'this code is in fix form?\n\tline=%s' % repr(l))
+
+                    if (not cont or strictf77) and (len(l) > 5 and not l[5] == ' '):
+                        # Continuation of a previous line
+                        ll = ll + l[6:]
                         origfinalline = ''
+                    elif not strictf77:
+                        # F90 continuation
+                        l, r = _contline(l)
+                        if cont:
+                            ll = ll + _contstart(l)
+                            origfinalline = ''
+                        else:
+                            # clean up line beginning from possible digits.
+                            origfinalline = ll
+                            ll = '     ' + l[5:]
+                            finaldirective, lldirective = lldirective, directive
+                        cont = r
                     else:
                         # clean up line beginning from possible digits.
-                        l = '     ' + l[5:]
-                        if localdolowercase:
-                            finalline = ll.lower()
-                        else:
-                            finalline = ll
                         origfinalline = ll
-                        ll = l
-                    cont = (r is not None)
+                        ll = '     ' + l[5:]
+                        finaldirective, lldirective = lldirective, directive
                 else:
-                    # clean up line beginning from possible digits.
-                    l = '     ' + l[5:]
+                    if not cont and ext == '.pyf' and _mline_mark.match(l):
+                        l = l + '\n'
+                        while True:
+                            lc = next(lines, '')
+                            if not lc:
+                                errmess(
+                                    'Unexpected end of file when reading multiline\n')
+                                break
+                            lineno += 1
+                            l = l + lc
+                            if _mline_mark.match(lc):
+                                break
+                        l = l.rstrip()
+                    l, r = _contline(l)
+                    if cont:
+                        ll = ll + _contstart(l)
+                        origfinalline = ''
+                    else:
+                        origfinalline = ll
+                        ll = l
+                        finaldirective, lldirective = lldirective, directive
+                    cont = r
+                if origfinalline:
+                    f2pydirective = finaldirective
                     if localdolowercase:
-                        finalline = ll.lower()
+                        yield origfinalline.lower(), origfinalline, lineno, l1
                     else:
-                        finalline = ll
-                    origfinalline = ll
-                    ll = l
-
-        elif sourcecodeform == 'free':
-            if not cont and ext == '.pyf' and mline_mark.match(l):
-                l = l + '\n'
-                while True:
-                    lc = fin.readline()
-                    if not lc:
-                        errmess(
-                            'Unexpected end of file when reading multiline\n')
-                        break
-                    l = l + lc
-                    if mline_mark.match(lc):
-                        break
-                l = l.rstrip()
-            r = cont1.match(l)
-            if r:
-                l = r.group('line')  # Continuation follows ..
-            if cont:
-                ll = ll + cont2.match(l).group('line')
-                finalline = ''
-                origfinalline = ''
-            else:
-                if localdolowercase:
-                    finalline = ll.lower()
-                else:
-                    finalline = ll
-                origfinalline = ll
-                ll = l
-            cont = (r is not None)
+                        yield origfinalline, origfinalline, lineno, l1
+                l1 = ll
+    if ll:
+        f2pydirective = lldirective
+        if localdolowercase:
+            yield ll.lower(), ll, lineno, l1
         else:
-            raise ValueError(
-                "Flag sourcecodeform must be either 'fix' or 'free': %s" % repr(sourcecodeform))
+            yield ll, ll, lineno, l1
+
+
+def _readinclude(fn, dowithline):
+    if os.path.isfile(fn) or fn in _stringsources:
+        readfortrancode(fn, dowithline=dowithline, istop=0)
+        return
+    include_dirs = [os.path.dirname(currentfilename)] + include_paths
+    for inc_dir in include_dirs:
+        fn1 = os.path.join(inc_dir, fn)
+        if os.path.isfile(fn1) or fn1 in _stringsources:
+            readfortrancode(fn1, dowithline=dowithline, istop=0)
+            return
+    outmess('readfortrancode: could not find include file %s in %s. Ignoring.\n' % (
+        repr(fn), os.pathsep.join(include_dirs)))
+
+
+def readfortrancode(ffile, dowithline=show, istop=1):
+    """
+    Read fortran codes from files and
+     1) Get rid of comments, line continuations, and empty lines; lower cases.
+     2) Call dowithline(line) on every line.
+     3) Recursively call itself when statement \"include '<filename>'\" is met.
+    """
+    global gotnextfile, filepositiontext, currentfilename, sourcecodeform, strictf77
+    global beginpattern, quiet, verbose, dolowercase, include_paths
+
+    if not istop:
+        saveglobals = gotnextfile, filepositiontext, currentfilename, sourcecodeform, strictf77,\
+            beginpattern, quiet, verbose, dolowercase
+    if ffile == []:
+        return
+    if istop:
+        dowithline('', -1)
+    filepositiontext = ''
+    for line, origline, lineno, l1 in readfortranstatements(ffile):
         filepositiontext = 'Line #%d in %s:"%s"\n\t' % (
-            fin.filelineno() - 1, currentfilename, l1)
-        m = includeline.match(origfinalline)
+            lineno - 1, currentfilename, l1)
+        m = _includeline.match(origline)
         if m:
-            fn = m.group('name')
-            if os.path.isfile(fn):
-                readfortrancode(fn, dowithline=dowithline, istop=0)
-            else:
-                include_dirs = [
-                    os.path.dirname(currentfilename)] + include_paths
-                foundfile = 0
-                for inc_dir in include_dirs:
-                    fn1 = os.path.join(inc_dir, fn)
-                    if os.path.isfile(fn1):
-                        foundfile = 1
-                        readfortrancode(fn1, dowithline=dowithline, istop=0)
-                        break
-                if not foundfile:
-                    outmess('readfortrancode: could not find include file %s in %s. Ignoring.\n' % (
-                        repr(fn), os.pathsep.join(include_dirs)))
+            _readinclude(m.group('name'), dowithline)
         else:
-            dowithline(finalline)
-        l1 = ll
-    if localdolowercase:
-        finalline = ll.lower()
-    else:
-        finalline = ll
-    origfinalline = ll
-    filepositiontext = 'Line #%d in %s:"%s"\n\t' % (
-        fin.filelineno() - 1, currentfilename, l1)
-    m = includeline.match(origfinalline)
-    if m:
-        fn = m.group('name')
-        if os.path.isfile(fn):
-            readfortrancode(fn, dowithline=dowithline, istop=0)
-        else:
-            include_dirs = [os.path.dirname(currentfilename)] + include_paths
-            foundfile = 0
-            for inc_dir in include_dirs:
-                fn1 = os.path.join(inc_dir, fn)
-                if os.path.isfile(fn1):
-                    foundfile = 1
-                    readfortrancode(fn1, dowithline=dowithline, istop=0)
-                    break
-            if not foundfile:
-                outmess('readfortrancode: could not find include file %s in %s. Ignoring.\n' % (
-                    repr(fn), os.pathsep.join(include_dirs)))
-    else:
-        dowithline(finalline)
+            dowithline(line)
     filepositiontext = ''
-    fin.close()
     if istop:
         dowithline('', 1)
     else:
@@ -623,21 +684,32 @@ multilinepattern = re.compile(
     r"\s*(?P<before>''')(?P<this>.*?)(?P<after>''')\s*\Z", re.S), 'multiline'
 ##
 
-def split_by_unquoted(line, characters):
-    """
-    Splits the line into (line[:i], line[i:]),
-    where i is the index of first occurrence of one of the characters
-    not within quotes, or len(line) if no such index exists
-    """
+@functools.lru_cache(maxsize=None)
+def _unquotedsplitter(characters):
     assert not (set('"\'') & set(characters)), "cannot split by unquoted quotes"
-    r = re.compile(
+    return re.compile(
         r"\A(?P<before>({single_quoted}|{double_quoted}|{not_quoted})*)"
         r"(?P<after>{char}.*)\Z".format(
             not_quoted="[^\"'{}]".format(re.escape(characters)),
             char="[{}]".format(re.escape(characters)),
             single_quoted=r"('([^'\\]|(\\.))*')",
-            double_quoted=r'("([^"\\]|(\\.))*")'))
-    m = r.match(line)
+            double_quoted=r'("([^"\\]|(\\.))*")')).match
+
+
+def split_by_unquoted(line, characters):
+    """
+    Splits the line into (line[:i], line[i:]),
+    where i is the index of first occurrence of one of the characters
+    not within quotes, or len(line) if no such index exists
+    """
+    r = _unquotedsplitter(characters)
+    found = [i for i in map(line.find, characters) if i >= 0]
+    if not found:
+        return (line, "")
+    if '"' not in line and "'" not in line and '\n' not in line:
+        i = min(found)
+        return (line[:i], line[i:])
+    m = r(line)
     if m:
         d = m.groupdict()
         return (d["before"], d["after"])
@@ -654,6 +726,173 @@ def _simplifyargs(argsline):
 crackline_re_1 = re.compile(r'\s*(?P<result>\b[a-z]+\w*\b)\s*=.*', re.I)
 
 
+def _crackorder():
+    """Return the crackline patterns in the order they are tried."""
+    return [dimensionpattern, externalpattern, intentpattern, optionalpattern,
+            requiredpattern,
+            parameterpattern, datapattern, publicpattern, privatepattern,
+            intrinsicpattern,
+            endifpattern, endpattern,
+            formatpattern,
+            beginpattern, functionpattern, subroutinepattern,
+            implicitpattern, typespattern, commonpattern,
+            callpattern, usepattern, containspattern,
+            entrypattern,
+            f2pyenhancementspattern,
+            multilinepattern
+            ]
+
+
+# Leading words of the statements that the crackline patterns match.
+# The patterns that allow a free prefix (function and subroutine
+# statements with type specs or attributes, labeled end-if like
+# statements) are instead tried on every line that contains one of
+# their keywords.
+_crackfirstwords = {
+    'dimension': ('dimension', 'virtual'),
+    'external': ('external',),
+    'intent': ('intent', 'depend', 'note', 'check'),
+    'optional': ('optional',),
+    'required': ('required',),
+    'parameter': ('parameter',),
+    'data': ('data',),
+    'public': ('public',),
+    'private': ('private',),
+    'intrinsic': ('intrinsic',),
+    'end': ('end', 'endprogram', 'endblockdata', 'endmodule',
+            'endpythonmodule', 'endinterface', 'endsubroutine',
+            'endfunction'),
+    'format': ('format',),
+    'implicit': ('implicit',),
+    'type': ('character', 'logical', 'integer', 'real', 'complex', 'double',
+             'doubleprecision', 'doublecomplex', 'doubleprecisioncomplex',
+             'type', 'byte'),
+    'common': ('common',),
+    'call': ('call',),
+    'use': ('use',),
+    'contains': ('contains',),
+    'entry': ('entry',),
+    'f2pyenhancements': ('threadsafe', 'fortranname', 'callstatement',
+                         'callprotoargument', 'usercode', 'pymethoddef'),
+}
+_crackbeginwords = {
+    # beginpattern77
+    False: ('program', 'block', 'blockdata'),
+    # beginpattern90
+    True: ('program', 'block', 'blockdata', 'module', 'python',
+           'pythonmodule', 'abstract', 'abstractinterface', 'interface',
+           'type'),
+}
+_firstword = re.compile(r'\s*(\w+)').match
+_crackindex = {}
+
+
+def _buildcrackindex(beginpattern):
+    """
+    Return the dictionary that maps leading words to the list of
+    ``(pattern, keywords)`` to try, in the order of _crackorder; None
+    maps to the patterns to try for any other leading word.
+    """
+    entries = []
+    for pat in _crackorder():
+        if pat is functionpattern:
+            entries.append((pat, ('function',), None))
+        elif pat is subroutinepattern:
+            entries.append((pat, ('subroutine',), None))
+        elif pat is endifpattern:
+            entries.append((pat, ('end', 'module'), None))
+        elif pat is beginpattern:
+            words = _crackbeginwords[pat is beginpattern90]
+            entries.append((pat, None, frozenset(words)))
+        else:
+            # multiline blocks never start with a word
+            words = _crackfirstwords.get(pat[1], ())
+            entries.append((pat, None, frozenset(words)))
+    allwords = set()
+    for _, _, words in entries:
+        if words:
+            allwords |= words
+    index = {}
+    for word in list(allwords) + [None]:
+        index[word] = [(pat, keywords) for pat, keywords, words in entries
+                       if words is None or word in words]
+    return index
+
+
+def _crackpatterns(line):
+    """Return the (pattern, keywords) pairs crackline tries on line."""
+    m = _firstword(line)
+    if not m:
+        return [(pat, None) for pat in _crackorder()]
+    index = _crackindex.get(beginpattern[0])
+    if index is None:
+        index = _crackindex[beginpattern[0]] = _buildcrackindex(beginpattern)
+    return index.get(m.group(1).lower()) or index[None]
+
+
+# Statements that start the executable part of a subprogram: the
+# executable statements with a leading keyword and the assignments.
+_executablewords = frozenset([
+    'allocate', 'assign', 'backspace', 'call', 'close', 'continue', 'cycle',
+    'deallocate', 'do', 'exit', 'flush', 'forall', 'go', 'goto', 'if',
+    'inquire', 'nullify', 'open', 'pause', 'print', 'read', 'return',
+    'rewind', 'select', 'selectcase', 'stop', 'wait', 'where', 'write'])
+# Statements of the executable part that crackline does not skip, in
+# addition to the end statements.
+_executablekeepwords = frozenset([
+    'contains', 'entry', 'call', 'data', 'intent', 'depend', 'note', 'check',
+    'threadsafe', 'fortranname', 'callstatement', 'callprotoargument',
+    'usercode', 'pymethoddef'])
+_labeledfirstword = re.compile(r'\s*(?:\d+\s+)?([a-z_]\w*)', re.I).match
+_endconstruct = re.compile(
+    r'\s*(?:\d+\s+)?end\s*(if|do|where|select|while|forall|associate|block|'
+    r'critical|team)\b', re.I).match
+_assignment = re.compile(r'\s*(%\s*\w+\s*)*=').match
+
+
+def _startsexecutablepart(line):
+    """
+    Return True when line, a statement that no crackline pattern
+    matches, is known to start the executable part of the current
+    subprogram.
+
+    Subprograms with external arguments are never skipped as the calls
+    to the externals determine their signatures.  Array element
+    assignments are told apart from statement functions by the
+    dimension of the variable.
+    """
+    group = groupcache[groupcounter]
+    if group.get('block') not in ('subroutine', 'function', 'program') \
+       or group.get('externals'):
+        return False
+    m = _labeledfirstword(line)
+    if not m:
+        return False
+    word = m.group(1)
+    if word.lower() in _executablewords:
+        return True
+    rest = line[m.end():]
+    if rest.lstrip()[:1] == '(':
+        attrspec = group['vars'].get(word, {}).get('attrspec', [])
+        return any(a[:9].lower() == 'dimension' for a in attrspec)
+    return bool(_assignment(rest))
+
+
+def _skipexecutable(line):
+    """
+    Return True when line is in the executable part of the current
+    subprogram and crackline can ignore it.
+    """
+    m = _labeledfirstword(line)
+    if not m:
+        return False
+    word = m.group(1).lower()
+    if word[:3] == 'end':
+        # the end of a construct, see endifpattern
+        return bool(_endconstruct(line))
+    return word not in _executablekeepwords
+
+
 def crackline(line, reset=0):
     """
     reset=-1  --- initialize
@@ -665,8 +904,9 @@ def crackline(line, reset=0):
     global beginpattern, groupcounter, groupname, groupcache, grouplist
     global filepositiontext, currentfilename, neededmodule, expectbegin
     global skipblocksuntil, skipemptyends, previous_context, gotnextfile
+    global executablepart
 
-    _, has_semicolon = split_by_unquoted(line, ";")
+    has_semicolon = ';' in line and split_by_unquoted(line, ";")[1]
     if has_semicolon and not (f2pyenhancementspattern[0].match(line) or
                                multilinepattern[0].match(line)):
         # XXX: non-zero reset values need testing
@@ -689,6 +929,7 @@ def crackline(line, reset=0):
         groupcache[groupcounter]['name'] = ''
         neededmodule = -1
         skipblocksuntil = -1
+        executablepart = -1
         return
     if reset > 0:
         fl = 0
@@ -716,24 +957,20 @@ def crackline(line, reset=0):
         return
     if line == '':
         return
-    flag = 0
-    for pat in [dimensionpattern, externalpattern, intentpattern, optionalpattern,
-                requiredpattern,
-                parameterpattern, datapattern, publicpattern, privatepattern,
-                intrinsicpattern,
-                endifpattern, endpattern,
-                formatpattern,
-                beginpattern, functionpattern, subroutinepattern,
-                implicitpattern, typespattern, commonpattern,
-                callpattern, usepattern, containspattern,
-                entrypattern,
-                f2pyenhancementspattern,
-                multilinepattern
-                ]:
+    if executablepart == groupcounter and not f2pydirective and \
+       _skipexecutable(line):
+        return
+    m = None
+    lline = None
+    for pat, keywords in _crackpatterns(line):
+        if keywords:
+            if lline is None:
+                lline = line.lower()
+            if not any(k in lline for k in keywords):
+                continue
         m = pat[0].match(line)
         if m:
             break
-        flag = flag + 1
     if not m:
         re_1 = crackline_re_1
         if 0 <= skipblocksuntil <= groupcounter:
@@ -761,11 +998,14 @@ def crackline(line, reset=0):
                         return
                     analyzeline(m, 'callfun', line)
                     return
+        if skipexecutable and _startsexecutablepart(line):
+            executablepart = groupcounter
         if verbose > 1 or (verbose == 1 and currentfilename.lower().endswith('.pyf')):
             previous_context = None
             outmess('crackline:%d: No pattern for line\n' % (groupcounter))
         return
     elif pat[1] == 'end':
+        executablepart = -1
         if 0 <= skipblocksuntil < groupcounter:
             groupcounter = groupcounter - 1
             if skipblocksuntil <= groupcounter:
@@ -799,6 +1039,7 @@ def crackline(line, reset=0):
     elif pat[1] == 'endif':
         pass
     elif pat[1] == 'contains':
+        executablepart = -1
         if ignorecontains:
             return
         if 0 <= skipblocksuntil <= groupcounter:
@@ -889,10 +1130,6 @@ nameargspattern = re.compile(
     r'\s*(?P<name>\b[\w$]+\b)\s*(@\(@\s*(?P<args>[\w\s,]*)\s*@\)@|)\s*((result(\s*@\(@\s*(?P<result>\b[\w$]+\b)\s*@\)@|))|(bind\s*@\(@\s*(?P<bind>.*)\s*@\)@))*\s*\Z', re.I)
 callnameargspattern = re.compile(
     r'\s*(?P<name>\b[\w$]+\b)\s*@\(@\s*(?P<args>.*)\s*@\)@\s*\Z', re.I)
-real16pattern = re.compile(
-    r'([-+]?(?:\d+(?:\.\d*)?|\d*\.\d+))[dD]((?:[-+]?\d+)?)')
-real8pattern = re.compile(
-    r'([-+]?((?:\d+(?:\.\d*)?|\d*\.\d+))[eE]((?:[-+]?\d+)?)|(\d+\.\d*))')
 
 _intentcallbackpattern = re.compile(r'intent\s*\(.*?\bcallback\b', re.I)
 
@@ -1205,31 +1442,20 @@ def analyzeline(m, case, line):
                 outmess(
                     'analyzeline: could not extract name,expr in parameter statement "%s" of "%s"\n' % (e, ll))
                 continue
-            params = get_parameters(edecl)
+            params = get_cached_parameters(edecl)
             k = rmbadname1(k)
             if k not in edecl:
                 edecl[k] = {}
             if '=' in edecl[k] and (not edecl[k]['='] == initexpr):
                 outmess('analyzeline: Overwriting the value of parameter "%s" ("%s") with "%s".\n' % (
                     k, edecl[k]['='], initexpr))
-            t = determineexprtype(initexpr, params)
-            if t:
-                if t.get('typespec') == 'real':
-                    tt = list(initexpr)
-                    for m in real16pattern.finditer(initexpr):
-                        tt[m.start():m.end()] = list(
-                            initexpr[m.start():m.end()].lower().replace('d', 'e'))
-                    initexpr = ''.join(tt)
-                elif t.get('typespec') == 'complex':
-                    initexpr = initexpr[1:].lower().replace('d', 'e').\
-                        replace(',', '+1j*(')
             try:
-                v = eval(initexpr, {}, params)
-            except (SyntaxError, NameError, TypeError) as msg:
+                v = _castconstant(edecl[k], _evalconstant(initexpr, params))
+            except _NotConstant as msg:
                 errmess('analyzeline: Failed to evaluate %r. Ignoring: %s\n'
                         % (initexpr, msg))
                 continue
-            edecl[k]['='] = repr(v)
+            edecl[k]['='] = _fortranconstant(v)
             if 'attrspec' in edecl[k]:
                 edecl[k]['attrspec'].append('parameter')
             else:
@@ -1864,7 +2090,7 @@ def get_useparameters(block, param_map=None):
                     (usename, block.get('name')))
             continue
         mvars = f90modulevars[usename]
-        params = get_parameters(mvars)
+        params = get_cached_parameters(mvars)
         if not params:
             continue
         # XXX: apply mapping
@@ -2147,6 +2373,66 @@ def myeval(e, g=None, l=None):
 getlincoef_re_1 = re.compile(r'\A\b\w+\b\Z', re.I)
 
 
+def _lincoefs(expr):
+    # Return {symbol: coefficient, None: constant term} when expr is a
+    # linear function of symbols with numeric coefficients, otherwise
+    # None. Integer divisions are evaluated exactly as fractions.
+    op = expr.op
+    if op in (symbolic.Op.INTEGER, symbolic.Op.REAL):
+        return {None: expr.data[0]}
+    if op is symbolic.Op.SYMBOL:
+        return {expr.data: 1}
+    if op is symbolic.Op.TERMS:
+        r = {}
+        for term, coeff in expr.data.items():
+            d = _lincoefs(term)
+            if d is None:
+                return None
+            for k, v in d.items():
+                r[k] = r.get(k, 0) + v * coeff
+        return r
+    if op is symbolic.Op.FACTORS:
+        r = {None: 1}
+        for base, exp in expr.data.items():
+            d = _lincoefs(base)
+            if d is None or not isinstance(exp, int):
+                return None
+            if list(d) == [None]:
+                v = d[None]
+                if isinstance(v, int):
+                    v = fractions.Fraction(v)
+                if not v and exp < 0:
+                    return None
+                c = v ** exp
+                r = dict((k, x * c) for k, x in r.items())
+            elif exp == 1 and list(r) == [None]:
+                c = r[None]
+                r = dict((k, x * c) for k, x in d.items())
+            else:
+                return None
+        return r
+    if op is symbolic.Op.APPLY and expr.data[0] is symbolic.ArithOp.DIV \
+       and not expr.data[2]:
+        numer, denom = map(_lincoefs, expr.data[1])
+        if numer is None or denom is None or list(denom) != [None] \
+           or not denom[None]:
+            return None
+        v = denom[None]
+        if isinstance(v, int):
+            v = fractions.Fraction(v)
+        return dict((k, x / v) for k, x in numer.items())
+    return None
+
+
+def _asnumber(value):
+    # Return a coefficient found by _lincoefs as int or float.
+    if isinstance(value, fractions.Fraction):
+        if value.denominator == 1:
+            return int(value)
+        return float(value)
+    return value
+
+
 def getlincoef(e, xset):  # e = a*x+b ; x in xset
     """
     Obtain ``a`` and ``b`` when ``e == "a*x+b"``, where ``x`` is a symbol in
@@ -2162,64 +2448,46 @@ def getlincoef(e, xset):  # e = a*x+b ; x in xset
     (0, 0, 'x')
     >>> getlincoef('x*x', {'x'})
     (None, None, None)
+    >>> getlincoef('(x + 1)/3', {'x'})
+    (0.3333333333333333, 0.3333333333333333, 'x')
 
-    This can be tricked by sufficiently complex expressions
+    Expressions that are not linear in one symbol of xset with numeric
+    coefficients are rejected
 
     >>> getlincoef('(x - 0.5)*(x - 1.5)*(x - 1)*x + 2*x + 3', {'x'})
-    (2.0, 3.0, 'x')
+    (None, None, None)
+    >>> getlincoef('max(1, x) + 1', {'x'})
+    (None, None, None)
     """
     try:
-        c = int(myeval(e, {}, {}))
-        return 0, c, None
+        expr = symbolic.fromstring(e.lower(),
+                                   language=symbolic.Language.Fortran)
+        coefs = _lincoefs(expr)
     except Exception:
-        pass
+        return None, None, None
+    if coefs is None:
+        return None, None, None
+    b = _asnumber(coefs.pop(None, 0))
+    coefs = dict((k, v) for k, v in coefs.items() if v)
+    if not coefs:
+        words = set(re.findall(r'\w+', e.lower()))
+        for x in xset:
+            if x.lower() in words:
+                # e.g. 0*x
+                return 0, b, x
+        return 0, int(b), None
     if getlincoef_re_1.match(e):
         return 1, 0, e
-    len_e = len(e)
-    for x in xset:
-        if len(x) > len_e:
-            continue
-        if re.search(r'\w\s*\([^)]*\b' + x + r'\b', e):
-            # skip function calls having x as an argument, e.g max(1, x)
-            continue
-        re_1 = re.compile(r'(?P<before>.*?)\b' + x + r'\b(?P<after>.*)', re.I)
-        m = re_1.match(e)
-        if m:
-            try:
-                m1 = re_1.match(e)
-                while m1:
-                    ee = '%s(%s)%s' % (
-                        m1.group('before'), 0, m1.group('after'))
-                    m1 = re_1.match(ee)
-                b = myeval(ee, {}, {})
-                m1 = re_1.match(e)
-                while m1:
-                    ee = '%s(%s)%s' % (
-                        m1.group('before'), 1, m1.group('after'))
-                    m1 = re_1.match(ee)
-                a = myeval(ee, {}, {}) - b
-                m1 = re_1.match(e)
-                while m1:
-                    ee = '%s(%s)%s' % (
-                        m1.group('before'), 0.5, m1.group('after'))
-                    m1 = re_1.match(ee)
-                c = myeval(ee, {}, {})
-                # computing another point to be sure that expression is linear
-                m1 = re_1.match(e)
-                while m1:
-                    ee = '%s(%s)%s' % (
-                        m1.group('before'), 1.5, m1.group('after'))
-                    m1 = re_1.match(ee)
-                c2 = myeval(ee, {}, {})
-                if (a * 0.5 + b == c and a * 1.5 + b == c2):
-                    return a, b, x
-            except Exception:
-                pass
-            break
+    if len(coefs) == 1:
+        (s, a), = coefs.items()
+        for x in xset:
+            if x.lower() == s:
+                return _asnumber(a), b, x
     return None, None, None
 
 
 word_pattern = re.compile(r'\b[a-z][\w$]*\b', re.I)
+_wordsplit = re.compile(r'\w+').findall
 
 
 def _get_depend_dict(name, vars, deps):
@@ -2272,17 +2540,6 @@ def get_sorted_names(vars):
     return [name for name in names if name in vars]
 
 
-def _kind_func(string):
-    # XXX: return something sensible.
-    if string[0] in "'\"":
-        string = string[1:-1]
-    if real16pattern.match(string):
-        return 8
-    elif real8pattern.match(string):
-        return 4
-    return 'kind(' + string + ')'
-
-
 def _selected_int_kind_func(r):
     # XXX: This should be processor dependent
     m = 10 ** r
@@ -2318,114 +2575,449 @@ def _selected_real_kind_func(p, r=0, radix=0):
     return -1
 
 
-def get_parameters(vars, global_params={}):
+class _NotConstant(Exception):
+    """Raised when an expression is not a foldable constant expression."""
+
+
+_logicalliteral = re.compile(r'\A\s*\.(true|false)\.(_\w+)?\s*\Z', re.I)
+# Character literal with doubled quotes, e.g. 'it''s'
+_charliteral = re.compile(r"""\A('([^']|'')*'|"([^"]|"")*")\Z""")
+_notprefix = re.compile(r'\A\s*\.not\.', re.I)
+# Binary logical and relational operators, lowest precedence first
+_logicalsplits = [
+    re.compile(r'(\.eqv\.|\.neqv\.)', re.I),
+    re.compile(r'(\.or\.)', re.I),
+    re.compile(r'(\.and\.)', re.I),
+    re.compile(r'(\.eq\.|\.ne\.|\.lt\.|\.le\.|\.gt\.|\.ge\.'
+               r'|==|/=|<=|>=|<|>)', re.I),
+]
+_relops = {
+    '.eq.': '==', '.ne.': '/=', '.lt.': '<', '.le.': '<=', '.gt.': '>',
+    '.ge.': '>=', symbolic.RelOp.EQ: '==', symbolic.RelOp.NE: '/=',
+    symbolic.RelOp.LT: '<', symbolic.RelOp.LE: '<=',
+    symbolic.RelOp.GT: '>', symbolic.RelOp.GE: '>='}
+
+
+def _compare(rop, a, b):
+    if isinstance(a, str) and isinstance(b, str):
+        # shorter strings are padded with blanks
+        n = max(len(a), len(b))
+        a, b = a.ljust(n), b.ljust(n)
+    elif isinstance(a, (bool, str)) or isinstance(b, (bool, str)) or \
+            rop not in ('==', '/=') and (isinstance(a, complex) or
+                                         isinstance(b, complex)):
+        raise _NotConstant('cannot compare %r with %r' % (a, b))
+    if rop == '==':
+        return a == b
+    if rop == '/=':
+        return a != b
+    if rop == '<':
+        return a < b
+    if rop == '<=':
+        return a <= b
+    if rop == '>':
+        return a > b
+    return a >= b
+
+
+def _logical(value):
+    if not isinstance(value, bool):
+        raise _NotConstant('expected logical value, got %r' % (value,))
+    return value
+
+
+def _intdiv(a, b):
+    # Fortran integer division truncates towards zero
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+
+def _arith(op, a, b):
+    for v in (a, b):
+        if isinstance(v, (bool, str)):
+            raise _NotConstant('arithmetic on %r' % (v,))
+    if op is symbolic.ArithOp.ADD:
+        return a + b
+    if op is symbolic.ArithOp.SUB:
+        return a - b
+    if op is symbolic.ArithOp.MUL:
+        return a * b
+    if op is symbolic.ArithOp.DIV:
+        if isinstance(a, int) and isinstance(b, int):
+            return _intdiv(a, b)
+        return a / b
+    if op is symbolic.ArithOp.POW:
+        if isinstance(a, int) and isinstance(b, int):
+            if abs(b) > 256 and abs(a) > 1:
+                raise _NotConstant('integer overflow in %r**%r' % (a, b))
+            if b < 0:
+                return _intdiv(1, a ** -b)
+        r = a ** b
+        if isinstance(r, complex) and not isinstance(a, complex) \
+           and not isinstance(b, complex):
+            raise _NotConstant('%r**%r is not real' % (a, b))
+        return r
+    raise _NotConstant('unsupported operation %s' % (op))
+
+
+def _unquote(s):
+    q = s[0]
+    return s[1:-1].replace(q + q, q)
+
+
+def _huge(value, kind):
+    if isinstance(value, int) and not isinstance(value, bool):
+        return 2 ** (8 * kind - 1) - 1
+    if isinstance(value, float) and kind in (4, 8):
+        return {4: 3.4028234663852886e+38, 8: sys.float_info.max}[kind]
+    raise _NotConstant('huge of %r with kind %r' % (value, kind))
+
+
+def _mod(a, p):
+    if isinstance(a, int) and isinstance(p, int):
+        return a - _intdiv(a, p) * p
+    return math.fmod(a, p)
+
+
+def _toint(x, kind=None):
+    if isinstance(x, complex):
+        x = x.real
+    return int(x)
+
+
+def _toreal(x, kind=None):
+    if isinstance(x, complex):
+        return x.real
+    return float(x)
+
+
+def _tocomplex(x, y=0, kind=None):
+    if isinstance(x, complex):
+        return x
+    return complex(x, y)
+
+
+# Intrinsic functions that are folded from the values of their arguments
+_intrinsics = {
+    'selected_int_kind': _selected_int_kind_func,
+    'selected_real_kind': _selected_real_kind_func,
+    'len': len,
+    'int': _toint,
+    'real': _toreal,
+    'dble': _toreal,
+    'cmplx': _tocomplex,
+    'dcmplx': _tocomplex,
+    'abs': abs,
+    'min': min,
+    'max': max,
+    'mod': _mod,
+}
+# Kinds of the results of intrinsic functions
+_intrinsickinds = {'len': 4, 'int': 4, 'real': 4, 'dble': 8, 'cmplx': 4,
+                   'dcmplx': 8, 'selected_int_kind': 4,
+                   'selected_real_kind': 4}
+
+
+def _foldsymbol(name, params):
+    m = _logicalliteral.match(name)
+    if m:
+        return m.group(1).lower() == 'true'
+    if _charliteral.match(name):
+        return _unquote(name)
+    for n in (name, name.lower()):
+        if n in params:
+            return params[n]
+    raise _NotConstant('unknown name %r' % (name))
+
+
+def _foldkind(kind, params):
+    if isinstance(kind, str) and kind.isdigit():
+        kind = int(kind)
+    if isinstance(kind, int):
+        return kind
+    kind = _foldsymbol(kind, params)
+    if not isinstance(kind, int) or isinstance(kind, bool):
+        raise _NotConstant('invalid kind %r' % (kind,))
+    return kind
+
+
+def _fold(expr, params, kinds):
+    # Return the value of the symbolic expression expr (see
+    # _evalconstant).
+    op = expr.op
+    if op in (symbolic.Op.INTEGER, symbolic.Op.REAL):
+        return expr.data[0]
+    if op is symbolic.Op.COMPLEX:
+        re_, im = [_fold(e, params, kinds) for e in expr.data]
+        if isinstance(re_, (bool, str)) or isinstance(im, (bool, str)):
+            raise _NotConstant('invalid complex constant %s' % (expr))
+        return complex(re_, im)
+    if op is symbolic.Op.STRING:
+        return _unquote(expr.data[0])
+    if op is symbolic.Op.SYMBOL:
+        return _foldsymbol(expr.data, params)
+    if op is symbolic.Op.APPLY:
+        func, args, kwargs = expr.data
+        if isinstance(func, symbolic.ArithOp):
+            return _arith(func, *[_fold(e, params, kinds) for e in args])
+        name = func.data.lower() if func.op is symbolic.Op.SYMBOL else None
+        if name in ('kind', 'huge') and len(args) == 1 and not kwargs:
+            k = _kindof(args[0], params, kinds)
+            if name == 'kind':
+                return k
+            return _huge(_fold(args[0], params, kinds), k)
+        if name not in _intrinsics:
+            raise _NotConstant('unknown function %s' % (func))
+        return _intrinsics[name](
+            *[_fold(e, params, kinds) for e in args],
+            **dict((k, _fold(e, params, kinds)) for k, e in kwargs.items()))
+    if op is symbolic.Op.CONCAT:
+        values = [_fold(e, params, kinds) for e in expr.data]
+        if not all(isinstance(v, str) for v in values):
+            raise _NotConstant('concatenation of non-strings %s' % (expr))
+        return ''.join(values)
+    if op is symbolic.Op.RELATIONAL:
+        rop, left, right = expr.data
+        return _compare(_relops[rop], _fold(left, params, kinds),
+                        _fold(right, params, kinds))
+    raise _NotConstant('cannot evaluate %s' % (expr))
+
+
+def _operands(expr):
+    if expr.op is symbolic.Op.APPLY:
+        return expr.data[1]
+    if expr.op is symbolic.Op.COMPLEX:
+        return expr.data
+    return ()
+
+
+def _kindof(expr, params, kinds):
+    # Return the kind type parameter of the symbolic expression expr.
+    op = expr.op
+    if op in (symbolic.Op.INTEGER, symbolic.Op.REAL, symbolic.Op.STRING):
+        return _foldkind(expr.data[1], params)
+    if op is symbolic.Op.SYMBOL:
+        m = _logicalliteral.match(expr.data)
+        if m:
+            return _foldkind(m.group(2)[1:], params) if m.group(2) else 4
+        for n in (expr.data, expr.data.lower()):
+            if kinds.get(n) is not None:
+                return kinds[n]
+        return 1 if isinstance(_foldsymbol(expr.data, params), str) else 4
+    if op is symbolic.Op.APPLY and not isinstance(expr.data[0],
+                                                 symbolic.ArithOp):
+        func, args, kwargs = expr.data
+        name = func.data.lower() if func.op is symbolic.Op.SYMBOL else None
+        if 'kind' in kwargs:
+            return _fold(kwargs['kind'], params, kinds)
+        if name in ('int', 'real', 'cmplx') and \
+           len(args) == (3 if name == 'cmplx' else 2):
+            return _fold(args[-1], params, kinds)
+        if name in _intrinsickinds:
+            return _intrinsickinds[name]
+    # The kind of an operation is the largest kind of the operands of
+    # the same type as the result
+    vtype = type(_fold(expr, params, kinds))
+    return max([_kindof(e, params, kinds) for e in _operands(expr)
+                if type(_fold(e, params, kinds)) is vtype] or [4])
+
+
+def _evalconstant(expr, params, kinds=None):
+    """
+    Return the value of the Fortran constant expression expr.
+
+    expr is folded with the Fortran semantics (integer division
+    truncates, ``.true.`` is True, ``'a'//'b'`` is ``'ab'``, ...) to a
+    Python bool, int, float, complex or str.  Names are looked up in the
+    params dictionary, kinds maps the names of params to their kind type
+    parameters.  Literals and the intrinsic functions ``kind``,
+    ``selected_int_kind``, ``selected_real_kind``, ``huge``, ``len`` and a
+    few numerical ones are supported.  Nothing is executed, other
+    expressions raise _NotConstant.
+    """
+    if kinds is None:
+        kinds = {}
+    m = _logicalliteral.match(expr)
+    if m:
+        return m.group(1).lower() == 'true'
+    try:
+        unquoted, quotes = symbolic.eliminate_quotes(expr)
+        r, parens = symbolic.replace_parenthesis(unquoted)
+    except (AssertionError, ValueError):
+        raise _NotConstant('unbalanced quotes or parenthesis in %r' % (expr))
+
+    def restore(s):
+        return symbolic.insert_quotes(
+            symbolic.unreplace_parenthesis(s, parens), quotes)
+
+    for pattern in _logicalsplits:
+        operands = pattern.split(r)
+        if len(operands) == 1:
+            continue
+        values = [_evalconstant(restore(s), params, kinds)
+                  for s in operands[::2]]
+        result = values[0]
+        for op, value in zip(operands[1::2], values[1:]):
+            op = op.lower()
+            if op in ('.eqv.', '.neqv.'):
+                result = (_logical(result) == _logical(value)) == \
+                    (op == '.eqv.')
+            elif op == '.or.':
+                result = _logical(result) or _logical(value)
+            elif op == '.and.':
+                result = _logical(result) and _logical(value)
+            elif len(operands) == 3:
+                result = _compare(_relops.get(op, op), result, value)
+            else:
+                raise _NotConstant('chained comparison in %r' % (expr))
+        return result
+    if _notprefix.match(r):
+        return not _logical(_evalconstant(
+            restore(_notprefix.sub('', r)), params, kinds))
+    s = r.strip()
+    if s in parens and s.startswith('@__f2py_PARENTHESIS_ROUND_') \
+       and ',' not in parens[s]:
+        # parenthesized logical expression
+        return _evalconstant(restore(parens[s]), params, kinds)
+    try:
+        e = symbolic.fromstring(expr, language=symbolic.Language.Fortran,
+                                simplify=False)
+        return _fold(e, params, kinds)
+    except _NotConstant:
+        raise
+    except Exception as msg:
+        raise _NotConstant(str(msg) or type(msg).__name__)
+
+
+def _fortranconstant(value):
+    # Return the Fortran literal of a value found by _evalconstant.
+    if isinstance(value, bool):
+        return '.true.' if value else '.false.'
+    if isinstance(value, complex):
+        return '(%r, %r)' % (value.real, value.imag)
+    return repr(value)
+
+
+def _castconstant(var, value):
+    # Convert value to the type of the variable var.
+    typespec = var.get('typespec')
+    if isinstance(value, (bool, str)):
+        return value
+    if typespec == 'integer':
+        return _toint(value)
+    if typespec in ('real', 'double precision'):
+        return _toreal(value)
+    if typespec in ('complex', 'double complex'):
+        return _tocomplex(value)
+    return value
+
+
+def _declkind(var, params, kinds):
+    # Return the kind type parameter of the variable var, or None.
+    typespec = var.get('typespec')
+    if typespec in ('double precision', 'double complex'):
+        return 8
+    if typespec == 'character':
+        return 1
+    selector = var.get('kindselector', {})
+    try:
+        if 'kind' in selector:
+            return _foldkind(_evalconstant(str(selector['kind']), params,
+                                           kinds), params)
+        if '*' in selector:
+            k = int(selector['*'])
+            return k // 2 if typespec == 'complex' else k
+    except (_NotConstant, ValueError):
+        return None
+    return 4 if typespec else None
+
+
+def get_parameters(vars, global_params={}, kinds=None):
+    """
+    Return a dictionary of the values of the parameters in vars.
+
+    The parameters are evaluated with _evalconstant in the order given by
+    get_sorted_names, so that every parameter can use the parameters it
+    depends on and the ones in global_params.  Values that cannot be
+    evaluated are kept as strings.  The kind type parameters of the
+    values are stored in the kinds dictionary when given.
+    """
     params = copy.copy(global_params)
-    g_params = copy.copy(global_params)
-    for name, func in [('kind', _kind_func),
-                       ('selected_int_kind', _selected_int_kind_func),
-                       ('selected_real_kind', _selected_real_kind_func), ]:
-        if name not in g_params:
-            g_params[name] = func
-    param_names = []
+    if kinds is None:
+        kinds = {}
     for n in get_sorted_names(vars):
         if 'attrspec' in vars[n] and 'parameter' in vars[n]['attrspec']:
-            param_names.append(n)
-    kind_re = re.compile(r'\bkind\s*\(\s*(?P<value>.*)\s*\)', re.I)
-    selected_int_kind_re = re.compile(
-        r'\bselected_int_kind\s*\(\s*(?P<value>.*)\s*\)', re.I)
-    selected_kind_re = re.compile(
-        r'\bselected_(int|real)_kind\s*\(\s*(?P<value>.*)\s*\)', re.I)
-    for n in param_names:
-        if '=' in vars[n]:
-            v = vars[n]['=']
-            if islogical(vars[n]):
-                v = v.lower()
-                for repl in [
-                    ('.false.', 'False'),
-                    ('.true.', 'True'),
-                    # TODO: test .eq., .neq., etc replacements.
-                ]:
-                    v = v.replace(*repl)
-            v = kind_re.sub(r'kind("\1")', v)
-            v = selected_int_kind_re.sub(r'selected_int_kind(\1)', v)
-
-            # We need to act according to the data.
-            # The easy case is if the data has a kind-specifier,
-            # then we may easily remove those specifiers.
-            # However, it may be that the user uses other specifiers...(!)
-            is_replaced = False
-            if 'kindselector' in vars[n]:
-                if 'kind' in vars[n]['kindselector']:
-                    orig_v_len = len(v)
-                    v = v.replace('_' + vars[n]['kindselector']['kind'], '')
-                    # Again, this will be true if even a single specifier
-                    # has been replaced, see comment above.
-                    is_replaced = len(v) < orig_v_len
-                    
-            if not is_replaced:
-                if not selected_kind_re.match(v):
-                    v_ = v.split('_')
-                    # In case there are additive parameters
-                    if len(v_) > 1: 
-                        v = ''.join(v_[:-1]).lower().replace(v_[-1].lower(), '')
-
-            # Currently this will not work for complex numbers.
-            # There is missing code for extracting a complex number,
-            # which may be defined in either of these:
-            #  a) (Re, Im)
-            #  b) cmplx(Re, Im)
-            #  c) dcmplx(Re, Im)
-            #  d) cmplx(Re, Im, <prec>)
-
-            if isdouble(vars[n]):
-                tt = list(v)
-                for m in real16pattern.finditer(v):
-                    tt[m.start():m.end()] = list(
-                        v[m.start():m.end()].lower().replace('d', 'e'))
-                v = ''.join(tt)
-
-            elif iscomplex(vars[n]):
-                outmess(f'get_parameters[TODO]: '
-                        f'implement evaluation of complex expression {v}\n')
+            _evalparameter(n, vars[n], params, kinds)
+    return params
 
-            try:
-                params[n] = eval(v, g_params, params)
-            except Exception as msg:
-                params[n] = v
-                outmess('get_parameters: got "%s" on %s\n' % (msg, repr(v)))
-            if isstring(vars[n]) and isinstance(params[n], int):
-                params[n] = chr(params[n])
-            nl = n.lower()
-            if nl != n:
-                params[nl] = params[n]
-        else:
-            print(vars[n])
-            outmess(
-                'get_parameters:parameter %s does not have value?!\n' % (repr(n)))
+
+def _evalparameter(n, var, params, kinds):
+    if '=' not in var:
+        outmess(
+            'get_parameters:parameter %s does not have value?!\n' % (repr(n)))
+        return
+    v = var['=']
+    try:
+        params[n] = _castconstant(var, _evalconstant(v, params, kinds))
+        kinds[n] = _declkind(var, params, kinds)
+    except _NotConstant as msg:
+        params[n] = v
+        outmess('get_parameters: got "%s" on %s\n' % (msg, repr(v)))
+    if isstring(var) and isinstance(params[n], int):
+        params[n] = chr(params[n])
+    nl = n.lower()
+    if nl != n:
+        params[nl] = params[n]
+        kinds[nl] = kinds.get(n)
+
+
+def get_cached_parameters(vars):
+    """
+    Like get_parameters(vars), but the values are cached per scope.
+
+    Parameters added to vars since the previous call with the same vars
+    dictionary (e.g. by the parameter statements of the block being
+    read) are evaluated on top of the cached values.  The cache of vars
+    is dropped when the value of a cached parameter changes.
+    """
+    cached = parametercache.get(id(vars))
+    if cached is None or cached[0] is not vars:
+        cached = parametercache[id(vars)] = (vars, {}, {}, {})
+    params, kinds, seen = cached[1:]
+    new = {}
+    for n, var in vars.items():
+        if 'attrspec' in var and 'parameter' in var['attrspec']:
+            if n not in seen:
+                new[n] = var
+            elif var.get('=') != seen[n]:
+                del parametercache[id(vars)]
+                return get_cached_parameters(vars)
+    for n in get_sorted_names(new):
+        seen[n] = new[n].get('=')
+        _evalparameter(n, new[n], params, kinds)
     return params
 
 
-def _eval_length(length, params):
+def _eval_length(length, params, kinds=None):
     if length in ['(:)', '(*)', '*']:
         return '(*)'
-    return _eval_scalar(length, params)
+    return _eval_scalar(length, params, kinds)
 
-_is_kind_number = re.compile(r'\d+_').match
 
-
-def _eval_scalar(value, params):
-    if _is_kind_number(value):
-        value = value.split('_')[0]
+def _eval_scalar(value, params, kinds=None):
+    # Return the string of the folded value of the constant expression
+    # value, or value itself when it is a literal or cannot be folded.
     try:
-        value = eval(value, {}, params)
-        value = (repr if isinstance(value, str) else str)(value)
-    except (NameError, SyntaxError, TypeError):
+        e = symbolic.fromstring(value, language=symbolic.Language.Fortran,
+                                simplify=False)
+    except Exception:
+        return value
+    if e.op in (symbolic.Op.REAL, symbolic.Op.COMPLEX, symbolic.Op.STRING):
+        return value
+    try:
+        return _fortranconstant(_evalconstant(value, params, kinds))
+    except _NotConstant:
         return value
-    except Exception as msg:
-        errmess('"%s" in evaluating %r '
-                '(available names: %s)\n'
-                % (msg, value, list(params.keys())))
-    return value
 
 
 def analyzevars(block):
@@ -2456,17 +3048,25 @@ def analyzevars(block):
         if n not in args:
             svars.append(n)
 
-    params = get_parameters(vars, get_useparameters(block))
+    kinds = {}
+    params = get_parameters(vars, get_useparameters(block), kinds)
 
+    # Names are looked up in the words of expressions, only names that
+    # are not identifiers (e.g. containing $) are matched with patterns
     dep_matches = {}
+    dep_words = {}
+    dep_order = {}
     name_match = re.compile(r'[A-Za-z][\w$]*').match
     for v in list(vars.keys()):
         m = name_match(v)
         if m:
             n = v[m.start():m.end()]
-            try:
-                dep_matches[n]
-            except KeyError:
+            if n in dep_order:
+                continue
+            dep_order[n] = len(dep_order)
+            if v.isidentifier():
+                dep_words.setdefault(v.lower(), []).append(n)
+            else:
                 dep_matches[n] = re.compile(r'.*\b%s\b' % (v), re.I).match
     for n in svars:
         if n[0] in list(attrrules.keys()):
@@ -2491,8 +3091,8 @@ def analyzevars(block):
             if 'len' in vars[n]['charselector']:
                 l = vars[n]['charselector']['len']
                 try:
-                    l = str(eval(l, {}, params))
-                except Exception:
+                    l = str(_evalconstant(l, params, kinds))
+                except _NotConstant:
                     pass
                 vars[n]['charselector']['len'] = l
 
@@ -2500,8 +3100,8 @@ def analyzevars(block):
             if 'kind' in vars[n]['kindselector']:
                 l = vars[n]['kindselector']['kind']
                 try:
-                    l = str(eval(l, {}, params))
-                except Exception:
+                    l = str(_evalconstant(l, params, kinds))
+                except _NotConstant:
                     pass
                 vars[n]['kindselector']['kind'] = l
 
@@ -2562,13 +3162,17 @@ def analyzevars(block):
                     # Evaluate `d` with respect to params
                     if d in params:
                         d = str(params[d])
+                    words = set(_wordsplit(d.lower()))
                     for p in params:
+                        if p.isidentifier() and p.lower() not in words:
+                            continue
                         re_1 = re.compile(r'(?P<before>.*?)\b' + p + r'\b(?P<after>.*)', re.I)
                         m = re_1.match(d)
                         while m:
                             d = m.group('before') + \
                                 str(params[p]) + m.group('after')
                             m = re_1.match(d)
+                        words = set(_wordsplit(d.lower()))
 
                     if d == star:
                         dl = [star]
@@ -2603,10 +3207,10 @@ def analyzevars(block):
                                     # solve_v function here.
                                     solve_v = None
                                     all_symbols = set(dsize.symbols())
-                                v_deps = set(
+                                v_deps = sorted(set(
                                     s.data for s in all_symbols
-                                    if s.data in vars)
-                                solver_and_deps[v] = solve_v, list(v_deps)
+                                    if s.data in vars))
+                                solver_and_deps[v] = solve_v, v_deps
                         # Note that dsize may contain symbols that are
                         # not defined in block['vars']. Here we assume
                         # these correspond to Fortran/C intrinsic
@@ -2712,24 +3316,24 @@ def analyzevars(block):
                                     aa = ''.join(aa.split())
                                     v_deps.extend(aa[7:-1].split(','))
                             if v_deps:
-                                vars[v]['depend'] = list(set(v_deps))
+                                vars[v]['depend'] = list(dict.fromkeys(v_deps))
                             if n not in v_deps:
                                 n_deps.append(v)
             elif isstring(vars[n]):
                 if 'charselector' in vars[n]:
                     if '*' in vars[n]['charselector']:
                         length = _eval_length(vars[n]['charselector']['*'],
-                                              params)
+                                              params, kinds)
                         vars[n]['charselector']['*'] = length
                     elif 'len' in vars[n]['charselector']:
                         length = _eval_length(vars[n]['charselector']['len'],
-                                              params)
+                                              params, kinds)
                         del vars[n]['charselector']['len']
                         vars[n]['charselector']['*'] = length
             if n_checks:
                 vars[n]['check'] = n_checks
             if n_deps:
-                vars[n]['depend'] = list(set(n_deps))
+                vars[n]['depend'] = list(dict.fromkeys(n_deps))
 
         if '=' in vars[n]:
             if 'attrspec' not in vars[n]:
@@ -2738,14 +3342,15 @@ def analyzevars(block):
                ('required' not in vars[n]['attrspec']):
                 vars[n]['attrspec'].append('optional')
             if 'depend' not in vars[n]:
-                vars[n]['depend'] = []
-                for v, m in list(dep_matches.items()):
-                    if m(vars[n]['=']):
-                        vars[n]['depend'].append(v)
+                value = vars[n]['=']
+                depend = [v for w in set(_wordsplit(value.lower()))
+                          for v in dep_words.get(w, ())]
+                depend.extend(v for v, m in dep_matches.items() if m(value))
+                vars[n]['depend'] = sorted(depend, key=dep_order.get)
                 if not vars[n]['depend']:
                     del vars[n]['depend']
             if isscalar(vars[n]):
-                vars[n]['='] = _eval_scalar(vars[n]['='], params)
+                vars[n]['='] = _eval_scalar(vars[n]['='], params, kinds)
 
     for n in list(vars.keys()):
         if n == block['name']:  # n is block name
@@ -2760,6 +3365,8 @@ def analyzevars(block):
                     ispure = (not pr == pr1)
                     pr = pr1.replace('recursive', '')
                     isrec = (not pr == pr1)
+                    # elemental is kept in the prefix, see iselemental
+                    pr = pr.replace('elemental', '')
                     m = typespattern[0].match(pr)
                     if m:
                         typespec, selector, attr, edecl = cracktypespec0(
@@ -2770,9 +3377,9 @@ def analyzevars(block):
                         if kindselect:
                             if 'kind' in kindselect:
                                 try:
-                                    kindselect['kind'] = eval(
-                                        kindselect['kind'], {}, params)
-                                except Exception:
+                                    kindselect['kind'] = str(_evalconstant(
+                                        kindselect['kind'], params, kinds))
+                                except _NotConstant:
                                     pass
                             vars[n]['kindselector'] = kindselect
                         if charselect:
@@ -2783,7 +3390,7 @@ def analyzevars(block):
                             vars[n] = setattrspec(vars[n], 'pure')
                         if isrec:
                             vars[n] = setattrspec(vars[n], 'recursive')
-                    else:
+                    elif pr.strip():
                         outmess(
                             'analyzevars: prefix (%s) were not used\n' % repr(block['prefix']))
     if not block['block'] in ['module', 'pythonmodule', 'python module', 'block data']:
@@ -2967,6 +3574,8 @@ def crack2fortrangen(block, tab='\n', as_interface=False):
     blocktype = block['block']
     if blocktype == 'program':
         return ''
+    if iselemental(block):
+        prefix = 'elemental '
     argsl = []
     if 'name' in block:
         name = block['name']
@@ -3197,17 +3806,291 @@ def vars2fortran(block, vars, args, tab='', as_interface=False):
 ######
 
 
-def crackfortran(files):
+def _isf77wrapper(block):
+    return (block.get('block') == 'python module'
+            and block.get('name') == f77modulename
+            and block.get('from') == ''
+            and len(block.get('body', [])) == 1)
+
+
+def _spliceblocks(dst, src):
+    """Merge the f77modulename wrapper block src into dst."""
+    for d, s in [(dst, src), (dst['body'][0], src['body'][0])]:
+        if d is not dst:
+            d['body'].extend(s['body'])
+        for n in s.get('externals', []):
+            if n not in d['externals']:
+                d['externals'].append(n)
+        d['interfaced'].extend(s.get('interfaced', []))
+        for n, v in s.get('vars', {}).items():
+            d['vars'].setdefault(n, v)
+
+
+def mergeblocks(units):
+    """
+    Merge the lists of blocks read from separate files into the block
+    list that reading all the files in one go produces.
+
+    With f77modulename set, the routines of all files end up in a single
+    python module block; the per-file wrappers are spliced together.
+    """
+    blocks = []
+    for unit in units:
+        unit = list(unit)
+        if f77modulename and blocks and unit and \
+                _isf77wrapper(blocks[-1]) and _isf77wrapper(unit[0]):
+            _spliceblocks(blocks[-1], unit.pop(0))
+        blocks.extend(unit)
+    return blocks
+
+
+def _cacheoptions(f2cmap_file=None):
+    return {'dolowercase': dolowercase,
+            'onlyfuncs': tuple(onlyfuncs),
+            'skipfuncs': tuple(skipfuncs),
+            'f77modulename': f77modulename,
+            'include_paths': tuple(include_paths),
+            'skipemptyends': skipemptyends,
+            'ignorecontains': ignorecontains,
+            'skipexecutable': skipexecutable,
+            'f2cmap_file': f2cmap_file}
+
+
+def _parserstate():
+    """Return the global flags a parser needs to read files."""
+    return {'strictf77': strictf77,
+            'sourcecodeform': sourcecodeform,
+            'tabchar': tabchar,
+            'pyffilename': pyffilename,
+            'dolowercase': dolowercase,
+            'onlyfuncs': list(onlyfuncs),
+            'skipfuncs': list(skipfuncs),
+            'f77modulename': f77modulename,
+            'include_paths': list(include_paths),
+            'skipemptyends': skipemptyends,
+            'ignorecontains': ignorecontains,
+            'skipexecutable': skipexecutable,
+            'verbose': verbose,
+            'quiet': quiet,
+            'debug': list(debug)}
+
+
+def _readfile(fn):
+    global expectbegin
+
+    expectbegin = 1
+    readfortrancode([fn], crackline)
+    return grouplist[0]
+
+
+def _crackfile(fn, state):
+    """
+    Read fn in a worker process with the given parser state.
+
+    Returns the blocks together with the messages written to stdout,
+    so that the parent can replay them in input order.
+    """
+    globals().update(state)
+    _resetparservars()
+    buf = io.StringIO()
+    with contextlib.redirect_stdout(buf):
+        blocks = _readfile(fn)
+    return blocks, buf.getvalue()
+
+
+def _crackfiles(files, cache=None, jobs=1):
+    """
+    Read files one at a time, reusing the blocks stored in cache and
+    reading the remaining files in up to jobs worker processes.
+
+    Returns the merged blocks and the cache keys of the files.
+    """
+    units = [None] * len(files)
+    keys = [None] * len(files)
+    todo = []
+    for i, fn in enumerate(files):
+        if cache is not None:
+            keys[i] = cache.unitkey([fn])
+            units[i] = cache.load(keys[i])
+            if units[i] is not None:
+                outmess('\tReading file %s (cached)\n' % (repr(fn)))
+                continue
+        todo.append(i)
+    if jobs > 1 and len(todo) > 1:
+        # FortranParser runs copies of the functions of this module, the
+        # worker must be the module level function to be picklable.
+        worker = sys.modules[__name__]._crackfile
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=min(jobs, len(todo))) as pool:
+            results = pool.map(worker, [files[i] for i in todo],
+                               itertools.repeat(_parserstate()))
+            for i, (blocks, text) in zip(todo, results):
+                sys.stdout.write(text)
+                units[i] = blocks
+    else:
+        for i in todo:
+            units[i] = _readfile(files[i])
+    if cache is not None:
+        for i in todo:
+            cache.store(keys[i], units[i])
+    return mergeblocks(units), keys
+
+
+def _crackfortran(files, cachedir=None, f2cmap_file=None, jobs=1):
     global usermodules
 
+    if isinstance(files, str):
+        files = [files]
+    cache = None
+    if cachedir is not None:
+        cache = sigcache.SignatureCache(cachedir, _cacheoptions(f2cmap_file))
+        if not cache.trusted:
+            errmess('Ignoring the signature cache directory %s: it is not a'
+                    ' directory owned by the user and private to it.\n'
+                    % (repr(cachedir)))
+            cache = None
     outmess('Reading fortran codes...\n', 0)
-    readfortrancode(files, crackline)
+    if cache is None and jobs <= 1:
+        readfortrancode(files, crackline)
+        blocks = grouplist[0]
+    else:
+        blocks, keys = _crackfiles(files, cache, jobs)
+    if cache is not None:
+        runkey = cache.runkey(keys)
+        postlist = cache.load(runkey)
+        if postlist is not None:
+            outmess('Using cached signatures.\n', 0)
+            return postlist
     outmess('Post-processing...\n', 0)
     usermodules = []
-    postlist = postcrack(grouplist[0])
+    postlist = postcrack(blocks)
     outmess('Post-processing (stage 2)...\n', 0)
-    postlist = postcrack2(postlist)
-    return usermodules + postlist
+    postlist = usermodules + postcrack2(postlist)
+    if cache is not None:
+        cache.store(runkey, postlist)
+    return postlist
+
+
+def _newparsernamespace():
+    """
+    Return a copy of the module namespace in which all functions of this
+    module are rebound to the copy, and the parser state is reset.
+    """
+    g = globals()
+    ns = dict(g)
+    for name, obj in g.items():
+        if isinstance(obj, types.FunctionType) and obj.__globals__ is g:
+            f = types.FunctionType(obj.__code__, ns, obj.__name__,
+                                   obj.__defaults__, obj.__closure__)
+            f.__kwdefaults__ = obj.__kwdefaults__
+            f.__doc__ = obj.__doc__
+            ns[name] = f
+    ns['_stringsources'] = {}
+    # buildimplicitrules updates the default implicit rules in place
+    ns['defaultimplicitrules'] = copy.deepcopy(defaultimplicitrules)
+    ns['reset_global_f2py_vars']()
+    return ns
+
+
+class FortranParser:
+    """
+    Fortran parser that owns its state.
+
+    The functions of this module keep the parser state (grouplist,
+    f90modulevars, usermodules, ...) and flags (dolowercase,
+    include_paths, f77modulename, ...) in module globals.  A
+    FortranParser runs private copies of these functions bound to a
+    namespace of its own, so that several parsers can be used at the
+    same time, e.g. from different threads, without resetting or
+    locking the module state.
+
+    Flags are given as keyword arguments; the flags and the parser state
+    are available as attributes::
+
+        parser = FortranParser(dolowercase=0, include_paths=['include'])
+        blocks = parser.parse_files(['foo.f90'])
+        parser.f90modulevars
+    """
+    statenames = frozenset([
+        # flags
+        'strictf77', 'sourcecodeform', 'quiet', 'verbose', 'tabchar',
+        'pyffilename', 'f77modulename', 'skipemptyends', 'ignorecontains',
+        'skipexecutable', 'dolowercase', 'debug', 'include_paths',
+        'onlyfuncs', 'skipfuncs',
+        # state
+        'groupcounter', 'grouplist', 'groupcache', 'groupname',
+        'neededmodule', 'expectbegin', 'skipblocksuntil', 'executablepart',
+        'f2pydirective',
+        'usermodules', 'f90modulevars', 'gotnextfile', 'filepositiontext',
+        'currentfilename', 'skipfunctions', 'previous_context',
+        'parametercache'])
+
+    def __init__(self, **flags):
+        object.__setattr__(self, '_ns', _newparsernamespace())
+        for k, v in flags.items():
+            setattr(self, k, v)
+
+    def __getattr__(self, name):
+        if name in FortranParser.statenames:
+            return self._ns[name]
+        raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        if name not in FortranParser.statenames:
+            raise AttributeError(
+                'FortranParser has no flag or state %r' % (name))
+        self._ns[name] = value
+
+    def parse_files(self, files, cachedir=None, f2cmap_file=None, jobs=1):
+        """
+        Crack the Fortran or signature files and return the list of
+        post-processed blocks.  See crackfortran for the arguments.
+        """
+        return self._ns['_crackfortran'](files, cachedir, f2cmap_file, jobs)
+
+    def parse_string(self, source, filename='source.f90'):
+        """
+        Crack Fortran source given as a string.
+
+        filename determines the source form the same way as the name of
+        a file does (``.f`` fixed form, ``.f90`` free form, ...).  The
+        source is read from memory, nothing is written to disk.
+        """
+        self._ns['_stringsources'][filename] = source
+        try:
+            return self.parse_files([filename])
+        finally:
+            del self._ns['_stringsources'][filename]
+
+
+def crackfortran(files, cachedir=None, f2cmap_file=None, jobs=1):
+    """
+    Crack the Fortran or signature files and return the list of
+    post-processed blocks.
+
+    The flags are taken from the module globals (f77modulename,
+    dolowercase, include_paths, ...) and the files are parsed by a new
+    FortranParser.
+
+    When cachedir is given, the blocks read from every file and the
+    final result are stored in (and reused from) a
+    ``sigcache.SignatureCache`` in that directory, which must be private
+    to the user.  f2cmap_file only contributes to the cache key.
+
+    With jobs > 1 the files are read in that many worker processes and
+    the resulting blocks are merged in input order before
+    post-processing, giving the same result as reading them serially.
+
+    The module globals usermodules and f90modulevars are then those of
+    the parser.
+    """
+    global usermodules, f90modulevars
+
+    parser = FortranParser(**_parserstate())
+    postlist = parser.parse_files(files, cachedir, f2cmap_file, jobs)
+    usermodules = parser.usermodules
+    f90modulevars = parser.f90modulevars
+    return postlist
 
 
 def crack2fortran(block):
@@ -3252,6 +4135,8 @@ if __name__ == "__main__":
             skipemptyends = 1
         elif l == '--ignore-contains':
             ignorecontains = 1
+        elif l == '--no-skip-executable':
+            skipexecutable = 0
         elif l == '-f77':
             strictf77 = 1
             sourcecodeform = 'fix'
@@ -3293,7 +4178,6 @@ if __name__ == "__main__":
     if pyffilename:
         outmess('Writing fortran code to file %s\n' % repr(pyffilename), 0)
         pyf = crack2fortran(postlist)
-        with open(pyffilename, 'w') as f: 
-            f.write(pyf)
+        writefile(pyffilename, pyf)
     if showblocklist:
         show(postlist)
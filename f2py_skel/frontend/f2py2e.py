@@ -16,10 +16,15 @@ Pearu Peterson
 """
 import sys
 import os
+import io
+import json
 import pprint
 import re
+import contextlib
+import concurrent.futures
 
 from f2py_skel.frontend import crackfortran
+from f2py_skel.frontend import sigcache
 from f2py_skel.codegen import rules
 from f2py_skel.stds.pyf import cb_rules
 from f2py_skel.stds import auxfuncs
@@ -116,6 +121,41 @@ Options:
   --f2cmap <filename>  Load Fortran-to-Python KIND specification from the given
                    file. Default: .f2py_f2cmap in current directory.
 
+  --sig-cache-dir <dirname>  Cache the signatures cracked from <fortran files>
+                   in <dirname> and reuse them for unchanged files. The
+                   cache holds pickles, <dirname> must be owned by the user
+                   and not writable by others; it is created if needed.
+                   Default: no cache.
+  --no-sig-cache   Do not read or write the signature cache.
+
+  --jobs <N>       Read <fortran files> and build the modules in N worker
+                   processes. Default: 1.
+  --shards <N>     Write the wrappers of the routines to N more C files,
+                   <modulename>module_shard<i>.c, that are compiled
+                   separately and linked with <modulename>module.c.
+                   Default: 0, the wrappers are in <modulename>module.c.
+  --release-gil=<threadsafe|auto>  Release the GIL during the call of the
+                   routines with the threadsafe directive, or with auto, of
+                   all the routines that do not call Python: without
+                   call-back arguments and callstatement.
+                   Default: threadsafe.
+  --release-gil-shared=<hold|release>  With --release-gil=auto, hold or
+                   release the GIL during the call of the routines that
+                   may use COMMON blocks or module variables, which are
+                   then not protected from concurrent calls. Default: hold.
+  --batch          Add a batched variant routine.batch(...) to the routines
+                   with numeric arguments that do not call Python. Its array
+                   arguments have a leading batch axis, the routine is
+                   called on each slice with the GIL released and the
+                   outputs are stacked. The keyword nthreads=<N> splits the
+                   batch over N threads when the module is built with
+                   OpenMP (N < 1: all the threads).
+  --ufunc          Add a NumPy ufunc routine.ufunc to the routines whose
+                   arguments are numeric scalars, elemental or not. The
+                   ufunc broadcasts its inputs and calls the routine on
+                   each element; its outputs are the values returned by
+                   the routine.
+
   --quiet          Run quietly.
   --verbose        Run with extra verbosity.
   -v               Print f2py version ID and exit.
@@ -156,12 +196,19 @@ Extra options (only effective with -c):
     -DUNDERSCORE_G77
 
   When using -DF2PY_REPORT_ATEXIT, a performance report of F2PY
-  interface is printed out at exit (platforms: Linux).
+  interface is printed out at exit (platforms: Linux). Without
+  recompiling, the calls can be timed at runtime with
+  mod.__f2py_call_timing__(True); then mod.__f2py_call_stats__()
+  returns the number of calls, the time spent in each phase of the
+  calls and a histogram of their durations per routine.
 
   When using -DF2PY_REPORT_ON_ARRAY_COPY=<int>, a message is
   sent to stderr whenever F2PY interface makes a copy of an
   array. Integer <int> sets the threshold for array sizes when
-  a message should be shown.
+  a message should be shown. Without recompiling, the copies can be
+  audited at runtime with mod.__f2py_copy_audit__(True); then
+  mod.__f2py_copy_stats__() returns the number of copies and bytes
+  copied per routine and argument, and the reasons of the copies.
 
 Version:     {f2py_version}
 numpy Version: {numpy_version}
@@ -173,7 +220,8 @@ https://web.archive.org/web/20140822061353/http://cens.ioc.ee/projects/f2py2e"""
 
 def scaninputline(inputline):
     files, skipfuncs, onlyfuncs, debug = [], [], [], []
-    f, f2, f3, f5, f6, f7, f8, f9, f10 = 1, 0, 0, 0, 0, 0, 0, 0, 0
+    f, f2, f3, f5, f6, f7, f8, f9, f10, f11, f12, f13 = \
+        1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0
     verbose = 1
     dolc = -1
     dolatexdoc = 0
@@ -182,6 +230,13 @@ def scaninputline(inputline):
     buildpath = '.'
     include_paths = []
     signsfile, modulename = None, None
+    sigcachedir = None
+    jobs = 1
+    shards = 0
+    releasegil = 'threadsafe'
+    releasegilshared = 'hold'
+    batch = 0
+    ufunc = 0
     options = {'buildpath': buildpath,
                'coutput': None,
                'f2py_wrapper_output': None}
@@ -226,6 +281,29 @@ def scaninputline(inputline):
             f9 = 1
         elif l == '--f2cmap':
             f10 = 1
+        elif l == '--sig-cache-dir':
+            f11 = 1
+        elif l == '--no-sig-cache':
+            sigcachedir = None
+        elif l == '--jobs':
+            f12 = 1
+        elif l == '--shards':
+            f13 = 1
+        elif l[:14] == '--release-gil=':
+            releasegil = l[14:]
+            if releasegil not in ('threadsafe', 'auto'):
+                errmess('Invalid --release-gil mode %s\n' % repr(releasegil))
+                sys.exit()
+        elif l[:21] == '--release-gil-shared=':
+            releasegilshared = l[21:]
+            if releasegilshared not in ('hold', 'release'):
+                errmess('Invalid --release-gil-shared policy %s\n'
+                        % repr(releasegilshared))
+                sys.exit()
+        elif l == '--batch':
+            batch = 1
+        elif l == '--ufunc':
+            ufunc = 1
         elif l == '--overwrite-signature':
             options['h-overwrite'] = 1
         elif l == '-h':
@@ -270,6 +348,23 @@ def scaninputline(inputline):
         elif f10:
             f10 = 0
             options["f2cmap_file"] = l
+        elif f11:
+            f11 = 0
+            sigcachedir = l
+        elif f12:
+            f12 = 0
+            try:
+                jobs = int(l)
+            except ValueError:
+                errmess('Invalid number of jobs %s\n' % repr(l))
+                sys.exit()
+        elif f13:
+            f13 = 0
+            try:
+                shards = int(l)
+            except ValueError:
+                errmess('Invalid number of shards %s\n' % repr(l))
+                sys.exit()
         elif f == 1:
             try:
                 with open(l):
@@ -315,6 +410,13 @@ def scaninputline(inputline):
     options['buildpath'] = buildpath
     options['include_paths'] = include_paths
     options.setdefault('f2cmap_file', None)
+    options['sig_cache_dir'] = sigcachedir
+    options['jobs'] = jobs
+    options['shards'] = shards
+    options['release_gil'] = releasegil
+    options['release_gil_shared'] = releasegilshared
+    options['batch'] = batch
+    options['ufunc'] = ufunc
     return files, options
 
 
@@ -330,15 +432,16 @@ def callcrackfortran(files, options):
         crackfortran.onlyfuncs = options['onlyfuncs']
     crackfortran.include_paths[:] = options['include_paths']
     crackfortran.dolowercase = options['do-lower']
-    postlist = crackfortran.crackfortran(files)
+    postlist = crackfortran.crackfortran(
+        files, cachedir=options.get('sig_cache_dir'),
+        f2cmap_file=options.get('f2cmap_file'), jobs=options.get('jobs', 1))
     if 'signsfile' in options:
         outmess('Saving signatures to file "%s"\n' % (options['signsfile']))
         pyf = crackfortran.crack2fortran(postlist)
         if options['signsfile'][-6:] == 'stdout':
             sys.stdout.write(pyf)
         else:
-            with open(options['signsfile'], 'w') as f:
-                f.write(pyf)
+            auxfuncs.writefile(options['signsfile'], pyf)
     if options["coutput"] is None:
         for mod in postlist:
             mod["coutput"] = "%smodule.c" % mod["name"]
@@ -354,7 +457,80 @@ def callcrackfortran(files, options):
     return postlist
 
 
-def buildmodules(lst):
+def _buildstate():
+    """Return the global state a worker process needs to build modules."""
+    return {'rules': {'options': rules.options},
+            'auxfuncs': {'options': auxfuncs.options,
+                         'debugoptions': auxfuncs.debugoptions,
+                         'wrapfuncs': auxfuncs.wrapfuncs},
+            'f90mod_rules': {'options': f90mod_rules.options},
+            'capi_maps': {'f2cmap_all': capi_maps.f2cmap_all,
+                          'lcb2_map': capi_maps.lcb2_map},
+            'cb_rules': {'cb_map': cb_rules.cb_map,
+                         'cb_sharedecls': cb_rules.cb_sharedecls},
+            'cfuncs': {n: getattr(cfuncs, n) for n in (
+                'includes0', 'includes', 'userincludes', 'typedefs',
+                'typedefs_generated', 'cppmacros', 'cfuncs', 'callbacks',
+                'f90modhooks', 'commonhooks', 'needs')}}
+
+
+def _initbuild(state):
+    # The tables of cfuncs are updated in place, they are shared with
+    # its lookup functions.
+    for modname, values in state.items():
+        mod = globals()[modname]
+        for name, value in values.items():
+            if modname == 'cfuncs':
+                getattr(mod, name).update(value)
+            else:
+                setattr(mod, name, value)
+
+
+def _buildmodule(module, um, outneeds):
+    """
+    Build module in a worker process with the given needs pending.
+
+    Returns the result of rules.buildmodule together with the messages
+    written to stdout, so that the parent can replay them in module
+    order.
+    """
+    cfuncs.outneeds = outneeds
+    buf = io.StringIO()
+    with contextlib.redirect_stdout(buf):
+        ret = rules.buildmodule(module, um)
+    return ret, buf.getvalue()
+
+
+def _buildmodules(builds, jobs=1):
+    # Yield the results of rules.buildmodule for the (module, um,
+    # outneeds) tuples builds, in order.
+    if jobs > 1 and len(builds) > 1:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=min(jobs, len(builds)), initializer=_initbuild,
+                initargs=(_buildstate(),)) as pool:
+            results = pool.map(_buildmodule, *zip(*builds))
+            # The workers empty their copies of the needs (see
+            # cfuncs.get_needs), the needs of the first module are
+            # cfuncs.outneeds
+            cfuncs.outneeds = cfuncs.newneeds()
+            for ret, text in results:
+                sys.stdout.write(text)
+                yield ret
+    else:
+        for module, um, outneeds in builds:
+            cfuncs.outneeds = outneeds
+            yield rules.buildmodule(module, um)
+
+
+def buildmodules(lst, jobs=1):
+    """
+    Build the modules of the python module blocks in lst.
+
+    The needs of the call-back functions and the user includes go to
+    the first module built, every module collects its own needs.  With
+    jobs > 1 the modules are built in that many worker processes, the
+    result and the messages are the same.
+    """
     cfuncs.buildcfuncs()
     outmess('Building modules...\n')
     modules, mnames, isusedby = [], [], {}
@@ -369,26 +545,69 @@ def buildmodules(lst):
                     isusedby[u].append(item['name'])
             modules.append(item)
             mnames.append(item['name'])
-    ret = {}
+    # The messages printed before building every module, and the builds
+    steps, builds = [], []
+    outneeds = cfuncs.outneeds
     for module, name in zip(modules, mnames):
         if name in isusedby:
-            outmess('\tSkipping module "%s" which is used by %s.\n' % (
-                name, ','.join('"%s"' % s for s in isusedby[name])))
+            steps.append(('\tSkipping module "%s" which is used by %s.\n' % (
+                name, ','.join('"%s"' % s for s in isusedby[name])), None))
         else:
+            text = ''
             um = []
             if 'use' in module:
                 for u in module['use'].keys():
                     if u in isusedby and u in mnames:
                         um.append(modules[mnames.index(u)])
                     else:
-                        outmess(
+                        text += (
                             f'\tModule "{name}" uses nonexisting "{u}" '
                             'which will be ignored.\n')
+            steps.append((text, name))
+            builds.append((module, um, outneeds))
+            outneeds = cfuncs.newneeds()
+    results = _buildmodules(builds, jobs)
+    ret = {}
+    for text, name in steps:
+        if text:
+            outmess(text)
+        if name is not None:
             ret[name] = {}
-            dict_append(ret[name], rules.buildmodule(module, um))
+            dict_append(ret[name], next(results))
     return ret
 
 
+def writemanifest(name, generated, files, options):
+    """
+    Write the manifest of the module name to the file
+    ``<buildpath>/<name>-f2pymanifest.json`` and return its path.
+
+    The manifest lists the generated files and the files they are
+    derived from (the input files, the files these include and the
+    f2cmap file), every file with the sha256 hex digest of its content.
+    """
+    inputs = []
+    for fn in files:
+        inputs.append((fn, sigcache.filehash(fn)))
+        inputs.extend(sigcache.scanincludes(fn, options['include_paths']))
+    # same default as capi_maps.load_f2cmap_file
+    f2cmap_file = options.get('f2cmap_file') or '.f2py_f2cmap'
+    if os.path.isfile(f2cmap_file):
+        inputs.append((f2cmap_file, sigcache.filehash(f2cmap_file)))
+    manifest = {
+        'module': name,
+        'f2py_version': f2py_version,
+        'inputs': [{'path': fn, 'sha256': h}
+                   for fn, h in dict(inputs).items()],
+        'outputs': [{'path': fn, 'sha256': sigcache.filehash(fn)}
+                    for fn in generated],
+    }
+    fn = os.path.join(options['buildpath'], '%s-f2pymanifest.json' % (name))
+    auxfuncs.writefile(fn, json.dumps(manifest, indent=2) + '\n')
+    outmess('    Wrote manifest of module "%s" to file "%s"\n' % (name, fn))
+    return fn
+
+
 def dict_append(d_out, d_in):
     for (k, v) in d_in.items():
         if k not in d_out:
@@ -399,7 +618,7 @@ def dict_append(d_out, d_in):
             d_out[k].append(v)
 
 
-def run_main(comline_list):
+def run_main(comline_list, jobs=None):
     """
     Equivalent to running::
 
@@ -414,6 +633,9 @@ def run_main(comline_list):
     You cannot build extension modules with this function, that is,
     using ``-c`` is not allowed. Use ``compile`` command instead
 
+    ``jobs`` overrides the ``--jobs`` option: the number of worker
+    processes used to read the Fortran files and to build the modules.
+
     Examples
     --------
     .. literalinclude:: ../../source/f2py/code/results/run_main_session.dat
@@ -425,6 +647,8 @@ def run_main(comline_list):
     fobjhsrc = os.path.join(f2pydir, 'src', 'fortranobject.h')
     fobjcsrc = os.path.join(f2pydir, 'src', 'fortranobject.c')
     files, options = scaninputline(comline_list)
+    if jobs is not None:
+        options['jobs'] = jobs
     auxfuncs.options = options
     capi_maps.load_f2cmap_file(options['f2cmap_file'])
     postlist = callcrackfortran(files, options)
@@ -459,12 +683,16 @@ def run_main(comline_list):
                 repr(postlist[i]['block'])))
     auxfuncs.debugoptions = options['debug']
     f90mod_rules.options = options
+    cb_rules.options = options
     auxfuncs.wrapfuncs = options['wrapfuncs']
 
-    ret = buildmodules(postlist)
+    ret = buildmodules(postlist, options.get('jobs', 1))
 
     for mn in ret.keys():
-        dict_append(ret[mn], {'csrc': fobjcsrc, 'h': fobjhsrc})
+        dict_append(ret[mn], {'manifest': writemanifest(
+            mn, ret[mn].get('generated', []), files, options)})
+        dict_append(ret[mn], {'csrc': ret[mn].get('shardsrc', []) + [fobjcsrc],
+                              'h': fobjhsrc})
     return ret
 
 
@@ -491,6 +719,13 @@ def get_prefix(module):
     return p
 
 
+# Options of the code generation of f2py_skel: with -c numpy.distutils
+# generates the wrappers with the f2py of numpy, which does not have them.
+_codegen_options = ['--sig-cache-dir', '--no-sig-cache', '--jobs', '--shards',
+                    '--release-gil', '--release-gil-shared', '--batch',
+                    '--ufunc']
+
+
 def run_compile():
     """
     Do it all in one call!
@@ -500,6 +735,14 @@ def run_compile():
     i = sys.argv.index('-c')
     del sys.argv[i]
 
+    codegen_flags = [_m for _m in sys.argv[1:]
+                     if _m.split('=', 1)[0] in _codegen_options]
+    if codegen_flags:
+        errmess('f2py options %s are not supported with -c: generate the'
+                ' wrappers with f2py first, then build the generated'
+                ' sources.\n' % (', '.join(codegen_flags)))
+        sys.exit(1)
+
     remove_build_dir = 0
     try:
         i = sys.argv.index('--build-dir')
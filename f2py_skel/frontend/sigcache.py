@@ -0,0 +1,176 @@
+"""
+Persistent on-disk cache of crackfortran results.
+
+Reading and cracking Fortran sources is the most expensive part of
+generating wrappers for large code bases, yet between two f2py runs
+most input files are usually unchanged.  The cache stores the blocks
+read from every input file (and the fully post-processed block list of
+a complete run) as pickles keyed by
+
+  - the path and content hash of the input file,
+  - the paths and content hashes of all files it includes,
+  - the crackfortran options that affect cracking (lower casing,
+    only:/skip: lists, module name, include paths, f2cmap file),
+  - the f2py version.
+
+Entries are never invalidated explicitly; a changed input simply maps
+to a new key.  Remove the cache directory to reclaim disk space.
+
+Loading a pickle can run arbitrary code, so the cache is only used in a
+directory owned by the user that others cannot write to; the directory
+is created with these permissions when it does not exist.
+"""
+import hashlib
+import os
+import pickle
+import re
+import stat
+import tempfile
+
+from f2py_skel import __version__
+
+f2py_version = __version__.version
+
+_includeline = re.compile(
+    r'\s*include\s*(\'|")(?P<name>[^\'"]*)(\'|")', re.I)
+
+
+def isprivate(path):
+    """Return whether the directory path is owned by the user and is not
+    writable by the group or others."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    if not hasattr(os, 'getuid'):
+        # no POSIX ownership, e.g. Windows
+        return os.path.isdir(path)
+    return (st.st_uid == os.getuid() and os.path.isdir(path)
+            and not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH))
+
+
+def filehash(filename):
+    """Return the sha256 hex digest of the content of filename, or None."""
+    h = hashlib.sha256()
+    try:
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 16), b''):
+                h.update(chunk)
+    except OSError:
+        return None
+    return h.hexdigest()
+
+
+def scanincludes(filename, include_paths=(), _seen=None):
+    """
+    Return the list of ``(path, hash)`` pairs of files included
+    (recursively) by filename.
+
+    Include files are resolved the same way as in
+    ``crackfortran.readfortrancode``; an include that cannot be found is
+    reported with a ``None`` hash so that adding it later changes the key.
+    """
+    if _seen is None:
+        _seen = set()
+    ret = []
+    try:
+        with open(filename, 'r', errors='replace') as f:
+            lines = f.readlines()
+    except OSError:
+        return ret
+    for line in lines:
+        m = _includeline.match(line)
+        if not m:
+            continue
+        fn = m.group('name')
+        if os.path.isfile(fn):
+            found = fn
+        else:
+            found = None
+            for inc_dir in [os.path.dirname(filename)] + list(include_paths):
+                fn1 = os.path.join(inc_dir, fn)
+                if os.path.isfile(fn1):
+                    found = fn1
+                    break
+        if found is None:
+            ret.append((fn, None))
+            continue
+        ret.append((found, filehash(found)))
+        if found not in _seen:
+            _seen.add(found)
+            ret.extend(scanincludes(found, include_paths, _seen))
+    return ret
+
+
+class SignatureCache:
+    """
+    Content addressed store of crackfortran results in ``cachedir``.
+
+    ``options`` is a dictionary of the settings that influence the
+    cracked blocks; it becomes part of every key.  When ``cachedir`` is
+    not private (see ``isprivate``), nothing is loaded or stored and
+    ``trusted`` is False.
+    """
+
+    def __init__(self, cachedir, options=None):
+        self.cachedir = cachedir
+        try:
+            os.makedirs(cachedir, mode=0o700, exist_ok=True)
+        except OSError:
+            pass
+        self.trusted = isprivate(cachedir)
+        self.options = dict(options or {})
+        # same default as capi_maps.load_f2cmap_file
+        f2cmap_file = self.options.get('f2cmap_file') or '.f2py_f2cmap'
+        self.options['f2cmap_hash'] = filehash(f2cmap_file)
+        self.hits = 0
+        self.misses = 0
+
+    def _digest(self, *items):
+        h = hashlib.sha256()
+        h.update(repr((f2py_version, sorted(self.options.items()))).encode())
+        for item in items:
+            h.update(repr(item).encode())
+        return h.hexdigest()
+
+    def unitkey(self, files):
+        """Return the key of the blocks read from the list of files."""
+        include_paths = self.options.get('include_paths', ())
+        return self._digest('unit', [
+            (fn, filehash(fn), scanincludes(fn, include_paths))
+            for fn in files])
+
+    def runkey(self, unitkeys):
+        """Return the key of the post-processed blocks of a whole run."""
+        return self._digest('run', list(unitkeys))
+
+    def _path(self, key):
+        return os.path.join(self.cachedir, key[:2], key + '.pickle')
+
+    def load(self, key):
+        """Return the object stored under key, or None."""
+        if not self.trusted:
+            self.misses += 1
+            return None
+        try:
+            with open(self._path(key), 'rb') as f:
+                obj = pickle.load(f)
+        except Exception:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return obj
+
+    def store(self, key, obj):
+        """Store obj under key; failures to write are silently ignored."""
+        if not self.trusted:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except OSError:
+            pass
@@ -14,10 +14,11 @@ $Date: 2005/07/24 19:01:55 $
 Pearu Peterson
 
 """
+import hashlib
 import pprint
+import re
 import sys
 import types
-from functools import reduce
 
 from f2py_skel import __version__
 from f2py_skel.codegen import cfuncs
@@ -28,9 +29,9 @@ __all__ = [
     'getfortranname', 'getpymethoddef', 'getrestdoc', 'getusercode',
     'getusercode1', 'hasbody', 'hascallstatement', 'hascommon',
     'hasexternals', 'hasinitvalue', 'hasnote', 'hasresultnote',
-    'isallocatable', 'isarray', 'isarrayofstrings', 'iscomplex',
+    'isallocatable', 'isarray', 'isarrayofstrings', 'isbatch', 'iscomplex',
     'iscomplexarray', 'iscomplexfunction', 'iscomplexfunction_warn',
-    'isdouble', 'isdummyroutine', 'isexternal', 'isfunction',
+    'isdouble', 'isdummyroutine', 'iselemental', 'isexternal', 'isfunction',
     'isfunction_wrap', 'isint1array', 'isinteger', 'isintent_aux',
     'isintent_c', 'isintent_callback', 'isintent_copy', 'isintent_dict',
     'isintent_hide', 'isintent_in', 'isintent_inout', 'isintent_inplace',
@@ -44,7 +45,7 @@ __all__ = [
     'isunsigned_chararray', 'isunsigned_long_long',
     'isunsigned_long_longarray', 'isunsigned_short',
     'isunsigned_shortarray', 'l_and', 'l_not', 'l_or', 'outmess',
-    'replace', 'show', 'stripcomma', 'throw_error',
+    'replace', 'show', 'stripcomma', 'throw_error', 'writefile',
 ]
 
 
@@ -289,6 +290,10 @@ def requiresf90wrapper(rout):
     return ismoduleroutine(rout) or hasassumedshape(rout)
 
 
+def iselemental(rout):
+    return isroutine(rout) and 'elemental' in rout.get('prefix', '')
+
+
 def isroutine(rout):
     return isfunction(rout) or issubroutine(rout)
 
@@ -376,6 +381,11 @@ def isthreadsafe(rout):
            'threadsafe' in rout['f2pyenhancements']
 
 
+def isbatch(var):
+    # The routines and arguments of the batched wrappers are marked
+    return 'batch' in var
+
+
 def hasvariables(rout):
     return 'vars' in rout and rout['vars']
 
@@ -736,9 +746,15 @@ def gentitle(name):
 
 
 def flatlist(l):
-    if isinstance(l, list):
-        return reduce(lambda x, y, f=flatlist: x + f(y), l, [])
-    return [l]
+    if not isinstance(l, list):
+        return [l]
+    flat = []
+    for x in l:
+        if isinstance(x, list):
+            flat.extend(flatlist(x))
+        else:
+            flat.append(x)
+    return flat
 
 
 def stripcomma(s):
@@ -747,26 +763,191 @@ def stripcomma(s):
     return s
 
 
+def writefile(filename, text):
+    """
+    Write text to filename unless the file has that content already.
+
+    Returns the sha256 hex digest of text.  Unchanged files keep their
+    time stamps, so that make and the like do not rebuild from them.
+    """
+    digest = hashlib.sha256(text.encode()).hexdigest()
+    try:
+        with open(filename) as f:
+            old = hashlib.sha256(f.read().encode()).hexdigest()
+    except (OSError, UnicodeError):
+        old = None
+    if old != digest:
+        with open(filename, 'w') as f:
+            f.write(text)
+    return digest
+
+
+# Placeholders are #name# where name has no white space
+_placeholder = re.compile(r'#([^#\s]+)#')
+_placeholderhead = re.compile(r'([^#\s]*)#')
+_placeholdername = re.compile(r'[^#\s]*\Z')
+# Compiled templates by their text, see _compile_template
+_templates = {}
+_templatecachesize = 8192
+_templatemaxlength = 1 << 14
+
+
+def _compile_template(text):
+    """
+    Return (parts, names, joins) for the template text.
+
+    parts is text split into literals (at even positions) and the names
+    of its ``#name#`` placeholders (at odd positions).  For every
+    placeholder, names holds the name of the placeholder it overlaps
+    with (``b`` in ``#a#b#``) or None, and joins the text between the
+    placeholder and the nearest ``#`` on its left and on its right (None
+    when white space comes first): a value that replaces the placeholder
+    can join with that text into a new placeholder.  Short templates are
+    cached.
+    """
+    compiled = _templates.get(text)
+    if compiled is not None:
+        return compiled
+    parts = tuple(_placeholder.split(text))
+    n = len(parts)
+    names = []
+    joins = []
+    for i in range(1, n, 2):
+        before, after = parts[i - 1], parts[i + 1]
+        last = i + 2 == n
+        m = _placeholderhead.match(after)
+        if m and m.group(1):
+            names.append(m.group(1))
+        elif after and not last and _placeholdername.match(after):
+            names.append(after)
+        else:
+            names.append(None)
+        if before[-1:] == '#':
+            left = ''
+        elif i > 1 and _placeholdername.match(before):
+            left = before
+        else:
+            left = None
+        if m:
+            right = m.group(1)
+        elif not last and _placeholdername.match(after):
+            right = after
+        else:
+            right = None
+        joins.append((left, right))
+    compiled = (parts, tuple(names), tuple(joins))
+    if len(text) <= _templatemaxlength:
+        if len(_templates) >= _templatecachesize:
+            _templates.clear()
+        _templates[text] = compiled
+    return compiled
+
+
 def replace(str, d, defaultsep=''):
+    """
+    Return str with the ``#key#`` placeholders replaced by the values of d.
+
+    The result is the one of replacing every key of d in turn, twice over
+    (so that the placeholders in the inserted values are also replaced by
+    the keys that follow), but the template is rendered in a single pass:
+    an inserted value is only expanded by the substitution steps that
+    would have been applied after it.  Where placeholders overlap or
+    values can join with their neighbours into new placeholders, the
+    steps are applied one by one.  Keys with white space are not
+    supported.  List values are joined with ``d['separatorsfor'][key]``
+    or defaultsep.
+    """
     if isinstance(d, list):
         return [replace(str, _m, defaultsep) for _m in d]
     if isinstance(str, list):
         return [replace(_m, d, defaultsep) for _m in str]
-    for k in 2 * list(d.keys()):
-        if k == 'separatorsfor':
-            continue
-        if 'separatorsfor' in d and k in d['separatorsfor']:
-            sep = d['separatorsfor'][k]
-        else:
-            sep = defaultsep
-        if isinstance(d[k], list):
-            str = str.replace('#%s#' % (k), sep.join(flatlist(d[k])))
-        else:
-            str = str.replace('#%s#' % (k), d[k])
-    return str
+    values = {}
+    keys = []  # the substitution steps, filled in when needed
+    index = {}
+    keytext = []
+
+    def value(k):
+        v = values.get(k)
+        if v is None:
+            v = d[k]
+            if isinstance(v, list):
+                if 'separatorsfor' in d and k in d['separatorsfor']:
+                    sep = d['separatorsfor'][k]
+                else:
+                    sep = defaultsep
+                v = sep.join(flatlist(v))
+            values[k] = v
+        return v
+
+    def step(k, start):
+        # Return the first substitution step >= start that replaces k
+        if not keys:
+            keys.extend(k for k in d if k != 'separatorsfor')
+            index.update((k, i) for i, k in enumerate(keys))
+        i = index[k]
+        if i < start:
+            i += len(keys)
+        return i if i >= start else None
+
+    def iskeypart(s):
+        # Return True if s can be a part of a key of d
+        if not keytext:
+            keytext.append('\n'.join(d))
+        return _placeholdername.match(s) is not None and s in keytext[0]
+
+    def joined(v, left, right):
+        if '#' not in v:
+            return left is not None and right is not None and \
+                iskeypart(left + v + right)
+        return left is not None and iskeypart(left + v[:v.index('#')]) or \
+            right is not None and iskeypart(v[v.rindex('#') + 1:] + right)
+
+    def stepwise(text, start):
+        for k in 2 * [k for k in d if k != 'separatorsfor']:
+            if start:
+                start -= 1
+            else:
+                text = text.replace('#%s#' % (k), value(k))
+        return text
+
+    def render(text, start):
+        if '#' not in text:
+            return text
+        parts, names, joins = _compile_template(text)
+        out = [parts[0]]
+        for i in range(1, len(parts), 2):
+            k = parts[i]
+            if names[i // 2] in d:
+                return stepwise(text, start)
+            if k not in d or k == 'separatorsfor':
+                v = '#%s#' % (k)
+            else:
+                v = value(k)
+                if joins[i // 2] != (None, None) and \
+                   joined(v, *joins[i // 2]):
+                    return stepwise(text, start)
+                if start or '#' in v:
+                    s = step(k, start)
+                    if s is None:
+                        v = '#%s#' % (k)
+                    elif '#' in v:
+                        v = render(v, s + 1)
+            out.append(v)
+            out.append(parts[i + 1])
+        return ''.join(out)
+
+    return render(str, 0)
 
 
 def dictappend(rd, ar):
+    """
+    Append the values of ar to the values of rd and return rd.
+
+    The list values of rd are extended in place (string values become
+    lists first), so that accumulating the rules of many routines takes
+    linear time.  List values are copied when they are first added to rd
+    and the lists of ar are never modified.
+    """
     if isinstance(ar, list):
         for a in ar:
             rd = dictappend(rd, a)
@@ -779,7 +960,7 @@ def dictappend(rd, ar):
                 rd[k] = [rd[k]]
             if isinstance(rd[k], list):
                 if isinstance(ar[k], list):
-                    rd[k] = rd[k] + ar[k]
+                    rd[k].extend(ar[k])
                 else:
                     rd[k].append(ar[k])
             elif isinstance(rd[k], dict):
@@ -790,6 +971,8 @@ def dictappend(rd, ar):
                                 rd[k][k1] = ar[k][k1]
                     else:
                         rd[k] = dictappend(rd[k], ar[k])
+        elif isinstance(ar[k], list):
+            rd[k] = ar[k][:]
         else:
             rd[k] = ar[k]
     return rd
@@ -47,22 +47,23 @@ def findcommonblocks(block, top=1):
 def buildhooks(m):
     ret = {'commonhooks': [], 'initcommonhooks': [],
            'docs': ['"COMMON blocks:\\n"']}
-    fwrap = ['']
+    # The lines of the hooks are collected in lists and joined at the end
+    fwrap = []
 
     def fadd(line, s=fwrap):
-        s[0] = '%s\n      %s' % (s[0], line)
-    chooks = ['']
+        s.append('\n      %s' % (line))
+    chooks = []
 
     def cadd(line, s=chooks):
-        s[0] = '%s\n%s' % (s[0], line)
-    ihooks = ['']
+        s.append('\n%s' % (line))
+    ihooks = []
 
     def iadd(line, s=ihooks):
-        s[0] = '%s\n%s' % (s[0], line)
-    doc = ['']
+        s.append('\n%s' % (line))
+    doc = []
 
     def dadd(line, s=doc):
-        s[0] = '%s\n%s' % (s[0], line)
+        s.append('\n%s' % (line))
     for (name, vnames, vars) in findcommonblocks(m):
         lower_name = name.lower()
         hnames, inames = [], []
@@ -137,9 +138,9 @@ def buildhooks(m):
         dadd('\\end{description}')
         ret['docs'].append(
             '"\t/%s/ %s\\n"' % (name, ','.join(map(lambda v, d: v + d, inames, idims))))
-    ret['commonhooks'] = chooks
-    ret['initcommonhooks'] = ihooks
-    ret['latexdoc'] = doc[0]
+    ret['commonhooks'] = [''.join(chooks)]
+    ret['initcommonhooks'] = [''.join(ihooks)]
+    ret['latexdoc'] = ''.join(doc)
     if len(ret['docs']) <= 1:
         ret['docs'] = ''
-    return ret, fwrap[0]
+    return ret, ''.join(fwrap)
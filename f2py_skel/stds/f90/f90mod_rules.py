@@ -91,14 +91,15 @@ def buildhooks(pymod):
            'separatorsfor': {'includes0': '\n', 'includes': '\n'},
            'docs': ['"Fortran 90/95 modules:\\n"'],
            'latexdoc': []}
-    fhooks = ['']
+    # The lines of the hooks are collected in lists and joined at the end
+    fhooks = []
 
     def fadd(line, s=fhooks):
-        s[0] = '%s\n      %s' % (s[0], line)
-    doc = ['']
+        s.append('\n      %s' % (line))
+    doc = []
 
     def dadd(line, s=doc):
-        s[0] = '%s\n%s' % (s[0], line)
+        s.append('\n%s' % (line))
     for m in findf90modules(pymod):
         sargs, fargs, efargs, modobjs, notvars, onlyvars = [], [], [], [], [
             m['name']], []
@@ -117,14 +118,14 @@ def buildhooks(pymod):
                 (m['name']))
         if onlyvars:
             outmess('\t\t  Variables: %s\n' % (' '.join(onlyvars)))
-        chooks = ['']
+        chooks = []
 
         def cadd(line, s=chooks):
-            s[0] = '%s\n%s' % (s[0], line)
-        ihooks = ['']
+            s.append('\n%s' % (line))
+        ihooks = []
 
         def iadd(line, s=ihooks):
-            s[0] = '%s\n%s' % (s[0], line)
+            s.append('\n%s' % (line))
 
         vrd = capi_maps.modsign2map(m)
         cadd('static FortranDataDef f2py_%s_def[] = {' % (m['name']))
@@ -176,11 +177,11 @@ def buildhooks(pymod):
                 fadd('use %s, only: d => %s\n' %
                      (m['name'], undo_rmbadname1(n)))
                 fadd('integer flag\n')
-                fhooks[0] = fhooks[0] + fgetdims1
+                fhooks.append(fgetdims1)
                 dms = range(1, int(dm['rank']) + 1)
                 fadd(' allocate(d(%s))\n' %
                      (','.join(['s(%s)' % i for i in dms])))
-                fhooks[0] = fhooks[0] + use_fgetdims2
+                fhooks.append(use_fgetdims2)
                 fadd('end subroutine %s' % (fargs[-1]))
             else:
                 fargs.append(n)
@@ -197,14 +198,19 @@ def buildhooks(pymod):
                     continue
                 modobjs.append('%s()' % (b['name']))
                 b['modulename'] = m['name']
+                # The variables that the routine may use, see
+                # rules.usesglobals
+                b['modulevars'] = [
+                    n for n in m['vars'] if n not in notvars and
+                    'parameter' not in m['vars'][n].get('attrspec', [])]
                 api, wrap = rules.buildapi(b)
                 if isfunction(b):
-                    fhooks[0] = fhooks[0] + wrap
+                    fhooks.append(wrap)
                     fargs.append('f2pywrap_%s_%s' % (m['name'], b['name']))
                     ifargs.append(func2subr.createfuncwrapper(b, signature=1))
                 else:
                     if wrap:
-                        fhooks[0] = fhooks[0] + wrap
+                        fhooks.append(wrap)
                         fargs.append('f2pywrap_%s_%s' % (m['name'], b['name']))
                         ifargs.append(
                             func2subr.createsubrwrapper(b, signature=1))
@@ -224,8 +230,8 @@ def buildhooks(pymod):
                      (m['name'], b['name']))
         cadd('\t{NULL}\n};\n')
         iadd('}')
-        ihooks[0] = 'static void f2py_setup_%s(%s) {\n\tint i_f2py=0;%s' % (
-            m['name'], ','.join(sargs), ihooks[0])
+        ihooks.insert(0, 'static void f2py_setup_%s(%s) {\n\tint i_f2py=0;' % (
+            m['name'], ','.join(sargs)))
         if '_' in m['name']:
             F_FUNC = 'F_FUNC_US'
         else:
@@ -236,7 +242,8 @@ def buildhooks(pymod):
         iadd('\t%s(f2pyinit%s,F2PYINIT%s)(f2py_setup_%s);'
              % (F_FUNC, m['name'], m['name'].upper(), m['name']))
         iadd('}\n')
-        ret['f90modhooks'] = ret['f90modhooks'] + chooks + ihooks
+        ret['f90modhooks'] = ret['f90modhooks'] + [''.join(chooks),
+                                                   ''.join(ihooks)]
         ret['initf90modhooks'] = ['\tPyDict_SetItemString(d, "%s", PyFortranObject_New(f2py_%s_def,f2py_init_%s));' % (
             m['name'], m['name'], m['name'])] + ret['initf90modhooks']
         fadd('')
@@ -264,7 +271,7 @@ def buildhooks(pymod):
     ret['routine_defs'] = ''
     ret['doc'] = []
     ret['docshort'] = []
-    ret['latexdoc'] = doc[0]
+    ret['latexdoc'] = ''.join(doc)
     if len(ret['docs']) <= 1:
         ret['docs'] = ''
-    return ret, fhooks[0]
+    return ret, ''.join(fhooks)
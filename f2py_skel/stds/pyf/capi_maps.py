@@ -658,6 +658,8 @@ def routsign2map(rout):
         ret['rname'] = a
         ret['pydocsign'], ret['pydocsignout'] = getpydocsign(a, rout)
         ret['ctype'] = getctype(rout['vars'][a])
+        if ret['ctype'] in c2capi_map:
+            ret['atype'] = c2capi_map[ret['ctype']]
         if hasresultnote(rout):
             ret['resultnote'] = rout['vars'][a]['note']
             rout['vars'][a]['note'] = ['See elsewhere.']
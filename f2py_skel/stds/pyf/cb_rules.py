@@ -27,42 +27,54 @@ from f2py_skel.codegen import cfuncs
 
 f2py_version = __version__.version
 
+options = {}
+
 
 ################## Rules for callback function ##############
 
-cb_routine_rules = {
-    'cbtypedefs': 'typedef #rctype#(*#name#_typedef)(#optargs_td##args_td##strarglens_td##noargs#);',
-    'body': """
-#begintitle#
+# The call-back function is #static# (see buildcallback) and the
+# functions of its active call-back are #cbstatic#. When the module is
+# split in shards they are F2PY_HIDDEN, defined once in the unit of the
+# module initialization and declared by their 'sharedecls' in the units
+# of the wrappers, see rules.shardbodies.
+cbstruct = """\
 typedef struct {
     PyObject *capi;
     PyTupleObject *args_capi;
     int nofargs;
     jmp_buf jmpbuf;
-} #name#_t;
+} #name#_t;"""
+cbproto = """\
+#static# #rctype# #callbackname# (#optargs##args##strarglens##noargs#)"""
+
+cb_routine_rules = {
+    'cbtypedefs': 'typedef #rctype#(*#name#_typedef)(#optargs_td##args_td##strarglens_td##noargs#);',
+    'body': """
+#begintitle#
+""" + cbstruct + """
 
 #if defined(F2PY_THREAD_LOCAL_DECL) && !defined(F2PY_USE_PYTHON_TLS)
 
 static F2PY_THREAD_LOCAL_DECL #name#_t *_active_#name# = NULL;
 
-static #name#_t *swap_active_#name#(#name#_t *ptr) {
+#cbstatic# #name#_t *swap_active_#name#(#name#_t *ptr) {
     #name#_t *prev = _active_#name#;
     _active_#name# = ptr;
     return prev;
 }
 
-static #name#_t *get_active_#name#(void) {
+#cbstatic# #name#_t *get_active_#name#(void) {
     return _active_#name#;
 }
 
 #else
 
-static #name#_t *swap_active_#name#(#name#_t *ptr) {
+#cbstatic# #name#_t *swap_active_#name#(#name#_t *ptr) {
     char *key = "__f2py_cb_#name#";
     return (#name#_t *)F2PySwapThreadLocalCallbackPtr(key, ptr);
 }
 
-static #name#_t *get_active_#name#(void) {
+#cbstatic# #name#_t *get_active_#name#(void) {
     char *key = "__f2py_cb_#name#";
     return (#name#_t *)F2PyGetThreadLocalCallbackPtr(key);
 }
@@ -70,19 +82,23 @@ static #name#_t *get_active_#name#(void) {
 #endif
 
 /*typedef #rctype#(*#name#_typedef)(#optargs_td##args_td##strarglens_td##noargs#);*/
-#static# #rctype# #callbackname# (#optargs##args##strarglens##noargs#) {
+""" + cbproto + """ {
     #name#_t cb_local = { NULL, NULL, 0 };
     #name#_t *cb = NULL;
     PyTupleObject *capi_arglist = NULL;
     PyObject *capi_return = NULL;
+    PyObject **capi_items = NULL;
     PyObject *capi_tmp = NULL;
     PyObject *capi_arglist_list = NULL;
     int capi_j,capi_i = 0;
     int capi_longjmp_ok = 1;
+    npy_int64 capi_clock = 0;
 #decl#
 #ifdef F2PY_REPORT_ATEXIT
 f2py_cb_start_clock();
 #endif
+    if (f2py_call_timing)
+        capi_clock = F2PyClock_Now();
     cb = get_active_#name#();
     if (cb == NULL) {
         capi_longjmp_ok = 0;
@@ -127,13 +143,16 @@ f2py_cb_start_clock();
     }
 #setdims#
 #ifdef PYPY_VERSION
+#define CAPI_ARGLIST_GETITEM(idx) NULL
 #define CAPI_ARGLIST_SETITEM(idx, value) PyList_SetItem((PyObject *)capi_arglist_list, idx, value)
     capi_arglist_list = PySequence_List(capi_arglist);
     if (capi_arglist_list == NULL) goto capi_fail;
 #else
+#define CAPI_ARGLIST_GETITEM(idx) PyTuple_GET_ITEM((PyObject *)capi_arglist, idx)
 #define CAPI_ARGLIST_SETITEM(idx, value) PyTuple_SetItem((PyObject *)capi_arglist, idx, value)
 #endif
 #pyobjfrom#
+#undef CAPI_ARGLIST_GETITEM
 #undef CAPI_ARGLIST_SETITEM
 #ifdef PYPY_VERSION
     CFUNCSMESSPY(\"cb:capi_arglist=\",capi_arglist_list);
@@ -149,7 +168,7 @@ f2py_cb_start_call_clock();
     Py_DECREF(capi_arglist_list);
     capi_arglist_list = NULL;
 #else
-    capi_return = PyObject_CallObject(cb->capi,(PyObject *)capi_arglist);
+    capi_return = PyObject_Vectorcall(cb->capi,PySequence_Fast_ITEMS((PyObject *)capi_arglist),PyTuple_GET_SIZE(capi_arglist),NULL);
 #endif
 #ifdef F2PY_REPORT_ATEXIT
 f2py_cb_stop_call_clock();
@@ -160,13 +179,16 @@ f2py_cb_stop_call_clock();
         goto capi_fail;
     }
     if (capi_return == Py_None) {
-        Py_DECREF(capi_return);
-        capi_return = Py_BuildValue(\"()\");
+        capi_j = 0;
+    }
+    else if (PyTuple_Check(capi_return)) {
+        capi_items = PySequence_Fast_ITEMS(capi_return);
+        capi_j = PyTuple_GET_SIZE(capi_return);
     }
-    else if (!PyTuple_Check(capi_return)) {
-        capi_return = Py_BuildValue(\"(N)\",capi_return);
+    else {
+        capi_items = &capi_return;
+        capi_j = 1;
     }
-    capi_j = PyTuple_Size(capi_return);
     capi_i = 0;
 #frompyobj#
     CFUNCSMESS(\"cb:#name#:successful\\n\");
@@ -179,15 +201,20 @@ capi_fail:
     fprintf(stderr,\"Call-back #name# failed.\\n\");
     Py_XDECREF(capi_return);
     Py_XDECREF(capi_arglist_list);
+    F2PyCallClock_Callback(&capi_clock);
     if (capi_longjmp_ok) {
         longjmp(cb->jmpbuf,-1);
     }
 capi_return_pt:
-    ;
+    F2PyCallClock_Callback(&capi_clock);
 #return#
 }
 #endtitle#
 """,
+    'sharedecls': cbstruct + """
+extern #cbstatic# #name#_t *swap_active_#name#(#name#_t *ptr);
+extern #cbstatic# #name#_t *get_active_#name#(void);
+""" + cbproto + ";",
     'need': ['setjmp.h', 'CFUNCSMESS', 'F2PY_THREAD_LOCAL_DECL'],
     'maxnofargs': '#maxnofargs#',
     'nofoptargs': '#nofoptargs#',
@@ -233,11 +260,11 @@ cb_rout_rules = [
     }, {  # Function
         'decl': '    #ctype# return_value;',
         'frompyobj': [{debugcapi: '    CFUNCSMESS("cb:Getting return_value->");'},
-                      '    if (capi_j>capi_i)\n        GETSCALARFROMPYTUPLE(capi_return,capi_i++,&return_value,#ctype#,"#ctype#_from_pyobj failed in converting return_value of call-back function #name# to C #ctype#\\n");',
+                      '    if (capi_j>capi_i)\n        GETSCALARFROMPYITEMS(capi_items,capi_i++,&return_value,#ctype#,"#ctype#_from_pyobj failed in converting return_value of call-back function #name# to C #ctype#\\n");',
                       {debugcapi:
                        '    fprintf(stderr,"#showvalueformat#.\\n",return_value);'}
                       ],
-        'need': ['#ctype#_from_pyobj', {debugcapi: 'CFUNCSMESS'}, 'GETSCALARFROMPYTUPLE'],
+        'need': ['#ctype#_from_pyobj', {debugcapi: 'CFUNCSMESS'}, 'GETSCALARFROMPYITEMS'],
         'return': '    return return_value;',
         '_check': l_and(isfunction, l_not(isstringfunction), l_not(iscomplexfunction))
     },
@@ -248,12 +275,12 @@ cb_rout_rules = [
         'args_td': '#ctype# ,int',
         'frompyobj': [{debugcapi: '    CFUNCSMESS("cb:Getting return_value->\\"");'},
                       """    if (capi_j>capi_i)
-        GETSTRFROMPYTUPLE(capi_return,capi_i++,return_value,return_value_len);""",
+        GETSTRFROMPYITEMS(capi_items,capi_i++,return_value,return_value_len);""",
                       {debugcapi:
                        '    fprintf(stderr,"#showvalueformat#\\".\\n",return_value);'}
                       ],
         'need': ['#ctype#_from_pyobj', {debugcapi: 'CFUNCSMESS'},
-                 'string.h', 'GETSTRFROMPYTUPLE'],
+                 'string.h', 'GETSTRFROMPYITEMS'],
         'return': 'return;',
         '_check': isstringfunction
     },
@@ -282,9 +309,9 @@ return_value
                       """\
     if (capi_j>capi_i)
 #ifdef F2PY_CB_RETURNCOMPLEX
-        GETSCALARFROMPYTUPLE(capi_return,capi_i++,&return_value,#ctype#,\"#ctype#_from_pyobj failed in converting return_value of call-back function #name# to C #ctype#\\n\");
+        GETSCALARFROMPYITEMS(capi_items,capi_i++,&return_value,#ctype#,\"#ctype#_from_pyobj failed in converting return_value of call-back function #name# to C #ctype#\\n\");
 #else
-        GETSCALARFROMPYTUPLE(capi_return,capi_i++,return_value,#ctype#,\"#ctype#_from_pyobj failed in converting return_value of call-back function #name# to C #ctype#\\n\");
+        GETSCALARFROMPYITEMS(capi_items,capi_i++,return_value,#ctype#,\"#ctype#_from_pyobj failed in converting return_value of call-back function #name# to C #ctype#\\n\");
 #endif
 """,
                       {debugcapi: """
@@ -304,7 +331,7 @@ return_value
 #endif
 """,
         'need': ['#ctype#_from_pyobj', {debugcapi: 'CFUNCSMESS'},
-                 'string.h', 'GETSCALARFROMPYTUPLE', '#ctype#'],
+                 'string.h', 'GETSCALARFROMPYITEMS', '#ctype#'],
         '_check': iscomplexfunction
     },
     {'docstrout': '        #pydocsignout#',
@@ -364,7 +391,7 @@ cb_arg_rules = [
                   ''},
         'frompyobj': [{debugcapi: '    CFUNCSMESS("cb:Getting #varname#->");'},
                       {isintent_out:
-                       '    if (capi_j>capi_i)\n        GETSCALARFROMPYTUPLE(capi_return,capi_i++,#varname_i#_cb_capi,#ctype#,"#ctype#_from_pyobj failed in converting argument #varname# of call-back function #name# to C #ctype#\\n");'},
+                       '    if (capi_j>capi_i)\n        GETSCALARFROMPYITEMS(capi_items,capi_i++,#varname_i#_cb_capi,#ctype#,"#ctype#_from_pyobj failed in converting argument #varname# of call-back function #name# to C #ctype#\\n");'},
                       {l_and(debugcapi, l_and(l_not(iscomplex), isintent_c)):
                           '    fprintf(stderr,"#showvalueformat#.\\n",#varname_i#);'},
                       {l_and(debugcapi, l_and(l_not(iscomplex), l_not( isintent_c))):
@@ -374,7 +401,7 @@ cb_arg_rules = [
                       {l_and(debugcapi, l_and(iscomplex, l_not( isintent_c))):
                           '    fprintf(stderr,"#showvalueformat#.\\n",(*#varname_i#_cb_capi).r,(*#varname_i#_cb_capi).i);'},
                       ],
-        'need': [{isintent_out: ['#ctype#_from_pyobj', 'GETSCALARFROMPYTUPLE']},
+        'need': [{isintent_out: ['#ctype#_from_pyobj', 'GETSCALARFROMPYITEMS']},
                  {debugcapi: 'CFUNCSMESS'}],
         '_check': isscalar
     }, {
@@ -394,11 +421,11 @@ cb_arg_rules = [
     }, {  # String
         'frompyobj': [{debugcapi: '    CFUNCSMESS("cb:Getting #varname#->\\"");'},
                       """    if (capi_j>capi_i)
-        GETSTRFROMPYTUPLE(capi_return,capi_i++,#varname_i#,#varname_i#_cb_len);""",
+        GETSTRFROMPYITEMS(capi_items,capi_i++,#varname_i#,#varname_i#_cb_len);""",
                       {debugcapi:
                        '    fprintf(stderr,"#showvalueformat#\\":%d:.\\n",#varname_i#,#varname_i#_cb_len);'},
                       ],
-        'need': ['#ctype#', 'GETSTRFROMPYTUPLE',
+        'need': ['#ctype#', 'GETSTRFROMPYITEMS',
                  {debugcapi: 'CFUNCSMESS'}, 'string.h'],
         '_check': l_and(isstring, isintent_out)
     }, {
@@ -430,20 +457,18 @@ cb_arg_rules = [
                       {isintent_c: """\
     if (cb->nofargs>capi_i) {
         int itemsize_ = #atype# == NPY_STRING ? 1 : 0;
-        /*XXX: Hmm, what will destroy this array??? */
-        PyArrayObject *tmp_arr = (PyArrayObject *)PyArray_New(&PyArray_Type,#rank#,#varname_i#_Dims,#atype#,NULL,(char*)#varname_i#,itemsize_,NPY_ARRAY_CARRAY,NULL);
+        PyObject *tmp_arr = F2PyCallback_Array(CAPI_ARGLIST_GETITEM(capi_i),#atype#,#rank#,#varname_i#_Dims,itemsize_,(char*)#varname_i#,NPY_ARRAY_CARRAY);
 """,
                        l_not(isintent_c): """\
     if (cb->nofargs>capi_i) {
         int itemsize_ = #atype# == NPY_STRING ? 1 : 0;
-        /*XXX: Hmm, what will destroy this array??? */
-        PyArrayObject *tmp_arr = (PyArrayObject *)PyArray_New(&PyArray_Type,#rank#,#varname_i#_Dims,#atype#,NULL,(char*)#varname_i#,itemsize_,NPY_ARRAY_FARRAY,NULL);
+        PyObject *tmp_arr = F2PyCallback_Array(CAPI_ARGLIST_GETITEM(capi_i),#atype#,#rank#,#varname_i#_Dims,itemsize_,(char*)#varname_i#,NPY_ARRAY_FARRAY);
 """,
                        },
                       """
         if (tmp_arr==NULL)
             goto capi_fail;
-        if (CAPI_ARGLIST_SETITEM(capi_i++,(PyObject *)tmp_arr))
+        if (CAPI_ARGLIST_SETITEM(capi_i++,tmp_arr))
             goto capi_fail;
 }"""],
         '_check': l_and(isarray, isintent_nothide, l_or(isintent_in, isintent_inout)),
@@ -452,7 +477,7 @@ cb_arg_rules = [
         'frompyobj': [{debugcapi: '    CFUNCSMESS("cb:Getting #varname#->");'},
                       """    if (capi_j>capi_i) {
         PyArrayObject *rv_cb_arr = NULL;
-        if ((capi_tmp = PyTuple_GetItem(capi_return,capi_i++))==NULL) goto capi_fail;
+        capi_tmp = capi_items[capi_i++];
         rv_cb_arr =  array_from_pyobj(#atype#,#varname_i#_Dims,#rank#,F2PY_INTENT_IN""",
                       {isintent_c: '|F2PY_INTENT_C'},
                       """,capi_tmp);
@@ -477,6 +502,7 @@ cb_arg_rules = [
 
 ################## Build call-back module #############
 cb_map = {}
+cb_sharedecls = {}
 
 
 def buildcallbacks(m):
@@ -499,6 +525,11 @@ def buildcallback(rout, um):
     capi_maps.depargs = depargs
     var = rout['vars']
     vrd = capi_maps.cb_routsign2map(rout, um)
+    vrd['cbstatic'] = 'static'
+    if options.get('shards'):
+        vrd['cbstatic'] = 'F2PY_HIDDEN'
+        if vrd['static'] == 'static':
+            vrd['static'] = 'F2PY_HIDDEN'
     rd = dictappend({}, vrd)
     cb_map[um].append([rout['name'], rd['name']])
     for r in cb_rout_rules:
@@ -595,6 +626,7 @@ def buildcallback(rout, um):
 
     ar = applyrules(cb_routine_rules, rd)
     cfuncs.callbacks[rd['name']] = ar['body']
+    cb_sharedecls[rd['name']] = ar['sharedecls']
     if isinstance(ar['need'], str):
         ar['need'] = [ar['need']]
 
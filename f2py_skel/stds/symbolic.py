@@ -21,7 +21,9 @@ __all__ = ['Expr']
 
 
 import re
+import threading
 import warnings
+from collections import OrderedDict, namedtuple
 from enum import Enum
 from math import gcd
 
@@ -143,14 +145,21 @@ class ExprWarning(UserWarning):
     pass
 
 
+_ewarn_count = 0
+
+
 def ewarn(message):
+    global _ewarn_count
+    _ewarn_count += 1
     warnings.warn(message, ExprWarning, stacklevel=2)
 
 
 class Expr:
     """Represents a Fortran expression as a op-data pair.
 
-    Expr instances are hashable and sortable.
+    Expr instances are hashable and sortable. They must not be modified
+    once they are used: the results of fromstring and normalize are
+    cached and shared between callers.
     """
 
     @staticmethod
@@ -231,13 +240,16 @@ class Expr:
                 and self.data == other.data)
 
     def __hash__(self):
-        if self.op in (Op.TERMS, Op.FACTORS):
-            data = tuple(sorted(self.data.items()))
-        elif self.op is Op.APPLY:
-            data = self.data[:2] + tuple(sorted(self.data[2].items()))
-        else:
-            data = self.data
-        return hash((self.op, data))
+        h = self.__dict__.get('_hash')
+        if h is None:
+            if self.op in (Op.TERMS, Op.FACTORS):
+                data = tuple(sorted(self.data.items()))
+            elif self.op is Op.APPLY:
+                data = self.data[:2] + tuple(sorted(self.data[2].items()))
+            else:
+                data = self.data
+            h = self._hash = hash((self.op, data))
+        return h
 
     def __lt__(self, other):
         if isinstance(other, Expr):
@@ -584,7 +596,7 @@ class Expr:
             value = symbols_map.get(self)
             if value is None:
                 return self
-            m = re.match(r'\A(@__f2py_PARENTHESIS_(\w+)_\d+@)\Z', self.data)
+            m = _parenthesis_symbol_pattern.match(self.data)
             if m:
                 # complement to fromstring method
                 items, paren = m.groups()
@@ -781,12 +793,159 @@ class Expr:
         return a, b
 
 
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class _LRUCache:
+    # Internal thread-safe mapping that keeps the maxsize most recently
+    # used items.
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.items.move_to_end(key)
+                self.hits += 1
+            return value
+
+    def setdefault(self, key, value):
+        with self.lock:
+            value = self.items.setdefault(key, value)
+            self.items.move_to_end(key)
+            if len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+            return value
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.hits = self.misses = 0
+
+    def info(self):
+        return CacheInfo(self.hits, self.misses, self.maxsize,
+                         len(self.items))
+
+
+# Parsed expressions by (string, language), see fromstring.
+_fromstring_cache = _LRUCache(1024)
+# Normalized expressions by the key of the expression to normalize.
+_normalize_cache = _LRUCache(8192)
+# The shared instances of expressions by their key (hash-consing).
+_intern_cache = _LRUCache(8192)
+
+
+def cache_info():
+    """Return the statistics of the expression caches.
+
+    The result maps the cache names 'fromstring', 'normalize' and
+    'intern' to CacheInfo(hits, misses, maxsize, currsize) tuples.
+    """
+    return {'fromstring': _fromstring_cache.info(),
+            'normalize': _normalize_cache.info(),
+            'intern': _intern_cache.info()}
+
+
+def clear_caches():
+    """Clear the expression caches and reset their statistics.
+    """
+    _fromstring_cache.clear()
+    _normalize_cache.clear()
+    _intern_cache.clear()
+
+
+def _exprkey(obj):
+    # Return a hashable key that identifies obj structurally. Unlike
+    # Expr equality, the key tells integer and real coefficients apart
+    # (`2 * x` and `2.0 * x` are equal expressions). The key is stored
+    # in the instance.
+    if not isinstance(obj, Expr):
+        return type(obj), obj
+    key = obj.__dict__.get('_key')
+    if key is not None:
+        return key
+    op, data = obj.op, obj.data
+    if op in (Op.TERMS, Op.FACTORS):
+        data = frozenset((_exprkey(k), _exprkey(v)) for k, v in data.items())
+    elif op is Op.APPLY:
+        func, args, kwargs = data
+        data = (_exprkey(func), tuple(map(_exprkey, args)),
+                frozenset((k, _exprkey(v)) for k, v in kwargs.items()))
+    elif op in (Op.REF, Op.DEREF):
+        data = _exprkey(data)
+    elif op in (Op.COMPLEX, Op.ARRAY, Op.CONCAT, Op.INDEXING, Op.TERNARY,
+                Op.RELATIONAL):
+        data = tuple(map(_exprkey, data))
+    key = obj._key = (op, data)
+    return key
+
+
+def _map_operands(obj, func):
+    # Return obj with func applied to its Expr operands.
+    op, data = obj.op, obj.data
+    if op in (Op.TERMS, Op.FACTORS):
+        data = dict((func(k), func(v) if isinstance(v, Expr) else v)
+                    for k, v in data.items())
+    elif op is Op.APPLY:
+        target, args, kwargs = data
+        if isinstance(target, Expr):
+            target = func(target)
+        data = (target, tuple(map(func, args)),
+                dict((k, func(v)) for k, v in kwargs.items()))
+    elif op in (Op.REF, Op.DEREF):
+        data = func(data)
+    elif op in (Op.COMPLEX, Op.ARRAY, Op.CONCAT, Op.TERNARY):
+        data = tuple(map(func, data))
+    elif op is Op.INDEXING:
+        target = data[0]
+        if isinstance(target, Expr):
+            target = func(target)
+        data = (target,) + tuple(map(func, data[1:]))
+    elif op is Op.RELATIONAL:
+        data = (data[0], func(data[1]), func(data[2]))
+    else:
+        return obj
+    return Expr(op, data)
+
+
+def intern(obj):
+    """Return the shared instance of an expression equal to obj.
+
+    Expressions with the same structure are represented by one instance,
+    so that identical subexpressions share storage.
+    """
+    if not isinstance(obj, Expr):
+        return obj
+    key = _exprkey(obj)
+    r = _intern_cache.get(key)
+    if r is None:
+        r = _map_operands(obj, intern)
+        r._key = key
+        r = _intern_cache.setdefault(key, r)
+    return r
+
+
 def normalize(obj):
     """Normalize Expr and apply basic evaluation methods.
     """
     if not isinstance(obj, Expr):
         return obj
+    key = _exprkey(obj)
+    r = _normalize_cache.get(key)
+    if r is None:
+        r = _normalize_cache.setdefault(key, intern(_normalize(obj)))
+    return r
 
+
+def _normalize(obj):
     if obj.op is Op.TERMS:
         d = {}
         for t, c in obj.data.items():
@@ -1162,6 +1321,39 @@ def _counter():
 COUNTER = _counter()
 
 
+# The patterns of the parser are compiled once: the re module cache is
+# easily flooded by the callers (crackfortran compiles a pattern for
+# every variable name), and recompiling them dominates parsing then.
+_quotes_pattern = re.compile(
+    r'({kind}_|)({single_quoted}|{double_quoted})'.format(
+        kind=r'\w[\w\d_]*',
+        single_quoted=r"('([^'\\]|(\\.))*')",
+        double_quoted=r'("([^"\\]|(\\.))*")'))
+_parenthesis_symbol_pattern = re.compile(
+    r'\A(@__f2py_PARENTHESIS_(\w+)_\d+@)\Z')
+_ternary_pattern = re.compile(r'\A([^?]+)[?]([^:]+)[:](.+)\Z')
+_fortran_relational_pattern = re.compile(
+    r'\A(.+)\s*[.](eq|ne|lt|le|gt|ge)[.]\s*(.+)\Z', re.I)
+_c_relational_pattern = re.compile(
+    r'\A(.+)\s*([=][=]|[!][=]|[<][=]|[<]|[>][=]|[>])\s*(.+)\Z')
+_keyword_argument_pattern = re.compile(r'\A(\w[\w\d_]*)\s*[=](.*)\Z')
+# signs that follow a multiplication or division operator are unary
+_terms_split_pattern = re.compile(
+    r'((?<![\d.][edED])(?<![*/])(?<![*/]\s)[+-])')
+_factors_split_pattern = re.compile(r'(?<=[@\w\d_])\s*([*]|/)')
+_int_literal_pattern = re.compile(r'\A({digit_string})({kind}|)\Z'.format(
+    digit_string=r'\d+',
+    kind=r'_(\d+|\w[\w\d_]*)'))
+_real_literal_pattern = re.compile(
+    r'\A({significant}({exponent}|)|\d+{exponent})({kind}|)\Z'.format(
+        significant=r'[.]\d+|\d+[.]\d*',
+        exponent=r'[edED][+-]?\d+',
+        kind=r'_(\d+|\w[\w\d_]*)'))
+_apply_pattern = re.compile(
+    r'\A(.+)\s*(@__f2py_PARENTHESIS_(ROUND|SQUARE)_\d+@)\Z')
+_name_pattern = re.compile(r'\A\w[\w\d_]*\Z')
+
+
 def eliminate_quotes(s):
     """Replace quoted substrings of input string.
 
@@ -1179,11 +1371,7 @@ def eliminate_quotes(s):
         d[k] = value
         return k
 
-    new_s = re.sub(r'({kind}_|)({single_quoted}|{double_quoted})'.format(
-        kind=r'\w[\w\d_]*',
-        single_quoted=r"('([^'\\]|(\\.))*')",
-        double_quoted=r'("([^"\\]|(\\.))*")'),
-        repl, s)
+    new_s = _quotes_pattern.sub(repl, s)
 
     assert '"' not in new_s
     assert "'" not in new_s
@@ -1230,6 +1418,8 @@ def replace_parenthesis(s):
 
     i = mn_i
     j = s.find(right, i)
+    if j == -1:
+        raise ValueError(f'Mismatch of {left+right} parenthesis in {s!r}')
 
     while s.count(left, i + 1, j) != s.count(right, i + 1, j):
         j = s.find(right, j + 1)
@@ -1261,14 +1451,31 @@ def unreplace_parenthesis(s, d):
     return s
 
 
-def fromstring(s, language=Language.C):
+def fromstring(s, language=Language.C, simplify=True):
     """Create an expression from a string.
 
     This is a "lazy" parser, that is, only arithmetic operations are
     resolved, non-arithmetic operations are treated as symbols.
+
+    With simplify=False, arithmetic operations are not normalized but
+    kept as ArithOp applications in the order of the source, e.g.
+    ``7/2*2`` becomes ``MUL(DIV(7, 2), 2)``.  Such trees can be
+    evaluated with the Fortran semantics of integer division, and
+    text that is treated as a symbol is not warned about.
+
+    The results are cached, see cache_info and clear_caches. Parsing
+    that issues a warning is not cached.
     """
-    r = _FromStringWorker(language=language).parse(s)
+    key = (s, language, simplify)
+    r = _fromstring_cache.get(key)
+    if r is not None:
+        return r
+    nwarnings = _ewarn_count
+    r = _FromStringWorker(language=language, simplify=simplify).parse(s)
     if isinstance(r, Expr):
+        r = intern(r)
+        if nwarnings == _ewarn_count:
+            r = _fromstring_cache.setdefault(key, r)
         return r
     raise ValueError(f'failed to parse `{s}` to Expr instance: got `{r}`')
 
@@ -1294,10 +1501,26 @@ class _Pair:
 
 class _FromStringWorker:
 
-    def __init__(self, language=Language.C):
+    def __init__(self, language=Language.C, simplify=True):
         self.original = None
         self.quotes_map = None
         self.language = language
+        self.simplify = simplify
+
+    def arith(self, op, left, right):
+        """Return the result of the arithmetic operation op."""
+        if not self.simplify:
+            return as_apply(op, left, right)
+        if op is ArithOp.ADD:
+            return left + right
+        if op is ArithOp.SUB:
+            return left - right
+        if op is ArithOp.MUL:
+            return left * right
+        if op is ArithOp.DIV:
+            return left / right
+        assert op is ArithOp.POW, op
+        return left ** right
 
     def finalize_string(self, s):
         return insert_quotes(s, self.quotes_map)
@@ -1345,7 +1568,7 @@ class _FromStringWorker:
                 f'parsing comma-separated list (context={context}): {r}')
 
         # ternary operation
-        m = re.match(r'\A([^?]+)[?]([^:]+)[:](.+)\Z', r)
+        m = _ternary_pattern.match(r)
         if m:
             assert context == 'expr', context
             oper, expr1, expr2 = restore(m.groups())
@@ -1356,11 +1579,9 @@ class _FromStringWorker:
 
         # relational expression
         if self.language is Language.Fortran:
-            m = re.match(
-                r'\A(.+)\s*[.](eq|ne|lt|le|gt|ge)[.]\s*(.+)\Z', r, re.I)
+            m = _fortran_relational_pattern.match(r)
         else:
-            m = re.match(
-                r'\A(.+)\s*([=][=]|[!][=]|[<][=]|[<]|[>][=]|[>])\s*(.+)\Z', r)
+            m = _c_relational_pattern.match(r)
         if m:
             left, rop, right = m.groups()
             if self.language is Language.Fortran:
@@ -1370,24 +1591,32 @@ class _FromStringWorker:
             return Expr(Op.RELATIONAL, (rop, left, right))
 
         # keyword argument
-        m = re.match(r'\A(\w[\w\d_]*)\s*[=](.*)\Z', r)
+        m = _keyword_argument_pattern.match(r)
         if m:
             keyname, value = m.groups()
             value = restore(value)
             return _Pair(keyname, self.process(value))
 
         # addition/subtraction operations
-        operands = re.split(r'((?<!\d[edED])[+-])', r)
+        operands = _terms_split_pattern.split(r)
         if len(operands) > 1:
             result = self.process(restore(operands[0] or '0'))
+            sign = '+'
             for op, operand in zip(operands[1::2], operands[2::2]):
-                operand = self.process(restore(operand))
                 op = op.strip()
+                if sign == '-':
+                    op = '+' if op == '-' else '-'
+                if not operand.strip():
+                    # unary sign, e.g. `x + -1`
+                    sign = op
+                    continue
+                sign = '+'
+                operand = self.process(restore(operand))
                 if op == '+':
-                    result += operand
+                    result = self.arith(ArithOp.ADD, result, operand)
                 else:
                     assert op == '-'
-                    result -= operand
+                    result = self.arith(ArithOp.SUB, result, operand)
             return result
 
         # string concatenate operation
@@ -1397,9 +1626,9 @@ class _FromStringWorker:
                         tuple(self.process(operands)))
 
         # multiplication/division operations
-        operands = re.split(r'(?<=[@\w\d_])\s*([*]|/)',
-                            (r if self.language is Language.C
-                             else r.replace('**', '@__f2py_DOUBLE_STAR@')))
+        operands = _factors_split_pattern.split(
+            r if self.language is Language.C
+            else r.replace('**', '@__f2py_DOUBLE_STAR@'))
         if len(operands) > 1:
             operands = restore(operands)
             if self.language is not Language.C:
@@ -1411,10 +1640,10 @@ class _FromStringWorker:
                 operand = self.process(operand)
                 op = op.strip()
                 if op == '*':
-                    result *= operand
+                    result = self.arith(ArithOp.MUL, result, operand)
                 else:
                     assert op == '/'
-                    result /= operand
+                    result = self.arith(ArithOp.DIV, result, operand)
             return result
 
         # referencing/dereferencing
@@ -1429,13 +1658,11 @@ class _FromStringWorker:
             result = self.process(operands[0])
             for operand in operands[1:]:
                 operand = self.process(operand)
-                result = operand ** result
+                result = self.arith(ArithOp.POW, operand, result)
             return result
 
         # int-literal-constant
-        m = re.match(r'\A({digit_string})({kind}|)\Z'.format(
-            digit_string=r'\d+',
-            kind=r'_(\d+|\w[\w\d_]*)'), r)
+        m = _int_literal_pattern.match(r)
         if m:
             value, _, kind = m.groups()
             if kind and kind.isdigit():
@@ -1443,11 +1670,7 @@ class _FromStringWorker:
             return as_integer(int(value), kind or 4)
 
         # real-literal-constant
-        m = re.match(r'\A({significant}({exponent}|)|\d+{exponent})({kind}|)\Z'
-                     .format(
-                         significant=r'[.]\d+|\d+[.]\d*',
-                         exponent=r'[edED][+-]?\d+',
-                         kind=r'_(\d+|\w[\w\d_]*)'), r)
+        m = _real_literal_pattern.match(r)
         if m:
             value, _, _, kind = m.groups()
             if kind and kind.isdigit():
@@ -1478,8 +1701,7 @@ class _FromStringWorker:
                 return as_array(items)
 
         # function call/indexing
-        m = re.match(r'\A(.+)\s*(@__f2py_PARENTHESIS_(ROUND|SQUARE)_\d+@)\Z',
-                     r)
+        m = _apply_pattern.match(r)
         if m:
             target, args, paren = m.groups()
             target = self.process(restore(target))
@@ -1499,12 +1721,13 @@ class _FromStringWorker:
                 return target[args]
 
         # Fortran standard conforming identifier
-        m = re.match(r'\A\w[\w\d_]*\Z', r)
+        m = _name_pattern.match(r)
         if m:
             return as_symbol(r)
 
         # fall-back to symbol
         r = self.finalize_string(restore(r))
-        ewarn(
-            f'fromstring: treating {r!r} as symbol (original={self.original})')
+        if self.simplify:
+            ewarn(f'fromstring: treating {r!r} as symbol'
+                  f' (original={self.original})')
         return as_symbol(r)
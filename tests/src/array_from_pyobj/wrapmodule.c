@@ -39,11 +39,16 @@ static PyObject *f2py_rout_wrap_call(PyObject *capi_self,
   int intent = 0;
   PyArrayObject *capi_arr_tmp = NULL;
   PyObject *arr_capi = Py_None;
+  static F2PyCopyStats capi_arr_copystats = {"wrap.call","obj"};
+  static F2PyCallStats capi_callstats = {"wrap.call"};
+  F2PyCallClock capi_clock = {0};
   int i;
 
   if (!PyArg_ParseTuple(capi_args,"iOiO|:wrap.call",\
                         &type_num,&dims_capi,&intent,&arr_capi))
     return NULL;
+  if (f2py_call_timing)
+    F2PyCallClock_Start(&capi_clock);
   rank = PySequence_Length(dims_capi);
   dims = malloc(rank*sizeof(npy_intp));
   for (i=0;i<rank;++i) {
@@ -58,13 +63,17 @@ static PyObject *f2py_rout_wrap_call(PyObject *capi_self,
         goto fail;
     }
   }
-  capi_arr_tmp = array_from_pyobj(type_num,dims,rank,intent|F2PY_INTENT_OUT,arr_capi);
+  capi_arr_tmp = array_from_pyobj_stats(type_num,dims,rank,intent|F2PY_INTENT_OUT,arr_capi,&capi_arr_copystats);
   if (capi_arr_tmp == NULL) {
     free(dims);
     return NULL;
   }
+  if (capi_clock.start)
+    F2PyCallClock_Lap(&capi_clock,F2PY_CALL_CONVERT);
   capi_buildvalue = Py_BuildValue("N",capi_arr_tmp);
   free(dims);
+  if (capi_clock.start)
+    F2PyCallClock_Stop(&capi_clock,F2PY_CALL_BUILD,&capi_callstats);
   return capi_buildvalue;
 
 fail:
@@ -119,6 +128,40 @@ static PyObject *f2py_rout_wrap_attrs(PyObject *capi_self,
                        PyArray_ITEMSIZE(arr));
 }
 
+/******************************** module data ********************************/
+/* The variables of a Fortran 90 module, with the allocatable array a
+   handled in C as the f2py_<module>_getdims_<name> routines of
+   f90mod_rules.py do in Fortran. */
+static int vars_i = 0;
+static double vars_x[3] = {0.0, 0.0, 0.0};
+static double *vars_a = NULL;
+static npy_intp vars_a_size = 0;
+
+static void vars_getdims_a(int *r, npy_intp *s, f2py_set_data_func set_data,
+                           int *flag) {
+  npy_intp allocated;
+  if (vars_a != NULL && s[0] >= 0 && s[0] != vars_a_size) {
+    free(vars_a);
+    vars_a = NULL;
+  }
+  if (vars_a == NULL && s[0] >= 1) {
+    vars_a = calloc(s[0], sizeof(double));
+    vars_a_size = s[0];
+  }
+  if (vars_a != NULL)
+    s[0] = vars_a_size;
+  *flag = 1;
+  allocated = (vars_a != NULL);
+  (*set_data)((char *)vars_a, &allocated);
+}
+
+static FortranDataDef f2py_vars_def[] = {
+  {"i",0,{{-1}},NPY_INT,(char *)&vars_i},
+  {"x",1,{{3}},NPY_DOUBLE,(char *)vars_x},
+  {"a",1,{{-1}},NPY_DOUBLE,NULL,vars_getdims_a},
+  {NULL}
+};
+
 static PyMethodDef f2py_module_methods[] = {
 
   {"call",f2py_rout_wrap_call,METH_VARARGS,doc_f2py_rout_wrap_call},
@@ -152,6 +195,11 @@ PyMODINIT_FUNC PyInit_test_array_from_pyobj_ext(void) {
   PyDict_SetItemString(d, "__doc__", s);
   wrap_error = PyErr_NewException ("wrap.error", NULL, NULL);
   Py_DECREF(s);
+  F2PyCopyAudit_AddFunctions(m);
+  F2PyCallTiming_AddFunctions(m);
+  s = PyFortranObject_New(f2py_vars_def, NULL);
+  PyDict_SetItemString(d, "vars", s);
+  Py_XDECREF(s);
 
 #define ADDCONST(NAME, CONST)              \
     s = PyLong_FromLong(CONST);             \
@@ -202,7 +250,10 @@ PyMODINIT_FUNC PyInit_test_array_from_pyobj_ext(void) {
   ADDCONST("ENSUREARRAY", NPY_ARRAY_ENSUREARRAY);
   ADDCONST("ALIGNED", NPY_ARRAY_ALIGNED);
   ADDCONST("WRITEABLE", NPY_ARRAY_WRITEABLE);
+#ifdef NPY_ARRAY_UPDATEIFCOPY
+  /* removed in numpy 1.23 */
   ADDCONST("UPDATEIFCOPY", NPY_ARRAY_UPDATEIFCOPY);
+#endif
   ADDCONST("WRITEBACKIFCOPY", NPY_ARRAY_WRITEBACKIFCOPY);
 
   ADDCONST("BEHAVED", NPY_ARRAY_BEHAVED);
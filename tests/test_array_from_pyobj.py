@@ -625,3 +625,172 @@ class TestSharedMemory:
             assert obj.flags["FORTRAN"]  # obj attributes changed inplace!
             assert not obj.flags["CONTIGUOUS"]
             assert obj.dtype.type is self.type.type  # obj changed inplace!
+
+
+def data_pointer(obj):
+    return np.asarray(obj).__array_interface__["data"][0]
+
+
+class TestBufferInput:
+    num23seq = [[1, 2, 3], [4, 5, 6]]
+
+    @pytest.fixture(autouse=True, scope="class",
+                    params=["BYTE", "INT", "DOUBLE", "CFLOAT"])
+    def setup_type(self, request):
+        request.cls.type = Type(request.param)
+
+    def call(self, intent, obj):
+        return wrap.call(self.type.type_num, (2, 3), intent.flags, obj)
+
+    @pytest.mark.parametrize("order", ["C", "F"])
+    def test_in_nocopy(self, order):
+        obj = np.array(self.num23seq, dtype=self.type.dtype, order=order)
+        obj.setflags(write=False)
+        view = memoryview(obj)
+        arr = self.call((order == "C" and intent.in_.c) or intent.in_, view)
+        assert data_pointer(arr) == data_pointer(obj)
+        assert (arr == obj).all()
+
+    @pytest.mark.parametrize("name", ["inout", "inplace"])
+    def test_inout_nocopy(self, name):
+        obj = np.array(self.num23seq, dtype=self.type.dtype, order="F")
+        arr = self.call(getattr(intent, name), memoryview(obj))
+        assert data_pointer(arr) == data_pointer(obj)
+        arr[1, 2] = 54
+        assert obj[1, 2] == 54
+
+    def test_inout_failure(self):
+        obj = np.array(self.num23seq, dtype=self.type.dtype, order="F")
+        obj.setflags(write=False)
+        for view in [memoryview(obj),
+                     memoryview(np.array(self.num23seq,
+                                         dtype=self.type.dtype)),
+                     memoryview(np.array(self.num23seq, dtype=np.float16,
+                                         order="F"))]:
+            with pytest.raises(TypeError, match="failed to initialize "
+                               "intent\\(inout\\|inplace\\|cache\\) array"):
+                self.call(intent.in_.inout, view)
+
+    def test_in_copy(self):
+        obj = np.array(self.num23seq, dtype=self.type.dtype, order="F")
+        for view, flags in [(memoryview(obj), intent.in_.copy),
+                            (memoryview(obj), intent.in_.c),
+                            (memoryview(obj.astype(np.float16)), intent.in_)]:
+            arr = self.call(flags, view)
+            assert data_pointer(arr) != data_pointer(obj)
+            assert (arr == obj).all()
+
+
+def test_in_buffers():
+    import array
+    import mmap
+
+    ubyte, double = Type("UBYTE"), Type("DOUBLE")
+    for typ, obj in [(ubyte, bytearray(b"abcdef")),
+                     (double, array.array("d", [1, 2, 3, 4, 5, 6])),
+                     (ubyte, mmap.mmap(-1, 6))]:
+        arr = wrap.call(typ.type_num, (6,), intent.in_.inout.flags, obj)
+        assert data_pointer(arr) == data_pointer(obj)
+        arr[0] = 7
+        assert np.asarray(obj)[0] == 7
+
+
+class TestCopyAudit:
+    @pytest.fixture(autouse=True)
+    def audit(self):
+        wrap.__f2py_copy_stats__(reset=True)
+        assert not wrap.__f2py_copy_audit__(True)
+        yield
+        assert wrap.__f2py_copy_audit__(False)
+
+    def call(self, typ, intent, obj):
+        return wrap.call(Type(typ).type_num, (2, 3), intent.flags, obj)
+
+    def test_stats(self):
+        obj = np.zeros((2, 3), dtype=np.float64, order="F")
+        self.call("DOUBLE", intent.in_, obj)
+        self.call("DOUBLE", intent.in_, memoryview(obj))
+        self.call("DOUBLE", intent.in_.inout, obj)
+        assert wrap.__f2py_copy_stats__() == {"wrap.call": {"obj": {
+            "calls": 3, "copies": 0, "bytes": 0, "reasons": {}}}}
+        self.call("DOUBLE", intent.in_, obj.astype(np.float32))
+        self.call("DOUBLE", intent.in_, np.zeros((2, 6), order="F")[:, ::2])
+        self.call("DOUBLE", intent.in_.c, obj)
+        self.call("DOUBLE", intent.in_.copy, obj)
+        self.call("DOUBLE", intent.in_, [[1, 2, 3], [4, 5, 6]])
+        self.call("FLOAT", intent.in_, memoryview(obj))
+        stats = wrap.__f2py_copy_stats__(reset=True)
+        assert stats == {"wrap.call": {"obj": {
+            "calls": 9, "copies": 6, "bytes": 5 * 48 + 24,
+            "reasons": {"dtype": 1, "non-contiguous": 1, "order": 1,
+                        "intent(copy)": 1, "non-array": 2}}}}
+        assert wrap.__f2py_copy_stats__() == {}
+
+    def test_inplace(self):
+        obj = np.zeros((2, 3), dtype=np.int8, order="F")
+        self.call("DOUBLE", intent.inplace, obj)
+        assert wrap.__f2py_copy_stats__()["wrap.call"]["obj"]["reasons"] == \
+            {"dtype": 1}
+
+    def test_disabled(self):
+        wrap.__f2py_copy_audit__(False)
+        self.call("DOUBLE", intent.in_, [[1, 2, 3], [4, 5, 6]])
+        assert wrap.__f2py_copy_stats__() == {}
+        wrap.__f2py_copy_audit__(True)
+
+
+def test_call_timing():
+    wrap.__f2py_call_stats__(reset=True)
+    assert not wrap.__f2py_call_timing__(True)
+    try:
+        for i in range(10):
+            wrap.call(Type("DOUBLE").type_num, (3,), intent.in_.flags,
+                      [1, 2, 3])
+    finally:
+        assert wrap.__f2py_call_timing__(False)
+    wrap.call(Type("DOUBLE").type_num, (3,), intent.in_.flags, [1, 2, 3])
+    stats = wrap.__f2py_call_stats__(reset=True)["wrap.call"]
+    assert stats["calls"] == 10
+    assert sum(stats["histogram"].values()) == 10
+    assert stats["convert"] > 0 and stats["build"] > 0
+    assert stats["fortran"] == stats["callback"] == 0
+    assert wrap.__f2py_call_stats__() == {}
+
+
+class TestModuleData:
+    def test_allocatable_view(self):
+        vars = wrap.vars
+        vars.a = None
+        assert vars.a is None
+        vars.a = [1, 2, 3]
+        a = vars.a
+        assert vars.a is a
+        # Setting the values keeps the allocation and the view
+        vars.a = [4, 5, 6]
+        assert vars.a is a
+        assert a.tolist() == [4, 5, 6]
+        # ... but not a new shape
+        vars.a = [1, 2]
+        assert vars.a is not a
+        assert vars.a.tolist() == [1, 2]
+        # A changed view is not reused
+        vars.a.flags.writeable = False
+        assert vars.a.flags.writeable
+        vars.a = None
+        assert vars.a is None
+
+    def test_bulk_access(self):
+        vars = wrap.vars
+        vars._setvars(i=3, x=[1, 2, 3], a=[7])
+        i, x, a = vars._getvars("i", "x", "a")
+        assert i == 3
+        assert x.tolist() == [1, 2, 3]
+        assert a.tolist() == [7]
+        assert vars.i == 3
+        with pytest.raises(AttributeError, match="y is not a Fortran"):
+            vars._setvars(y=1)
+        with pytest.raises(AttributeError):
+            vars._getvars("y")
+        with pytest.raises(TypeError):
+            vars._setvars(3)
+        vars.a = None
@@ -0,0 +1,121 @@
+import hashlib
+import os
+import random
+
+import pytest
+
+from f2py_skel.stds import auxfuncs
+from f2py_skel.stds.auxfuncs import dictappend, flatlist, replace, writefile
+
+
+def replace_stepwise(str, d, defaultsep=''):
+    # The substitution loop that replace is equivalent to
+    for k in 2 * list(d.keys()):
+        if k == 'separatorsfor':
+            continue
+        if 'separatorsfor' in d and k in d['separatorsfor']:
+            sep = d['separatorsfor'][k]
+        else:
+            sep = defaultsep
+        if isinstance(d[k], list):
+            str = str.replace('#%s#' % (k), sep.join(flatlist(d[k])))
+        else:
+            str = str.replace('#%s#' % (k), d[k])
+    return str
+
+
+class TestReplace:
+    @pytest.mark.parametrize(
+        "template, d, expected",
+        [
+            ("#name#(#args#)", {"name": "f", "args": "x"}, "f(x)"),
+            ("#a# #b#", {"a": "1"}, "1 #b#"),
+            ("#rank*[-1]#", {"rank*[-1]": "-1, -1"}, "-1, -1"),
+            # placeholders in values are replaced by the keys that follow
+            ("#a#", {"a": "#b#", "b": "1"}, "1"),
+            # ... and by the keys that precede in the second round
+            ("#b#", {"a": "1", "b": "#a#"}, "1"),
+            ("#b#", {"c": "x", "a": "#c#", "b": "#a#"}, "#c#"),
+            ("#a#", {"a": "#a#."}, "#a#.."),
+            ("#l#", {"l": ["a", ["b"]], "separatorsfor": {"l": ","}}, "a,b"),
+            # overlapping placeholders
+            ("#a#b#", {"a": "1", "b": "2"}, "1b#"),
+            ("#x#b#", {"a": "1", "b": "2"}, "#x2"),
+            ("##a#", {"a": "b", "b": "2"}, "#b"),
+            ("##a#c#", {"a": "b", "bc": "2"}, "2"),
+        ],
+    )
+    def test_replace(self, template, d, expected):
+        assert replace(template, d) == expected
+        assert replace_stepwise(template, d) == expected
+
+    def test_lists(self):
+        assert replace(["#a#", "#a#-"], {"a": "1"}) == ["1", "1-"]
+        assert replace("#a#", [{"a": "1"}, {"a": "2"}]) == ["1", "2"]
+        assert replace("#l#", {"l": ["a", "b"]}, "\n") == "a\nb"
+
+    def test_stepwise(self):
+        rng = random.Random(0)
+        tokens = ["#", "a", "b", "ab", " ", ",", "*", "\n", "#a#", "#b#",
+                  "#ab#", "#c#", "#,#", "#a.b#"]
+        names = ["a", "b", "ab", "c", ",", "*", "a.b", "b,"]
+
+        def text(n):
+            return "".join(rng.choice(tokens)
+                           for _ in range(rng.randint(0, n)))
+
+        for _ in range(20000):
+            d = {}
+            for k in rng.sample(names, rng.randint(0, 5)):
+                d[k] = [text(3), [text(3)]] if rng.random() < 0.2 else text(4)
+            if rng.random() < 0.2:
+                d["separatorsfor"] = {"a": rng.choice([",", "#"])}
+            template = text(8)
+            assert replace(template, d, "#") == \
+                replace_stepwise(template, d, "#"), (template, d)
+
+    def test_template_cache(self):
+        auxfuncs._templates.clear()
+        replace("#a#", {"a": "1"})
+        assert "#a#" in auxfuncs._templates
+        replace("#a#" * auxfuncs._templatemaxlength, {"a": ""})
+        assert len(auxfuncs._templates) == 1
+
+
+class TestDictappend:
+    def test_dictappend(self):
+        rd = dictappend({}, {"a": "1", "b": ["x"], "_c": "skipped",
+                             "d": {"e": "2"}})
+        assert rd == {"a": "1", "b": ["x"], "d": {"e": "2"}}
+        rd = dictappend(rd, [{"a": "2", "b": ["y", ["z"]]},
+                             {"a": ["3"], "b": "w", "d": {"e": "3"}}])
+        assert rd == {"a": ["1", "2", "3"], "b": ["x", "y", ["z"], "w"],
+                      "d": {"e": ["2", "3"]}}
+        assert flatlist(rd["b"]) == ["x", "y", "z", "w"]
+
+    def test_lists_not_shared(self):
+        ar = {"a": ["1"]}
+        rd = dictappend({}, ar)
+        dictappend(rd, {"a": "2"})
+        dictappend(rd, {"a": ["3"]})
+        assert ar == {"a": ["1"]}
+        assert rd == {"a": ["1", "2", "3"]}
+
+    def test_flatlist(self):
+        assert flatlist("a") == ["a"]
+        assert flatlist([]) == []
+        assert flatlist(["a", ["b", ["c"], []], "d"]) == ["a", "b", "c", "d"]
+
+
+class TestWritefile:
+    def test_writefile(self, tmp_path):
+        fn = tmp_path / "a.c"
+        digest = writefile(str(fn), "int a;\n")
+        assert digest == hashlib.sha256(b"int a;\n").hexdigest()
+        assert fn.read_text() == "int a;\n"
+        os.utime(fn, (0, 0))
+        assert writefile(str(fn), "int a;\n") == digest
+        assert fn.stat().st_mtime == 0
+        writefile(str(fn), "int b;\n")
+        assert fn.read_text() == "int b;\n"
+        assert fn.stat().st_mtime != 0
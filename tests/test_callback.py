@@ -1,3 +1,4 @@
+import ctypes
 import math
 import textwrap
 import sys
@@ -5,9 +6,10 @@ import pytest
 import threading
 import traceback
 import time
+import weakref
 
 import numpy as np
-from numpy.testing import IS_PYPY
+from numpy.testing import IS_PYPY, assert_array_equal
 from . import util
 
 
@@ -199,6 +201,315 @@ class TestF77CallbackPythonTLS(TestF77Callback):
     options = ["-DF2PY_USE_PYTHON_TLS"]
 
 
+class TestThreadLocalCallback:
+    # The module is built with the wrappers of f2py_skel, with the active
+    # call-backs in the thread-local storage of the compiler or, with
+    # F2PY_USE_PYTHON_TLS, in the thread state dictionary of Python
+    signature = textwrap.dedent("""\
+        python module {name}__user__routines
+            interface
+                function fun() result (r)
+                    integer :: r
+                end function fun
+            end interface
+        end python module {name}__user__routines
+        python module {name}
+            interface
+                function t(fun) result (a)
+                    intent(c) t
+                    use {name}__user__routines
+                    external fun
+                    integer :: a
+                end function t
+            end interface
+        end python module {name}
+        """)
+    source = "int t(int (*fun)(void)) { return fun(); }\n"
+
+    def build(self, tls):
+        if not util.has_c_compiler():
+            pytest.skip("No C compiler available")
+        name = f"_test_callback_tls_{tls}"
+        return util.build_skel_module(
+            self.signature.format(name=name), self.source, name,
+            define_macros=[("F2PY_USE_PYTHON_TLS", None)]
+            if tls == "python" else [])
+
+    @pytest.mark.skipif(IS_PYPY, reason="Uses the C API of CPython")
+    @pytest.mark.parametrize("tls", ["native", "python"])
+    def test_storage(self, tls):
+        module = self.build(tls)
+        get_dict = ctypes.pythonapi.PyThreadState_GetDict
+        get_dict.restype = ctypes.c_void_p  # a borrowed reference
+        key = f"__f2py_cb_cb_fun_in_{module.__name__}__user__routines"
+        found = []
+
+        def fun():
+            local_dict = ctypes.cast(get_dict(), ctypes.py_object).value
+            found.append(key in local_dict)
+            return 1
+
+        assert module.t(fun) == 1
+        assert found == [tls == "python"]
+
+    @pytest.mark.parametrize("tls", ["native", "python"])
+    def test_nested_threads(self, tls):
+        # Each thread resolves its own nested callbacks
+        module = self.build(tls)
+        errors = []
+
+        def nested(depth, tag):
+            def cb():
+                if depth == 0:
+                    return tag
+                r = module.t(nested(depth - 1, tag))
+                assert r == tag + depth - 1
+                return r + 1
+
+            return cb
+
+        def runner(tag):
+            try:
+                for j in range(20):
+                    r = module.t(nested(5, tag))
+                    assert r == tag + 5
+            except Exception:
+                errors.append(traceback.format_exc())
+
+        threads = [
+            threading.Thread(target=runner, args=(100 * n, ))
+            for n in range(8)
+        ]
+
+        for t in threads:
+            t.start()
+
+        for t in threads:
+            t.join()
+
+        errors = "\n\n".join(errors)
+        if errors:
+            raise AssertionError(errors)
+
+
+class TestCallTiming:
+    # The module is built with the runtime of f2py_skel
+    signature = textwrap.dedent("""\
+        python module {name}__user__routines
+            interface
+                subroutine fs()
+                end subroutine fs
+            end interface
+        end python module {name}__user__routines
+        python module {name}
+            interface
+                subroutine sleep_ms(ms)
+                    intent(c) sleep_ms
+                    threadsafe
+                    integer, intent(c) :: ms
+                end subroutine sleep_ms
+                subroutine calls(fs, ncalls)
+                    intent(c) calls
+                    use {name}__user__routines
+                    external fs
+                    integer, intent(c) :: ncalls
+                end subroutine calls
+            end interface
+        end python module {name}
+        """)
+    source = textwrap.dedent("""\
+        #ifdef _WIN32
+        #include <windows.h>
+        void sleep_ms(int ms) { Sleep(ms); }
+        #else
+        #define _POSIX_C_SOURCE 199309L
+        #include <time.h>
+        void sleep_ms(int ms) {
+            struct timespec ts = {ms / 1000, (ms % 1000) * 1000000L};
+            nanosleep(&ts, NULL);
+        }
+        #endif
+        void calls(void (*fs)(void), int ncalls) {
+            int i;
+            for (i = 0; i < ncalls; i++)
+                fs();
+        }
+        """)
+
+    @pytest.mark.parametrize("tls", ["native", "python"])
+    def test_threads(self, tls):
+        # The call-backs of a thread are not counted in the routine that
+        # another thread runs without the GIL
+        if not util.has_c_compiler():
+            pytest.skip("No C compiler available")
+        name = f"_test_call_timing_{tls}"
+        module = util.build_skel_module(
+            self.signature.format(name=name), self.source, name,
+            define_macros=[("F2PY_USE_PYTHON_TLS", None)]
+            if tls == "python" else [])
+        started = threading.Event()
+
+        def cb():
+            started.set()
+            time.sleep(5e-3)
+
+        thread = threading.Thread(target=module.calls, args=(cb, 40))
+        module.__f2py_call_stats__(reset=True)
+        assert not module.__f2py_call_timing__(True)
+        try:
+            thread.start()
+            started.wait()
+            module.sleep_ms(100)
+            thread.join()
+        finally:
+            assert module.__f2py_call_timing__(False)
+        stats = module.__f2py_call_stats__(reset=True)
+        assert stats[f"{name}.sleep_ms"]["callback"] == 0
+        assert stats[f"{name}.sleep_ms"]["fortran"] >= 0.09
+        assert stats[f"{name}.calls"]["callback"] >= 0.19
+
+
+class TestCallbackArray:
+    # The array arguments of the call-backs are views of the Fortran arrays,
+    # reused between the calls of the call-back
+    signature = textwrap.dedent("""\
+        python module _test_callback_array__user__routines
+            interface
+                function fun(x) result (r)
+                    double precision dimension(4) :: x
+                    double precision :: r
+                end function fun
+                subroutine sub(x, s, p)
+                    double precision dimension(4) :: x
+                    double precision, intent(out) :: s, p
+                end subroutine sub
+                subroutine nop(x)
+                    double precision dimension(4) :: x
+                end subroutine nop
+            end interface
+        end python module _test_callback_array__user__routines
+        python module _test_callback_array
+            interface
+                function calls(fun, x, ncalls) result (r)
+                    intent(c) calls
+                    use _test_callback_array__user__routines
+                    external fun
+                    double precision dimension(4), intent(c) :: x
+                    integer, intent(c) :: ncalls
+                    double precision :: r
+                end function calls
+                function sums(sub, x, ncalls) result (r)
+                    intent(c) sums
+                    use _test_callback_array__user__routines
+                    external sub
+                    double precision dimension(4), intent(c) :: x
+                    integer, intent(c) :: ncalls
+                    double precision :: r
+                end function sums
+                subroutine nops(nop, x, ncalls)
+                    intent(c) nops
+                    use _test_callback_array__user__routines
+                    external nop
+                    double precision dimension(4), intent(c) :: x
+                    integer, intent(c) :: ncalls
+                end subroutine nops
+            end interface
+        end python module _test_callback_array
+        """)
+    source = textwrap.dedent("""\
+        double calls(double (*fun)(double *), double *x, int ncalls) {
+            int i;
+            double r = 0;
+            for (i = 0; i < ncalls; i++) {
+                x[0] = i;
+                r += fun(x);
+            }
+            return r;
+        }
+        double sums(void (*sub)(double *, double *, double *), double *x,
+                    int ncalls) {
+            int i;
+            double s, p, r = 0;
+            for (i = 0; i < ncalls; i++) {
+                x[0] = i;
+                sub(x, &s, &p);
+                r += s * p;
+            }
+            return r;
+        }
+        void nops(void (*nop)(double *), double *x, int ncalls) {
+            int i;
+            for (i = 0; i < ncalls; i++) {
+                x[0] = i;
+                nop(x);
+            }
+        }
+        """)
+
+    @pytest.fixture(scope="class")
+    def module(self):
+        if not util.has_c_compiler():
+            pytest.skip("No C compiler available")
+        return util.build_skel_module(self.signature, self.source,
+                                      "_test_callback_array")
+
+    def test_reuse(self, module):
+        views = []
+
+        def fun(x):
+            if views:
+                assert views[-1]() is x
+            views.append(weakref.ref(x))
+            return x[0]
+
+        assert module.calls(fun, np.ones(4), 3) == 3
+
+    def test_kept(self, module):
+        # A view that the call-back function keeps is not reused
+        kept = []
+
+        def fun(x):
+            assert all(x is not y for y in kept)
+            kept.append(x)
+            return x[0]
+
+        x = np.ones(4)
+        assert module.calls(fun, x, 3) == 3
+        assert len(kept) == 3
+        for y in kept:
+            assert y.shape == (4, )
+            y[1] = 5
+        assert x[1] == 5
+
+    @pytest.mark.parametrize("change", ["reshape", "writeable"])
+    def test_changed(self, module, change):
+        # A view that the call-back function changes is not reused
+        def fun(x):
+            assert x.shape == (4, ) and x.flags.writeable
+            assert_array_equal(x[1:], [1, 1, 1])
+            r = x[0]
+            if change == "reshape":
+                x.shape = (2, 2)
+            else:
+                x.flags.writeable = False
+            return r
+
+        assert module.calls(fun, np.ones(4), 3) == 3
+
+    def test_returns(self, module):
+        def sub(x):
+            return x[0], 2
+
+        def nop(x):
+            x[1] = x[0]
+
+        x = np.ones(4)
+        assert module.sums(sub, x, 3) == 6
+        module.nops(nop, x, 3)
+        assert_array_equal(x, [2, 2, 1, 1])
+        assert module.calls(lambda x: (x[0], ), x, 3) == 3
+
+
 class TestF90Callback(util.F2PyTest):
     sources = [util.getpath("tests", "src", "callback", "gh17797.f90")]
 
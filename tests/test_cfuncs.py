@@ -0,0 +1,152 @@
+import copy
+import random
+
+import pytest
+
+from f2py_skel.codegen import cfuncs
+
+KINDS = ['includes', 'typedefs', 'cppmacros', 'cfuncs']
+
+
+def append_needs_recursive(need, flag=1):
+    # The recursive search that append_needs is equivalent to
+    if isinstance(need, list):
+        for n in need:
+            append_needs_recursive(n, flag)
+        return
+    for n in KINDS:
+        if need in getattr(cfuncs, n):
+            break
+    else:
+        return
+    if need in cfuncs.outneeds[n]:
+        return
+    tmp = {}
+    for nn in cfuncs.needs.get(need, []):
+        t = append_needs_recursive(nn, 0)
+        if isinstance(t, dict):
+            for nnn in t.keys():
+                if nnn not in tmp:
+                    tmp[nnn] = t[nnn]
+                elif flag:
+                    tmp[nnn] = tmp[nnn] + t[nnn]
+                else:
+                    tmp[nnn] = t[nnn] + tmp[nnn]
+    if not flag:
+        tmp.setdefault(n, []).append(need)
+        return tmp
+    for nn in tmp.keys():
+        for nnn in tmp[nn]:
+            if nnn not in cfuncs.outneeds[nn]:
+                cfuncs.outneeds[nn] = [nnn] + cfuncs.outneeds[nn]
+    cfuncs.outneeds[n].append(need)
+
+
+def get_needs_rotating():
+    # The sort by rotation that get_needs is equivalent to
+    res = {}
+    for n in cfuncs.outneeds.keys():
+        queue = copy.copy(cfuncs.outneeds[n])
+        out = []
+        while queue:
+            if queue[0] in cfuncs.needs and \
+                    any(k in cfuncs.needs[queue[0]] for k in queue[1:]):
+                queue = queue[1:] + queue[:1]
+            else:
+                out.append(queue.pop(0))
+        res[n] = out or [n]
+    return res
+
+
+@pytest.fixture
+def graph(monkeypatch):
+    # Empty outneeds and a private needs graph
+    monkeypatch.setattr(cfuncs, 'outneeds', {n: [] for n in KINDS})
+    monkeypatch.setattr(cfuncs, 'needs', cfuncs.NeedsGraph())
+    for n in KINDS:
+        monkeypatch.setattr(cfuncs, n, dict(getattr(cfuncs, n)))
+    monkeypatch.setattr(cfuncs, '_needtables',
+                        tuple((n, getattr(cfuncs, n)) for n in KINDS))
+    cfuncs._closures.clear()
+
+    def add(need, kind='cfuncs', deps=()):
+        getattr(cfuncs, kind)[need] = '/* %s */' % (need)
+        if deps:
+            cfuncs.needs[need] = list(deps)
+
+    yield add
+    cfuncs._closures.clear()
+
+
+@pytest.fixture
+def messages(monkeypatch):
+    messages = []
+    monkeypatch.setattr(cfuncs, 'errmess', messages.append)
+    return messages
+
+
+class TestNeeds:
+    def test_order(self, graph):
+        graph('h', 'includes')
+        graph('t', 'typedefs', ['h'])
+        graph('M', 'cppmacros', ['t'])
+        graph('f', 'cfuncs', ['M', 'g'])
+        graph('g', 'cfuncs', ['t'])
+        cfuncs.append_needs(['f', 'M'])
+        assert cfuncs.outneeds == {'includes': ['h'], 'typedefs': ['t'],
+                                   'cppmacros': ['M'], 'cfuncs': ['g', 'f']}
+        assert cfuncs.get_needs() == {'includes': ['h'], 'typedefs': ['t'],
+                                      'cppmacros': ['M'],
+                                      'cfuncs': ['g', 'f']}
+        assert cfuncs.outneeds == {n: [] for n in KINDS}
+        assert cfuncs.get_needs()['cfuncs'] == ['cfuncs']
+
+    def test_random(self, graph):
+        rng = random.Random(0)
+        for _ in range(200):
+            cfuncs.needs.clear()
+            names = ['n%d' % i for i in range(rng.randint(1, 30))]
+            for i, name in enumerate(names):
+                # Dependencies on earlier needs only, the graph is a DAG
+                graph(name, rng.choice(KINDS),
+                      rng.sample(names[:i], min(i, rng.randint(0, 4))))
+            cfuncs._closures.clear()
+            appended = [rng.choice(names) for _ in range(rng.randint(1, 10))]
+            for need in appended:
+                append_needs_recursive(need)
+            expected = copy.deepcopy(cfuncs.outneeds)
+            sorted_expected = get_needs_rotating()
+            for n in KINDS:
+                cfuncs.outneeds[n] = []
+            for need in appended:
+                cfuncs.append_needs(need)
+            assert cfuncs.outneeds == expected, appended
+            assert cfuncs.get_needs() == sorted_expected, appended
+
+    def test_graph_changes(self, graph):
+        graph('a')
+        graph('b')
+        cfuncs.append_needs('a')
+        assert cfuncs.get_needs()['cfuncs'] == ['a']
+        cfuncs.needs['a'] = ['b']
+        cfuncs.append_needs('a')
+        assert cfuncs.get_needs()['cfuncs'] == ['b', 'a']
+
+    def test_unknown(self, graph, messages):
+        graph('a', deps=['x'])
+        cfuncs.append_needs(['a', 'y'])
+        assert cfuncs.outneeds['cfuncs'] == ['a']
+        assert messages == ["append_needs: unknown need 'x'\n",
+                            "append_needs: unknown need 'y'\n"]
+
+    def test_cycles(self, graph, messages):
+        graph('a', deps=['b'])
+        graph('b', deps=['c'])
+        graph('c', deps=['a'])
+        cfuncs.append_needs('a')
+        assert messages == ["append_needs: circular dependence of needs "
+                            "a -> b -> c -> a, skipping a.\n"]
+        assert cfuncs.outneeds['cfuncs'] == ['b', 'c', 'a']
+        assert cfuncs.get_needs()['cfuncs'] == ['b', 'c', 'a']
+        assert messages[1:] == ["get_needs: circular dependence of needs "
+                                "b -> c -> a -> b, skipping.\n"]
@@ -3,6 +3,7 @@ import numpy as np
 from f2py_skel.frontend.crackfortran import markinnerspaces
 from . import util
 from f2py_skel.frontend import crackfortran
+import sys
 import textwrap
 
 
@@ -200,3 +201,449 @@ class TestModuleDeclaration:
         mod = crackfortran.crackfortran([str(fpath)])
         assert len(mod) == 1
         assert mod[0]["vars"]["abar"]["="] == "bar('abar')"
+
+
+class TestSignatureCache:
+    def test_cached_blocks(self, tmp_path):
+        fpath = tmp_path / "foo.f90"
+        incpath = tmp_path / "foo.inc"
+        incpath.write_text("integer, parameter :: n = 3\n")
+        fpath.write_text(textwrap.dedent("""\
+            module foo
+              include 'foo.inc'
+            contains
+              subroutine bar(x)
+                real, intent(inout) :: x(n)
+                x = x + 1
+              end subroutine bar
+            end module foo
+            """))
+        cachedir = tmp_path / "cache"
+        pyf = crackfortran.crack2fortran(
+            crackfortran.crackfortran([str(fpath)]))
+        mod = crackfortran.crackfortran([str(fpath)], cachedir=str(cachedir))
+        assert crackfortran.crack2fortran(mod) == pyf
+        assert len(list(cachedir.glob("*/*.pickle"))) == 2
+        mod = crackfortran.crackfortran([str(fpath)], cachedir=str(cachedir))
+        assert crackfortran.crack2fortran(mod) == pyf
+        assert len(list(cachedir.glob("*/*.pickle"))) == 2
+
+        # changing an included file invalidates the cached entries
+        incpath.write_text("integer, parameter :: n = 4\n")
+        mod = crackfortran.crackfortran([str(fpath)], cachedir=str(cachedir))
+        assert mod[0]["vars"]["n"]["="] == "4"
+        assert len(list(cachedir.glob("*/*.pickle"))) == 4
+
+    @pytest.mark.skipif(sys.platform == "win32",
+                        reason="No POSIX ownership and permissions")
+    def test_shared_dir(self, tmp_path, monkeypatch):
+        messages = []
+        monkeypatch.setattr(crackfortran, "errmess", messages.append)
+        fpath = tmp_path / "foo.f90"
+        fpath.write_text("subroutine foo(a)\nreal a\nend\n")
+        cachedir = tmp_path / "cache"
+        cachedir.mkdir()
+        cachedir.chmod(0o777)
+        mod = crackfortran.crackfortran([str(fpath)], cachedir=str(cachedir))
+        assert mod[0]["name"] == "foo"
+        assert messages[0].startswith(
+            "Ignoring the signature cache directory")
+        assert list(cachedir.iterdir()) == []
+
+    def test_f77module_splicing(self, tmp_path):
+        fpaths = []
+        for name in ["sub1", "sub2"]:
+            fpath = tmp_path / f"{name}.f"
+            fpath.write_text(f"      subroutine {name}(a)\n"
+                             "      real a\n"
+                             "      end\n")
+            fpaths.append(str(fpath))
+        crackfortran.f77modulename = "foo"
+        try:
+            pyf = crackfortran.crack2fortran(
+                crackfortran.crackfortran(fpaths))
+            mod = crackfortran.crackfortran(fpaths,
+                                            cachedir=str(tmp_path / "cache"))
+        finally:
+            crackfortran.f77modulename = ""
+        assert crackfortran.crack2fortran(mod) == pyf
+        assert len(mod) == 1
+        assert [b["name"] for b in mod[0]["body"][0]["body"]] == ["sub1",
+                                                                  "sub2"]
+
+
+class TestParallelRead:
+    def test_jobs(self):
+        fpaths = [
+            str(util.getpath("tests", "src", "crackfortran", name))
+            for name in ["gh15035.f", "gh17859.f", "gh2848.f90",
+                         "privatemod.f90"]
+        ]
+        pyf = crackfortran.crack2fortran(crackfortran.crackfortran(fpaths))
+        mod = crackfortran.crackfortran(fpaths, jobs=2)
+        assert crackfortran.crack2fortran(mod) == pyf
+
+
+class TestFortranParser:
+    def test_parse_string(self):
+        parser = crackfortran.FortranParser(dolowercase=0,
+                                            f77modulename="bar")
+        mod = parser.parse_string(textwrap.dedent("""\
+            module Foo
+              integer :: N
+            end module Foo
+            """))
+        assert mod[0]["name"] == "bar"
+        assert mod[0]["body"][0]["body"][0]["name"] == "Foo"
+        assert "N" in parser.f90modulevars["Foo"]
+        assert "Foo" not in crackfortran.f90modulevars
+
+    def test_module_state(self, monkeypatch):
+        # crackfortran passes the module flags to its parser and sets the
+        # module state from it
+        fpath = util.getpath("tests", "src", "crackfortran", "privatemod.f90")
+        flags = []
+        init = crackfortran.FortranParser.__init__
+
+        def spy(parser, **kw):
+            flags.append(kw)
+            init(parser, **kw)
+
+        monkeypatch.setattr(crackfortran.FortranParser, "__init__", spy)
+        monkeypatch.setattr(crackfortran, "tabchar", "\t")
+        monkeypatch.setattr(crackfortran, "f77modulename", "bar")
+        crackfortran.crackfortran([str(fpath)])
+        assert flags[0]["tabchar"] == "\t"
+        assert set(flags[0]) >= {"strictf77", "sourcecodeform",
+                                 "pyffilename"}
+        assert "a" in crackfortran.f90modulevars["foo"]
+
+    def test_concurrent(self):
+        import concurrent.futures
+
+        fpaths = [
+            str(util.getpath("tests", "src", "crackfortran", name))
+            for name in ["gh15035.f", "gh17859.f", "gh2848.f90",
+                         "privatemod.f90", "publicmod.f90"]
+        ]
+        expected = [
+            crackfortran.crack2fortran(crackfortran.crackfortran([fpath]))
+            for fpath in fpaths
+        ]
+
+        def parse(fpath):
+            parser = crackfortran.FortranParser(verbose=0)
+            return crackfortran.crack2fortran(parser.parse_files([fpath]))
+
+        with concurrent.futures.ThreadPoolExecutor(4) as pool:
+            result = list(pool.map(parse, fpaths * 4))
+        assert result == expected * 4
+
+
+class TestReadFortranStatements:
+    def test_continuation(self, tmp_path):
+        fixed = tmp_path / "foo.f"
+        fixed.write_text("      SUBROUTINE FOO(A,\n"
+                         "     &  B)\n"
+                         "c     comment\n"
+                         "      END\n")
+        free = tmp_path / "bar.f90"
+        free.write_text("subroutine bar(a, & ! comment\n"
+                        "\n"
+                        "    & b)\n"
+                        "end subroutine bar\n")
+        crackfortran.dolowercase = 1
+        stmts = [(line, origline) for line, origline, _, _ in
+                 crackfortran.readfortranstatements([str(fixed), str(free)])]
+        assert stmts == [
+            ("      subroutine foo(a,  b)", "      SUBROUTINE FOO(A,  B)"),
+            ("      end", "      END"),
+            ("subroutine bar(a,  b) ", "subroutine bar(a,  b) "),
+            ("end subroutine bar ", "end subroutine bar "),
+        ]
+
+
+class TestCrackPatterns:
+    lines = [
+        "      subroutine foo(a, b)",
+        "      real*8 function f(x)",
+        "pure recursive integer(kind=4) function g(x) result(y)",
+        "      end",
+        "end subroutine foo",
+        "      endif",
+        "100   end do",
+        "module mod",
+        "end module mod",
+        "python module m",
+        "abstract interface",
+        "type, public :: t",
+        "type(t) :: x",
+        "      double precision a(n), b(n)",
+        "      integer n",
+        "      common /blk/ a, b",
+        "      dimension x(10)",
+        "intent(in) x",
+        "depend(n) a",
+        "      call foo(a)",
+        "      a(1) = a(2) + 1",
+        "      if (n > 0) call foo(a)",
+        "use iso_c_binding, only: c_int",
+        "contains",
+        "      entry bar(a)",
+        "callstatement (*f2py_func)(a)",
+        "      parameter (n = 10)",
+        "  x = data",
+        "'''code'''",
+        "",
+    ]
+
+    @pytest.mark.parametrize("beginpattern", ["beginpattern77",
+                                              "beginpattern90"])
+    def test_dispatch(self, beginpattern, monkeypatch):
+        # the keyword index must select the same pattern as the full
+        # ordered scan
+        monkeypatch.setattr(crackfortran, "beginpattern",
+                            getattr(crackfortran, beginpattern))
+
+        def first(candidates):
+            for pat, keywords in candidates:
+                if keywords and not any(k in line.lower() for k in keywords):
+                    continue
+                if pat[0].match(line):
+                    return pat[1]
+
+        for line in self.lines:
+            expected = first((pat, None) for pat in crackfortran._crackorder())
+            assert first(crackfortran._crackpatterns(line)) == expected, line
+
+
+class TestSkipExecutable:
+    source = textwrap.dedent("""\
+        subroutine foo(a, n, fun)
+          integer n, k
+          real(8) a(n)
+          a(1) = 0
+          do k = 2, n
+             a(k) = a(k - 1) + k
+          end do
+          if (n > 1) then
+             call fun(n)
+          end if
+          !f2py intent(in,out) a
+          return
+          entry bar(a, n)
+          a(n) = 1
+        end subroutine foo
+        """)
+
+    def test_executable_part(self):
+        outputs = []
+        for skipexecutable in (0, 1):
+            parser = crackfortran.FortranParser(
+                verbose=0, skipexecutable=skipexecutable)
+            blocks = parser.parse_string(self.source, "foo.f90")
+            outputs.append(crackfortran.crack2fortran(blocks))
+        assert outputs[0] == outputs[1]
+        pyf = outputs[1]
+        assert "intent(in,out) :: a" in pyf
+        assert "subroutine fun(n)" in pyf
+        assert "entry bar(a,n)" in pyf
+
+    @pytest.mark.parametrize("filename,comment", [("bar.f", "Cf2py"),
+                                                   ("bar.f90", "!f2py")])
+    def test_late_directives(self, filename, comment):
+        # Typed directives after the first executable statement
+        source = textwrap.dedent(f"""\
+                  subroutine bar(a, b, m, n)
+                  integer n, m, k
+                  real a(n), b
+                  b = 0
+                  do k = 1, n
+                     b = b + a(k)
+                  end do
+            {comment} real intent(out) :: b
+            {comment} integer optional, intent(in) :: m = 1
+            {comment} intent(hide) n
+                  end
+            """)
+        outputs = []
+        for skipexecutable in (0, 1):
+            parser = crackfortran.FortranParser(
+                verbose=0, skipexecutable=skipexecutable)
+            blocks = parser.parse_string(source, filename)
+            outputs.append(crackfortran.crack2fortran(blocks))
+        assert outputs[0] == outputs[1]
+        pyf = outputs[1]
+        assert "real intent(out) :: b" in pyf
+        assert "integer, optional,intent(in) :: m=1" in pyf
+        assert "integer, optional,intent(hide),check(" in pyf
+
+    def test_statement_function(self, monkeypatch):
+        monkeypatch.setattr(crackfortran, "beginpattern",
+                            crackfortran.beginpattern90)
+        monkeypatch.setattr(crackfortran, "skipexecutable", 1)
+        crackfortran.crackline("", -1)
+        for line, executable in [("subroutine foo(a, n)", -1),
+                                 ("integer n", -1),
+                                 ("real a(n)", -1),
+                                 ("f(x) = 2 * x", -1),
+                                 ("a(1) = f(1.0)", 1),
+                                 ("real = 1.0", 1),
+                                 ("end", -1)]:
+            crackfortran.crackline(line)
+            assert crackfortran.executablepart == executable, line
+        crackfortran.crackline("", 1)
+
+
+class TestGetLinCoef:
+    @pytest.mark.parametrize("expr, expected", [
+        ("2*x + 1", (2, 1, "x")),
+        ("X*2 - 3", (2, -3, "x")),
+        ("x*-2 + 1", (-2, 1, "x")),
+        ("(x + 9)/3", (1 / 3, 3, "x")),
+        ("7/2", (0, 3, None)),
+        ("-7/2", (0, -3, None)),
+        ("0*x + 2.5", (0, 2.5, "x")),
+        ("x*0 + m", (1, 0, "m")),
+        ("n", (1, 0, "n")),
+        ("x*x", (None, None, None)),
+        ("x*m + 1", (None, None, None)),
+        ("x + m", (None, None, None)),
+        ("max(1, x) + 1", (None, None, None)),
+        ("x/0", (None, None, None)),
+        ("(x - 0.5)*(x - 1.5)*(x - 1)*x + 2*x + 3", (None, None, None)),
+    ])
+    def test_getlincoef(self, expr, expected):
+        assert crackfortran.getlincoef(expr, {"x", "m"}) == expected
+
+    def test_repeated_calls(self):
+        # typical dimension specifications, the second calls are cached
+        exprs = ["n", "2*n+1", "n-1", "lda", "(n+1)/2", "k*(k+1)/2", "m*n",
+                 "3", "max(1,n)", "2*n*(n+1)"]
+        xset = {"n", "m", "k", "lda"}
+        expected = [(1, 0, "n"), (2, 1, "n"), (1, -1, "n"), (1, 0, "lda"),
+                    (0.5, 0.5, "n"), (None, None, None), (None, None, None),
+                    (0, 3, None), (None, None, None), (None, None, None)]
+        for i in range(2):
+            assert [crackfortran.getlincoef(e, xset) for e in exprs] == \
+                expected
+
+
+class TestEvalConstant:
+    params = {"n": 7, "dp": 8, "s": "abc", "t": True}
+
+    @pytest.mark.parametrize("expr, expected", [
+        ("7/2*2", 6),
+        ("-7/2", -3),
+        ("2**-1", 0),
+        ("2**10", 1024),
+        ("1.5d0", 1.5),
+        ("1.e-3", 0.001),
+        ("3._dp / 2", 1.5),
+        ("(1.0, 2.0)", 1 + 2j),
+        ("cmplx(1, 2, dp)", 1 + 2j),
+        (".TRUE.", True),
+        (".not. t .or. n > 3 .and. n /= 8", True),
+        ("(n .eq. 7) .neqv. t", False),
+        ("'it''s' // s", "it'sabc"),
+        ("len(s) + len('ab')", 5),
+        ("kind(1.0)", 4),
+        ("kind(1.0d0)", 8),
+        ("kind(1_dp)", 8),
+        ("selected_int_kind(9)", 4),
+        ("selected_real_kind(p=15)", 8),
+        ("huge(1)", 2**31 - 1),
+        ("huge(1_8)", 2**63 - 1),
+        ("mod(-7, 3) + max(1, n)", 6),
+    ])
+    def test_evalconstant(self, expr, expected):
+        value = crackfortran._evalconstant(expr, self.params)
+        assert value == expected
+        assert type(value) is type(expected)
+
+    @pytest.mark.parametrize("expr", [
+        "m + 1", "foo(1)", "1/0", ".not. 1", "2**100000000",
+        "__import__('os')", "(lambda: 1)()", "*", "len(", "'it's'",
+        "(1.0, 2.0) < 1"])
+    def test_not_constant(self, expr):
+        with pytest.raises(crackfortran._NotConstant):
+            crackfortran._evalconstant(expr, self.params)
+
+    def test_parameters(self):
+        parser = crackfortran.FortranParser(verbose=0, f77modulename="m")
+        mod = parser.parse_string(textwrap.dedent("""\
+            module consts
+              integer, parameter :: dp = selected_real_kind(15)
+              integer, parameter :: n = 10/4
+              real(dp), parameter :: half = 0.5_dp
+              integer, parameter :: kd = kind(half)
+              logical, parameter :: flag = .true. .and. n > 1
+              character(len=*), parameter :: name = 'it''s'
+              integer, parameter :: lname = len(name)
+            end module consts
+            subroutine foo(a)
+              use consts
+              real(kd) :: a(n, lname)
+            end subroutine foo
+            subroutine bar(b)
+              integer k
+              parameter (k = 7/2, t = .false.)
+              real b(k)
+            end subroutine bar
+            """))
+        consts, foo, bar = mod[0]["body"][0]["body"]
+        vars = consts["vars"]
+        assert vars["dp"]["="] == "8"
+        assert vars["n"]["="] == "2"
+        assert vars["kd"]["="] == "8"
+        assert vars["flag"]["="] == ".true."
+        assert foo["vars"]["a"]["kindselector"]["kind"] == "8"
+        assert foo["vars"]["a"]["dimension"] == ["2", "4"]
+        assert bar["vars"]["b"]["dimension"] == ["3"]
+
+    def test_many_parameters(self):
+        # a module with many parameters is used by many routines, see
+        # the Parameters benchmark
+        n = 100
+        source = ["module many",
+                  "  integer, parameter :: dp = selected_real_kind(15)"]
+        for i in range(n):
+            source.append(f"  integer, parameter :: n{i} = {i} * 2 + 1")
+            source.append(f"  real(dp), parameter :: r{i} = {i}.5_dp / 2")
+        source.append("end module many")
+        for i in range(20):
+            source.extend([f"subroutine s{i}(a)", "  use many",
+                           f"  real(dp) :: a(n{i})", f"end subroutine s{i}"])
+        parser = crackfortran.FortranParser(verbose=0, f77modulename="m")
+        mod = parser.parse_string("\n".join(source) + "\n")
+        blocks = mod[0]["body"][0]["body"]
+        assert blocks[0]["vars"][f"r{n - 1}"]["="] == repr((n - 0.5) / 2)
+        assert blocks[-1]["vars"]["a"]["dimension"] == ["39"]
+        assert blocks[-1]["vars"]["a"]["kindselector"]["kind"] == "8"
+
+
+class TestElemental:
+    def test_prefix(self):
+        parser = crackfortran.FortranParser(verbose=0, f77modulename="m")
+        mod = parser.parse_string(textwrap.dedent("""\
+            elemental complex(8) function f(z)
+              complex(8), intent(in) :: z
+              f = conjg(z)
+            end function f
+            pure elemental subroutine s(x, y)
+              real, intent(in) :: x
+              real, intent(out) :: y
+              y = x
+            end subroutine s
+            real function g(x)
+              real x
+              g = x
+            end function g
+            """))
+        f, s, g = mod[0]["body"][0]["body"]
+        assert [crackfortran.iselemental(b) for b in (f, s, g)] == \
+            [True, True, False]
+        assert f["vars"]["f"]["typespec"] == "complex"
+        assert f["vars"]["f"]["kindselector"] == {"kind": "8"}
+        assert "elemental subroutine s(x,y)" in crackfortran.crack2fortran(
+            mod)
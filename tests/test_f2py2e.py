@@ -0,0 +1,765 @@
+import concurrent.futures
+import functools
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import sys
+import textwrap
+import threading
+import time
+
+import numpy as np
+import pytest
+from numpy.testing import assert_array_equal
+
+from f2py_skel.frontend import crackfortran, f2py2e
+from . import util
+
+PYF = textwrap.dedent("""\
+    python module m1__user__routines
+        interface
+            function cb(x)
+                real*8 :: x
+                real*8 :: cb
+            end function cb
+        end interface
+    end python module m1__user__routines
+    python module m1
+        interface
+            subroutine s1(cb, a, n)
+                use m1__user__routines
+                external cb
+                real*8 dimension(n), intent(inout) :: a
+                integer, intent(hide), depend(a) :: n = len(a)
+            end subroutine s1
+        end interface
+    end python module m1
+    python module m2
+        interface
+            subroutine s2(c, k)
+                character*(*) :: c
+                integer dimension(2,3), intent(out) :: k
+            end subroutine s2
+        end interface
+    end python module m2
+    python module m3
+        interface
+            function h(l)
+                logical :: l
+                integer*8 :: h
+            end function h
+        end interface
+    end python module m3
+    """)
+
+# Sources with PARAMETER statements and a kind expression
+PARAMS = {
+    "c.f": ("      subroutine c1(a)\n"
+            "      integer m\n"
+            "      parameter (m=3)\n"
+            "      real a(m)\n"
+            "      end\n"),
+    "b.f90": textwrap.dedent("""\
+        module bm
+          integer, parameter :: rk = selected_real_kind(12)
+          integer, parameter :: n = 4
+        contains
+          subroutine b1(x)
+            real(kind=rk), intent(inout) :: x(n)
+            x = 1
+          end subroutine b1
+        end module bm
+        """)}
+
+
+def use_spawn(monkeypatch):
+    # The workers do not inherit the state of the parent
+    context = multiprocessing.get_context("spawn")
+    monkeypatch.setattr(concurrent.futures, "ProcessPoolExecutor",
+                        functools.partial(
+                            concurrent.futures.ProcessPoolExecutor,
+                            mp_context=context))
+
+
+class TestParallelBuild:
+    def build(self, path, monkeypatch, capsys, jobs,
+              sources={"multi.pyf": PYF}, args=()):
+        path.mkdir()
+        monkeypatch.chdir(path)
+        for name, text in sources.items():
+            (path / name).write_text(text)
+        ret = f2py2e.run_main(["--no-sig-cache", *args, *sources], jobs=jobs)
+        files = {p.name: p.read_text() for p in path.iterdir()}
+        return ret, files, capsys.readouterr().out
+
+    def test_jobs(self, tmp_path, monkeypatch, capsys):
+        serial = self.build(tmp_path / "serial", monkeypatch, capsys, 1)
+        parallel = self.build(tmp_path / "parallel", monkeypatch, capsys, 3)
+        assert sorted(serial[0]) == ["m1", "m2", "m3"]
+        assert "m1module.c" in serial[1]
+        assert parallel == serial
+
+    def test_parallel_first(self, tmp_path, monkeypatch, capsys):
+        # The parallel build leaves no needs to the next build
+        m3 = PYF[PYF.index("python module m3"):]
+        path = tmp_path / "m3"
+        path.mkdir()
+        monkeypatch.chdir(path)
+        (path / "m3.pyf").write_text(m3)
+        f2py2e.run_main(["--no-sig-cache", "m3.pyf"])
+        expected = (path / "m3module.c").read_text()
+        self.build(tmp_path / "parallel", monkeypatch, capsys, 3)
+        monkeypatch.chdir(path)
+        f2py2e.run_main(["--no-sig-cache", "m3.pyf"])
+        assert (path / "m3module.c").read_text() == expected
+
+    def test_spawn(self, tmp_path, monkeypatch, capsys):
+        # e.g. the call-back functions of m1 are built by the parent
+        use_spawn(monkeypatch)
+        serial = self.build(tmp_path / "serial", monkeypatch, capsys, 1)
+        parallel = self.build(tmp_path / "parallel", monkeypatch, capsys, 2)
+        assert "cb_cb_in_m1__user__routines" in parallel[1]["m1module.c"]
+        assert parallel == serial
+
+    def test_spawn_parameters(self, tmp_path, monkeypatch, capsys):
+        use_spawn(monkeypatch)
+        parallel = self.build(tmp_path / "parallel", monkeypatch, capsys, 2,
+                              PARAMS, ["-m", "pm"])
+        serial = self.build(tmp_path / "serial", monkeypatch, capsys, 1,
+                            PARAMS, ["-m", "pm"])
+        assert "pmmodule.c" in serial[1]
+        assert parallel[:2] == serial[:2]
+        # The messages name the directory of the build
+        assert parallel[2].replace("parallel", "serial") == serial[2]
+
+    def test_spawn_crackfortran(self, tmp_path, monkeypatch):
+        # The workers read the files without reset_global_f2py_vars
+        use_spawn(monkeypatch)
+        monkeypatch.chdir(tmp_path)
+        for name, text in PARAMS.items():
+            (tmp_path / name).write_text(text)
+        parallel = crackfortran.crack2fortran(
+            crackfortran.crackfortran(list(PARAMS), jobs=2))
+        serial = crackfortran.crack2fortran(
+            crackfortran.crackfortran(list(PARAMS)))
+        assert "real dimension(3) :: a" in serial
+        assert "integer, parameter,optional :: rk=8" in serial
+        assert parallel == serial
+
+
+class TestDeterministicBuild:
+    def test_manifest(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / "multi.pyf").write_text(PYF)
+        ret = f2py2e.run_main(["--no-sig-cache", "multi.pyf"])
+        assert ret["m1"]["manifest"] == ["./m1-f2pymanifest.json"]
+        manifest = json.loads((tmp_path / "m1-f2pymanifest.json").read_text())
+        assert manifest["module"] == "m1"
+        assert manifest["inputs"] == [{
+            "path": "multi.pyf",
+            "sha256": hashlib.sha256(PYF.encode()).hexdigest()}]
+        outputs = [o["path"] for o in manifest["outputs"]]
+        assert outputs == ["./m1module.c"]
+        for o in manifest["outputs"]:
+            with open(o["path"], "rb") as f:
+                assert hashlib.sha256(f.read()).hexdigest() == o["sha256"]
+
+        # Unchanged files are not written again
+        files = sorted(p for p in os.listdir(tmp_path) if p != "multi.pyf")
+        for p in files:
+            os.utime(tmp_path / p, (0, 0))
+        f2py2e.run_main(["--no-sig-cache", "multi.pyf"])
+        assert [os.stat(tmp_path / p).st_mtime for p in files] == \
+            [0] * len(files)
+
+
+class TestShards:
+    def test_shards(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / "multi.pyf").write_text(PYF)
+        ret = f2py2e.run_main(["--no-sig-cache", "--shards", "2", "multi.pyf"])
+        shardsrc = ret["m1"]["shardsrc"]
+        assert shardsrc == ["./m1module_shard1.c", "./m1module_shard2.c"]
+        csrc = ret["m1"]["csrc"]
+        assert csrc[:3] == ["./m1module.c"] + shardsrc
+        assert csrc[3].endswith("fortranobject.c")
+        core, shard1, shard2 = [(tmp_path / fn).read_text()
+                                for fn in csrc[:3]]
+        assert ret["m1"]["manifest"] == ["./m1-f2pymanifest.json"]
+        # The wrapper is defined in a shard and declared in the core
+        assert core.count("PyObject *f2py_rout_m1_s1(") == 1
+        assert "extern F2PY_HIDDEN PyObject *f2py_rout_m1_s1(" in core
+        assert "F2PY_HIDDEN PyObject *f2py_rout_m1_s1(" in shard1 + shard2
+        assert "PyInit_m1" not in shard1 + shard2
+        assert "extern F2PY_HIDDEN PyObject *m1_module;" in shard1
+        # ... and the call-back function once, in the core
+        assert "F2PY_HIDDEN double cb_cb_in_m1__user__routines (" in core
+        assert "F2PY_HIDDEN double cb_cb_in_m1__user__routines (" in shard1
+        assert "extern F2PY_HIDDEN cb_cb_in_m1__user__routines_t " \
+            "*swap_active_cb_cb_in_m1__user__routines(" in shard1
+        assert "_active_cb_cb_in_m1__user__routines = NULL" not in shard1
+
+
+    source = textwrap.dedent("""\
+        module data_m
+          real(8) :: total = 0
+        contains
+          subroutine add(x)
+            real(8), intent(in) :: x
+            total = total + x
+          end subroutine add
+        end module data_m
+        subroutine apply(fun, x, y)
+          external fun
+          real(8) fun, x
+          real(8), intent(out) :: y
+          y = fun(x)
+        end subroutine apply
+        subroutine scale(a, x, n)
+          integer n
+          real(8) a, x(n)
+          intent(inout) x
+          x = a * x
+        end subroutine scale
+        function cube(x)
+          real(8) x, cube
+          cube = x**3
+        end function cube
+        subroutine count()
+          integer calls
+          common /blk/ calls
+          calls = calls + 1
+        end subroutine count
+        """)
+
+    def test_module(self):
+        if not util.has_c_compiler() or not util.has_f90_compiler():
+            pytest.skip("No C or Fortran 90 compiler available")
+        module = util.build_skel_module(self.source, None, "_test_shards",
+                                        ["--shards", "2"], suffix=".f90")
+        module.data_m.add(2.)
+        module.data_m.add(3.)
+        assert module.data_m.total == 5.
+        assert module.apply(lambda x: 2 * x, 3.) == 6.
+        x = np.arange(3.)
+        module.scale(2., x)
+        assert_array_equal(x, [0., 2., 4.])
+        assert module.cube(2.) == 8.
+        module.blk.calls = 0
+        module.count()
+        module.count()
+        assert module.blk.calls == 2
+
+
+class TestVectorcall:
+    def test_wrapper(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / "multi.pyf").write_text(PYF)
+        f2py2e.run_main(["--no-sig-cache", "multi.pyf"])
+        m1 = (tmp_path / "m1module.c").read_text()
+        assert "PyObject *const *capi_args," in m1
+        assert "PyArg_ParseTupleAndKeywords" not in m1
+        assert 'static F2PyArgParser capi_parser = {"OO|O!:m1.s1",' in m1
+        # The required arguments given by position are not parsed
+        assert ("    if (capi_kwnames == NULL && capi_nargs == 2) {\n"
+                "        cb_cb.capi = capi_args[0];\n"
+                "        a_capi = capi_args[1];\n"
+                "    } else if (!F2PyArg_ParseVectorcall(") in m1
+        m2 = (tmp_path / "m2module.c").read_text()
+        assert ("    if (capi_kwnames == NULL && capi_nargs == 1) {\n"
+                "        c_capi = capi_args[0];\n") in m2
+
+    def test_callback(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / "cb.f90").write_text(textwrap.dedent("""\
+            subroutine t(fun, a, n)
+                external fun
+                integer n
+                real(8) a(n)
+                call fun(a, n)
+            end subroutine t
+            """))
+        f2py2e.run_main(["--no-sig-cache", "-m", "cb", "cb.f90"])
+        cb = (tmp_path / "cbmodule.c").read_text()
+        assert "capi_return = PyObject_Vectorcall(cb->capi," in cb
+        # The return value is not wrapped in a tuple
+        callback = cb.split("PyObject_Vectorcall(")[1].split("capi_fail:")[0]
+        assert "Py_BuildValue" not in callback
+        # The view of the array of the previous call is reused
+        assert ("F2PyCallback_Array(CAPI_ARGLIST_GETITEM(capi_i),NPY_DOUBLE,"
+                "1,a_Dims,itemsize_,(char*)a,NPY_ARRAY_FARRAY);") in cb
+
+
+    signature = textwrap.dedent("""\
+        python module {name}__user__routines
+            interface
+                function fun(x) result (r)
+                    double precision :: x
+                    double precision :: r
+                end function fun
+            end interface
+        end python module {name}__user__routines
+        python module {name}
+            interface
+                function calc(fun, a, b, c) result (r)
+                    intent(c) calc
+                    use {name}__user__routines
+                    external fun
+                    double precision, intent(c) :: a
+                    double precision, optional, intent(c) :: b = 1
+                    integer, optional, intent(c) :: c = 2
+                    double precision :: r
+                end function calc
+            end interface
+        end python module {name}
+        """)
+    source = ("double calc(double (*fun)(double *), double a, double b, "
+              "int c) { return fun(&a) * b + c; }\n")
+
+    def test_module(self, tmp_path):
+        # The arguments are parsed as by PyArg_ParseTupleAndKeywords in the
+        # wrappers of the f2py of numpy
+        if not util.has_c_compiler():
+            pytest.skip("No C compiler available")
+        module = util.build_skel_module(
+            self.signature.format(name="_test_vectorcall"), self.source,
+            "_test_vectorcall")
+        (tmp_path / "_test_vectorcall_np.pyf").write_text(
+            self.signature.format(name="_test_vectorcall_np"))
+        (tmp_path / "routines.c").write_text(self.source)
+        expected = util.build_module(
+            [str(tmp_path / "_test_vectorcall_np.pyf"),
+             str(tmp_path / "routines.c")],
+            module_name="_test_vectorcall_np")
+
+        def fun(x):
+            return 2 * x
+
+        def call(f, *args, **kwargs):
+            try:
+                return f(*args, **kwargs)
+            except Exception as e:
+                return type(e), str(e).replace("_np.", ".")
+
+        calls = [
+            ((fun, 3.), {}),
+            ((fun, 3., 4., 5), {}),
+            ((), {"fun": fun, "a": 3., "c": 5}),
+            ((fun, ), {"a": 3., "b": 4.}),
+            ((fun, 3.), {"fun_extra_args": ()}),
+            ((fun, 3.), {"a": 4.}),
+            ((fun, 3., 4., 5, (), 6), {}),
+            ((), {"fun": fun, "a": 3., "b": 4., "c": 5,
+                  "fun_extra_args": (), "d": 6}),
+            ((fun, 3.), {"d": 6}),
+            ((fun, ), {}),
+            ((), {"a": 3.}),
+            ((fun, 3., 4., 5, [1]), {}),
+        ]
+        results = [call(module.calc, *args, **kwargs)
+                   for args, kwargs in calls]
+        assert results[:5] == [8., 29., 11., 26., 8.]
+        assert results == [call(expected.calc, *args, **kwargs)
+                           for args, kwargs in calls]
+        # Calls with a dictionary of keyword arguments, and by tp_call, that
+        # is, fortran_call
+        kwargs = {"fun": fun, "a": 3.}
+        assert module.calc(**kwargs) == 8.
+        assert module.calc.__call__(fun, 3., c=5) == 11.
+
+
+class TestCopyAudit:
+    def test_wrapper(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / "multi.pyf").write_text(PYF)
+        f2py2e.run_main(["--no-sig-cache", "multi.pyf"])
+        m1 = (tmp_path / "m1module.c").read_text()
+        assert ('static F2PyCopyStats capi_a_copystats = {"m1.s1","a"};'
+                in m1)
+        assert "array_from_pyobj_stats(NPY_DOUBLE,a_Dims,a_Rank," \
+            "capi_a_intent,a_capi,&capi_a_copystats);" in m1
+        assert "F2PyCopyAudit_AddFunctions(m)" in m1
+        # Hidden arrays are not copies of arguments
+        m2 = (tmp_path / "m2module.c").read_text()
+        assert "array_from_pyobj(NPY_INT,k_Dims" in m2
+        assert "capi_k_copystats" not in m2
+
+
+class TestCallTiming:
+    def test_wrapper(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / "multi.pyf").write_text(PYF)
+        f2py2e.run_main(["--no-sig-cache", "multi.pyf"])
+        m1 = (tmp_path / "m1module.c").read_text()
+        callback, wrapper = m1.split("static PyObject *f2py_rout_m1_s1(")
+        assert 'static F2PyCallStats capi_callstats = {"m1.s1"};' in wrapper
+        # The clock is started and stopped after each phase...
+        phases = [wrapper.index("F2PyCallClock_Start(&capi_clock)"),
+                  wrapper.index("/*end of frompyobj*/"),
+                  wrapper.index("F2PyCallClock_Lap(&capi_clock,"
+                                "F2PY_CALL_CONVERT)"),
+                  wrapper.index("(*f2py_func)(cb_cptr,a,&n);"),
+                  wrapper.index("F2PyCallClock_Lap(&capi_clock,"
+                                "F2PY_CALL_FORTRAN)"),
+                  wrapper.index("Py_BuildValue("),
+                  wrapper.index("F2PyCallClock_Stop(&capi_clock,"
+                                "F2PY_CALL_BUILD,&capi_callstats)")]
+        assert phases == sorted(phases)
+        # ... and the call-back accumulates its time
+        assert callback.count("F2PyCallClock_Callback(&capi_clock);") == 2
+        assert "F2PyCallTiming_AddFunctions(m)" in m1
+
+
+GILSRC = textwrap.dedent("""\
+    module pure_m
+      integer, parameter :: dp = kind(1d0)
+    contains
+      subroutine ps(x)
+        real(dp), intent(inout) :: x
+        x = x + 1
+      end subroutine ps
+    end module pure_m
+    module state_m
+      real :: total
+    contains
+      subroutine ss(x)
+        real x
+        total = total + x
+      end subroutine ss
+    end module state_m
+    subroutine f(x, n)
+      integer n
+      double precision x(n)
+      x = 2 * x
+    end subroutine f
+    function h(x)
+      real x, h
+      h = x
+    end function h
+    subroutine c(x)
+      real x, y
+      common /blk/ y
+      y = x
+    end subroutine c
+    subroutine u(x)
+      use state_m
+      real x
+      total = x
+    end subroutine u
+    subroutine cb(fun, x)
+      external fun
+      real x
+      call fun(x)
+    end subroutine cb
+    """)
+
+
+class TestReleaseGil:
+    @pytest.mark.parametrize("args, released", [
+        ([], []),
+        (["--release-gil=auto"], ["f", "h", "pure_m_ps"]),
+        (["--release-gil=auto", "--release-gil-shared=release"],
+         ["f", "h", "c", "u", "pure_m_ps", "state_m_ss"]),
+    ])
+    def test_release_gil(self, tmp_path, monkeypatch, args, released):
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / "gil.f90").write_text(GILSRC)
+        f2py2e.run_main(["--no-sig-cache", "-m", "gil", "gil.f90", *args])
+        gil = (tmp_path / "gilmodule.c").read_text()
+        wrappers = dict(re.findall(
+            r"static PyObject \*f2py_rout_gil_(\w+)\((.*?\n)}\n", gil, re.S))
+        assert len(wrappers) == 7
+        assert sorted(name for name, body in wrappers.items()
+                      if "Py_BEGIN_ALLOW_THREADS" in body) == sorted(released)
+
+
+    signature = textwrap.dedent("""\
+        python module _test_release_gil__user__routines
+            interface
+                subroutine fun()
+                end subroutine fun
+            end interface
+        end python module _test_release_gil__user__routines
+        python module _test_release_gil
+            interface
+                subroutine sleep_ms(ms)
+                    intent(c) sleep_ms
+                    integer, intent(c) :: ms
+                end subroutine sleep_ms
+                subroutine sleep_ms_cb(fun, ms)
+                    intent(c) sleep_ms_cb
+                    use _test_release_gil__user__routines
+                    external fun
+                    integer, intent(c) :: ms
+                end subroutine sleep_ms_cb
+                subroutine sleep_ms_common(ms)
+                    intent(c) sleep_ms_common
+                    integer, intent(c) :: ms
+                    integer :: calls
+                    common /blk/ calls
+                end subroutine sleep_ms_common
+            end interface
+        end python module _test_release_gil
+        """)
+    source = textwrap.dedent("""\
+        #ifdef _WIN32
+        #include <windows.h>
+        void sleep_ms(int ms) { Sleep(ms); }
+        #else
+        #define _POSIX_C_SOURCE 199309L
+        #include <time.h>
+        void sleep_ms(int ms) {
+            struct timespec ts = {ms / 1000, (ms % 1000) * 1000000L};
+            nanosleep(&ts, NULL);
+        }
+        #endif
+        void sleep_ms_cb(void (*fun)(void), int ms) { sleep_ms(ms); }
+        void sleep_ms_common(int ms) { sleep_ms(ms); }
+        """)
+
+    @pytest.mark.parametrize("name, released", [
+        ("sleep_ms", True), ("sleep_ms_cb", False),
+        ("sleep_ms_common", False)])
+    def test_threads(self, name, released):
+        # The main thread runs while another thread is in a routine that
+        # releases the GIL, and waits for the routines that keep it
+        if not util.has_c_compiler():
+            pytest.skip("No C compiler available")
+        module = util.build_skel_module(self.signature, self.source,
+                                        "_test_release_gil",
+                                        ["--release-gil=auto"])
+        args = {"sleep_ms": (200, ), "sleep_ms_cb": (lambda: None, 200),
+                "sleep_ms_common": (200, )}[name]
+        thread = threading.Thread(target=getattr(module, name), args=args)
+        ticks = [time.perf_counter()]
+        thread.start()
+        while thread.is_alive():
+            time.sleep(1e-3)
+            ticks.append(time.perf_counter())
+        thread.join()
+        assert ticks[-1] - ticks[0] >= 0.19
+        gap = max(b - a for a, b in zip(ticks, ticks[1:]))
+        if released:
+            assert gap < 0.1
+        else:
+            assert gap >= 0.15
+
+
+class TestBatch:
+    def test_wrapper(self, tmp_path, monkeypatch, capsys):
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / "gil.f90").write_text(GILSRC)
+        f2py2e.run_main(["--no-sig-cache", "-m", "gil", "gil.f90"])
+        assert "F2PyBatch_" not in (tmp_path / "gilmodule.c").read_text()
+        f2py2e.run_main(["--no-sig-cache", "-m", "gil", "gil.f90",
+                         "--batch"])
+        gil = (tmp_path / "gilmodule.c").read_text()
+        out = capsys.readouterr().out
+        assert 'Constructing batched wrapper "f.batch"' in out
+        assert 'No batched wrapper of "cb": call-back' in out
+        assert 'No batched wrapper of "h": no array argument' in out
+        wrapper = re.search(r"static PyObject \*f2py_batch_gil_f\((.*?\n)}\n",
+                            gil, re.S).group(1)
+        assert "F2PyBatch_FromPyObj(NPY_DOUBLE,x_Dims,x_Rank," \
+            "capi_x_intent,x_capi,capi_batch,&capi_x_batch);" in wrapper
+        loop = wrapper.split("for (capi_i = 0; capi_i < capi_batch; "
+                             "capi_i++) {")[1]
+        assert "double *x = (double *)(capi_x_data + capi_i * capi_x_step);" \
+            in loop
+        assert "(*f2py_func)(x,&n);" in loop
+        assert "Py_BEGIN_ALLOW_THREADS" in wrapper
+        assert "F2PyBatch_AddAttr(m,&def)" in gil
+        assert "f2py_batch_gil_cb" not in gil
+
+    # The arrays of affine are C-ordered, those of faffine F-ordered
+    signature = textwrap.dedent("""\
+        python module _test_batch__user__routines
+            interface
+                function fun(x) result (r)
+                    double precision :: x
+                    double precision :: r
+                end function fun
+            end interface
+        end python module _test_batch__user__routines
+        python module _test_batch
+            interface
+                subroutine affine(a, x, m, k, y)
+                    intent(c) affine
+                    double precision, intent(c) :: a
+                    double precision dimension(m,k), intent(c,in) :: x
+                    integer, intent(c,hide), depend(x) :: m = shape(x,0)
+                    integer, intent(c,hide), depend(x) :: k = shape(x,1)
+                    double precision dimension(m,k), intent(c,out), &
+                        depend(m,k) :: y
+                end subroutine affine
+                subroutine faffine(a, x, m, k, y)
+                    intent(c) faffine
+                    double precision, intent(c) :: a
+                    double precision dimension(m,k), intent(in) :: x
+                    integer, intent(c,hide), depend(x) :: m = shape(x,0)
+                    integer, intent(c,hide), depend(x) :: k = shape(x,1)
+                    double precision dimension(m,k), intent(out), &
+                        depend(m,k) :: y
+                end subroutine faffine
+                subroutine cumsum(x, n)
+                    intent(c) cumsum
+                    double precision dimension(n), intent(c,inout) :: x
+                    integer, intent(c,hide), depend(x) :: n = len(x)
+                end subroutine cumsum
+                function add(a, b) result (r)
+                    intent(c) add
+                    double precision, intent(c) :: a, b
+                    double precision :: r
+                end function add
+                function apply(fun, x) result (r)
+                    intent(c) apply
+                    use _test_batch__user__routines
+                    external fun
+                    double precision, intent(c) :: x
+                    double precision :: r
+                end function apply
+            end interface
+        end python module _test_batch
+        """)
+    source = textwrap.dedent("""\
+        void affine(double a, double *x, int m, int k, double *y) {
+            int i;
+            for (i = 0; i < m * k; i++)
+                y[i] = a * x[i] + i;
+        }
+        void faffine(double a, double *x, int m, int k, double *y) {
+            affine(a, x, m, k, y);
+        }
+        void cumsum(double *x, int n) {
+            int i;
+            for (i = 1; i < n; i++)
+                x[i] += x[i - 1];
+        }
+        double add(double a, double b) { return a + b; }
+        double apply(double (*fun)(double *), double x) { return fun(&x); }
+        """)
+
+    @pytest.mark.parametrize("order", ["C", "F"])
+    def test_module(self, order):
+        if not util.has_c_compiler():
+            pytest.skip("No C compiler available")
+        module = util.build_skel_module(self.signature, self.source,
+                                        "_test_batch", ["--batch"])
+        stack = np.arange(60.).reshape(5, 3, 4).copy(order)
+        for f in [module.affine, module.faffine]:
+            expected = np.array([f(2., x) for x in stack])
+            assert_array_equal(f.batch(2., stack), expected)
+        # The slices of intent(inout) arrays are written back to the stack
+        stack = stack[:, 0].copy(order)
+        expected = [x.copy() for x in stack]
+        for x in expected:
+            module.cumsum(x)
+        module.cumsum.batch(stack)
+        assert_array_equal(stack, expected)
+        assert not hasattr(module.add, "batch")
+        assert not hasattr(module.apply, "batch")
+
+
+UFUNCSRC = textwrap.dedent("""\
+    elemental function hyp(x, y)
+      real(8), intent(in) :: x, y
+      real(8) :: hyp
+      hyp = sqrt(x * x + y * y)
+    end function hyp
+    subroutine split(x, k, i, f)
+      real x, f
+      integer k, i
+      intent(out) i, f
+      i = int(x) * k
+      f = x - int(x)
+    end subroutine split
+    subroutine inc(x)
+      real, intent(inout) :: x
+      x = x + 1
+    end subroutine inc
+    function total(x, n)
+      integer n
+      real x(n), total
+      total = sum(x)
+    end function total
+    """)
+
+
+class TestUfunc:
+    def test_wrapper(self, tmp_path, monkeypatch, capsys):
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / "uf.f90").write_text(UFUNCSRC)
+        f2py2e.run_main(["--no-sig-cache", "-m", "uf", "uf.f90"])
+        assert "ufunc" not in (tmp_path / "ufmodule.c").read_text()
+        f2py2e.run_main(["--no-sig-cache", "-m", "uf", "uf.f90", "--ufunc"])
+        uf = (tmp_path / "ufmodule.c").read_text()
+        out = capsys.readouterr().out
+        assert 'Constructing ufunc "hyp.ufunc"' in out
+        assert 'No ufunc of "inc": argument x is intent(inout)' in out
+        assert 'No ufunc of "total": argument x is not a numeric scalar' \
+            in out
+        assert '#include "numpy/ufuncobject.h"' in uf
+        # The inputs are followed by the outputs, as in the wrapper
+        loop = uf.split("static void f2py_ufunc_uf_split(")[1]
+        assert ("        float x = *(float *)(capi_args[0] + capi_i * "
+                "capi_steps[0]);\n"
+                "        int k = *(int *)(capi_args[1] + capi_i * "
+                "capi_steps[1]);\n"
+                "        int i;\n"
+                "        float f;\n"
+                "        (*f2py_func)(&x,&k,&i,&f);\n"
+                "        *(int *)(capi_args[2] + capi_i * capi_steps[2]) "
+                "= i;\n"
+                "        *(float *)(capi_args[3] + capi_i * capi_steps[3]) "
+                "= f;\n") in loop
+        assert "static char types[] = {NPY_FLOAT,NPY_INT,NPY_INT," \
+            "NPY_FLOAT};" in uf
+        assert 'f2py_ufunc_addattr(m,"split",funcs,data,types,2,2,' \
+            'doc_f2py_ufunc_uf_split)' in uf
+        assert "static char types[] = {NPY_DOUBLE,NPY_DOUBLE," \
+            "NPY_DOUBLE};" in uf
+
+    def test_module(self):
+        if not util.has_c_compiler() or not util.has_f90_compiler():
+            pytest.skip("No C or Fortran 90 compiler available")
+        module = util.build_skel_module(UFUNCSRC, None, "_test_ufunc",
+                                        ["--ufunc"], suffix=".f90")
+        hyp = module.hyp.ufunc
+        assert isinstance(hyp, np.ufunc)
+        assert hyp(3., 4.) == 5.
+        x = np.linspace(0., 3., 8).reshape(2, 4)
+        y = np.arange(4.)
+        assert_array_equal(hyp(x, y), np.hypot(x, y))
+        out = np.full((2, 4), -1.)
+        ret = hyp(x, y, out=out, where=y > 1.)
+        assert ret is out
+        assert_array_equal(out, np.where(y > 1., np.hypot(x, y), -1.))
+        # The loops are those of the declared types, as the casts are safe
+        i, f = module.split.ufunc(np.float32([1.5, 2.25, 3.75]), np.intc(2))
+        assert i.dtype == np.intc and f.dtype == np.float32
+        assert_array_equal(i, [2, 4, 6])
+        assert_array_equal(f, [.5, .25, .75])
+        assert not hasattr(module.inc, "ufunc")
+        assert not hasattr(module.total, "ufunc")
+
+
+class TestCompile:
+    @pytest.mark.parametrize("args", [
+        ["--sig-cache-dir", "cache"], ["--no-sig-cache"], ["--jobs", "2"],
+        ["--shards", "2"], ["--release-gil=auto"],
+        ["--release-gil-shared=release"], ["--batch"], ["--ufunc"]])
+    def test_codegen_options(self, tmp_path, monkeypatch, args):
+        # -c generates the wrappers with the f2py of numpy
+        messages = []
+        monkeypatch.setattr(f2py2e, "errmess", messages.append)
+        monkeypatch.chdir(tmp_path)
+        (tmp_path / "multi.pyf").write_text(PYF)
+        monkeypatch.setattr(sys, "argv", ["f2py", "-c", *args, "multi.pyf"])
+        with pytest.raises(SystemExit) as exc:
+            f2py2e.main()
+        assert exc.value.code == 1
+        assert messages[0].startswith(
+            f"f2py options {args[0]} are not supported with -c")
+        assert os.listdir(tmp_path) == ["multi.pyf"]
@@ -28,6 +28,10 @@ from f2py_skel.stds.symbolic import (
     as_gt,
     as_le,
     as_ge,
+    cache_info,
+    clear_caches,
+    intern,
+    ExprWarning,
 )
 from . import util
 
@@ -492,3 +496,60 @@ class TestSymbolic(util.F2PyTest):
         assert (y(x) + x).polynomial_atoms() == {y(x), x}
         assert (y(x) * x[y]).polynomial_atoms() == {y(x), x[y]}
         assert (y(x)**x).polynomial_atoms() == {y(x)}
+
+    def test_caches(self):
+        clear_caches()
+        e = fromstring("2*n+1")
+        assert fromstring("2*n+1") is e
+        assert cache_info()["fromstring"].hits == 1
+        # parsed again for another language, yet the same instance
+        assert fromstring("2*n+1", language=Language.Fortran) is e
+        assert cache_info()["fromstring"].misses == 2
+
+        # identical subexpressions share storage
+        f = fromstring("f(n+1, n+1)")
+        assert f.data[1][0] is f.data[1][1]
+        assert intern(as_symbol("n") + 1) is f.data[1][0]
+
+        # normalized results are shared but integer and real
+        # coefficients are told apart
+        x = as_symbol("x")
+        assert normalize(x * 2) is normalize(x * 2)
+        assert str(x * 2) == "2 * x"
+        assert str(x * 2.0) == "2.0 * x"
+
+        # parsing that warns is not cached
+        for i in range(2):
+            with pytest.warns(ExprWarning):
+                fromstring("a b")
+
+        clear_caches()
+        assert all(info.currsize == 0 for info in cache_info().values())
+        assert fromstring("2*n+1") == e
+
+    def test_fromstring_unary_signs(self):
+        x = as_symbol("x")
+        for language in (Language.C, Language.Fortran):
+            assert fromstring("x + -1", language=language) == x - 1
+            assert fromstring("x - -1", language=language) == x + 1
+            assert fromstring("x*-2", language=language) == x * -2
+            assert fromstring("x * +2", language=language) == x * 2
+            assert fromstring("-x", language=language) == -x
+        assert fromstring("x**-1", language=Language.Fortran) == x ** -1
+
+    def test_fromstring_unsimplified(self):
+        n = as_symbol("n")
+
+        def f(s):
+            return fromstring(s, language=Language.Fortran, simplify=False)
+
+        assert fromstring("7/2*2", language=Language.Fortran) == as_number(7)
+        assert f("7/2*2") == as_apply(
+            ArithOp.MUL, as_apply(ArithOp.DIV, as_number(7), as_number(2)),
+            as_number(2))
+        assert f("n-n") == as_apply(ArithOp.SUB, n, n)
+        assert f("2**n") == as_apply(ArithOp.POW, as_number(2), n)
+        assert f("1.e-3") == fromstring("1.0e-3", language=Language.Fortran)
+        assert f(".true.") == as_symbol(".true.")
+        with pytest.raises(ValueError):
+            f("len(")
@@ -319,6 +319,75 @@ if __name__ == "__main__":
     return sys.modules[module_name]
 
 
+@_memoize
+def build_skel_module(signature, c_source, module_name, options=[],
+                      define_macros=[], suffix=".pyf"):
+    """
+    Build a module of a signature file and the C source of its routines
+    with the wrappers and the runtime of f2py_skel, and import it.
+
+    With a suffix other than ``.pyf``, the signature is a Fortran source
+    that is compiled with the module, and c_source may be None.
+
+    The modules of F2PyTest are built with ``f2py -c``, that is, with the
+    f2py of numpy.
+    """
+    code = "import sys; sys.path = %s; import f2py_skel; " "f2py_skel.main()" % repr(
+        sys.path)
+
+    d = tempfile.mkdtemp(dir=get_module_dir())
+    pyf = os.path.join(d, module_name + suffix)
+    with open(pyf, "w") as f:
+        f.write(signature)
+    sources = [pyf] if suffix != ".pyf" else []
+    if c_source is not None:
+        sources.append(os.path.join(d, module_name + "_routines.c"))
+        with open(sources[-1], "w") as f:
+            f.write(c_source)
+
+    # Generate the wrappers
+    cmd = [sys.executable, "-c", code, pyf, "--build-dir", d,
+           "--no-sig-cache"] + options
+    if suffix != ".pyf":
+        cmd += ["-m", module_name]
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                         stderr=subprocess.STDOUT)
+    out, err = p.communicate()
+    if p.returncode != 0:
+        raise RuntimeError("Running f2py failed: %s\n%s" %
+                           (cmd[3:], asstr(out)))
+    for fn in ["-f2pywrappers.f", "-f2pywrappers2.f90"]:
+        if os.path.isfile(os.path.join(d, module_name + fn)):
+            sources.append(os.path.join(d, module_name + fn))
+    # ... and the shards of the module, with --shards
+    sources = [os.path.join(d, module_name + "module.c")] + sorted(
+        os.path.join(d, fn) for fn in os.listdir(d)
+        if fn.startswith(module_name + "module_shard")) + sources
+    # The Fortran sources are built in a library, distutils would
+    # generate the wrappers of the extension again with the f2py of numpy
+    names = [os.path.basename(fn) for fn in sources]
+    fnames = [fn for fn in names if not fn.endswith(".c")]
+    libraries = []
+    config_code = ""
+    if fnames:
+        libraries = [module_name + "_fortran"]
+        config_code = f"""
+        config.add_library({libraries[0]!r}, sources={fnames!r})
+        """
+    names = [fn for fn in names if fn.endswith(".c")] + ["fortranobject.c"]
+    config_code = textwrap.dedent(config_code) + textwrap.dedent(f"""
+    config.add_extension({module_name!r},
+                         sources={names!r},
+                         libraries={libraries!r},
+                         define_macros={define_macros!r})
+    """)
+    src = sources + [
+        getpath("f2py_skel", "csrcs", "fortranobject.c"),
+        getpath("f2py_skel", "csrcs", "fortranobject.h"),
+    ]
+    return build_module_distutils(src, config_code, module_name)
+
+
 #
 # Unittest convenience
 #